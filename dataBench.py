@@ -0,0 +1,510 @@
+# dataBench.py - 迁移性能基准测试
+"""
+使用本地替身运行完整迁移流程并统计性能：
+  - 源库：SQLite文件（兼容pymysql游标接口）
+  - 目标库：记录插入的伪ClickHouse客户端
+
+用法：
+  python dataBench.py                    # 重复运行取中位数，与本机基线比较；退化时返回1，没有本机同参数的基线时返回2
+  python dataBench.py --save-baseline    # 运行并保存为本机的新基线（基线文件按机器保存）
+  python dataBench.py --rows 5000 --days 5 --workers 8
+"""
+import argparse
+import json
+import os
+import random
+import re
+import platform
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psutil
+from pytz import timezone
+
+# 基准测试不创建 dataWeb 模块级的迁移实例，也不接管本机的落盘目录
+os.environ.setdefault('MIGRATION_APP_DISABLED', '1')
+
+from dataWeb import DataMigrationApp, app, init_db, logger  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# 源列名中包含这些关键字的列按字符串生成
+STRING_HINTS = ('Name', 'name', 'Tag', 'Status', 'Type', 'Id', 'ASIN', 'SKU', 'Title', 'Brand', 'Url', 'Query',
+                'Keyword', 'Adgroup', 'Code', 'Currency', 'Size', 'Interval', 'Philips_ALL', '标签', '类型')
+# 源列名中包含这些关键字的列按整数生成
+INT_HINTS = ('Impression', 'Click', 'Order', 'Units', 'Purchases', 'Sale Units', 'Sale_Units', 'Video')
+
+
+class StageTimer:
+    """阶段耗时记录器"""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def time(self, stage: str):
+        timer = self
+
+        class _Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timer.record(stage, time.perf_counter() - self.start)
+
+        return _Timer()
+
+    def summary(self):
+        result = {}
+        with self.lock:
+            for stage, values in self.samples.items():
+                ordered = sorted(values)
+                result[stage] = {
+                    'count': len(ordered),
+                    'total_ms': round(sum(ordered) * 1000, 3),
+                    'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+                    'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+                    'max_ms': round(ordered[-1] * 1000, 3)
+                }
+        return result
+
+
+class SQLiteSourceCursor:
+    """MySQL游标替身"""
+
+    def __init__(self, cursor, stages: StageTimer):
+        self.cursor = cursor
+        self.stages = stages
+
+    def execute(self, sql, args=None):
+        if 'information_schema.columns' in sql:
+            # 结构发现：用PRAGMA模拟，源表列统一为text
+            self.cursor.execute(f"SELECT name, 'text' FROM pragma_table_info(?)", (args[1],))
+            return
+        if sql.startswith('SHOW INDEX FROM'):
+            # 索引发现：用pragma_index_list/pragma_index_info模拟SHOW INDEX的列，rowid视为主键
+            self.cursor.execute("SELECT 'PRIMARY' AS Key_name, 0 AS Non_unique, 1 AS Seq_in_index, "
+                                "'rowid' AS Column_name UNION ALL "
+                                'SELECT il.name, NOT il."unique", ii.seqno + 1, ii.name '
+                                'FROM pragma_index_list(?) il, pragma_index_info(il.name) ii',
+                                (sql.split('`')[1],))
+            return
+        sql = re.sub(r'FORCE INDEX \((`[^`]+`)\)', r'INDEXED BY \1', sql)
+        with self.stages.time('mysql_query'):
+            return self.cursor.execute(sql.replace('%s', '?'), args or ())
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def fetchmany(self, size):
+        with self.stages.time('mysql_fetch'):
+            return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        with self.stages.time('mysql_fetch'):
+            return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteSourceConnection:
+    """MySQL连接替身：基于SQLite文件"""
+
+    def __init__(self, path: str, stages: StageTimer, raw: bool = False):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if raw:
+            # 模拟 use_unicode=False：文本列返回bytes
+            self.conn.text_factory = bytes
+        self.stages = stages
+
+    def cursor(self, cursor_class=None):
+        return SQLiteSourceCursor(self.conn.cursor(), self.stages)
+
+    def ping(self, reconnect=True):
+        return True
+
+    def close(self):
+        self.conn.close()
+
+
+class _QueryResult:
+    def __init__(self, rows):
+        self.result_rows = rows
+
+
+class RecordingClickHouseClient:
+    """ClickHouse客户端替身：记录插入的行数与数据量"""
+
+    def __init__(self, schema: dict, recorder: 'InsertRecorder', stages: StageTimer):
+        self.schema = schema
+        self.recorder = recorder
+        self.stages = stages
+
+    def query(self, sql, parameters=None, **kwargs):
+        if 'system.columns' in sql:
+            return _QueryResult(list(self.schema[parameters['table']]))
+        return _QueryResult([])
+
+    def command(self, sql, *args, **kwargs):
+        self.recorder.commands.append(sql)
+
+    def insert(self, table, data, column_names=None, **kwargs):
+        with self.stages.time('clickhouse_insert'):
+            self.recorder.add(table, data)
+
+    def close(self):
+        pass
+
+
+class InsertRecorder:
+    """插入记录器（按目标表统计）"""
+
+    def __init__(self):
+        self.rows = {}
+        self.bytes = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def estimate_bytes(data) -> int:
+        """按ClickHouse Native格式粗略估算数据量"""
+        size = 0
+        for row in data:
+            for value in row:
+                if isinstance(value, str):
+                    size += len(value.encode('utf-8')) + 1
+                elif isinstance(value, bytes):
+                    size += len(value) + 1
+                elif value is None:
+                    size += 1
+                else:
+                    size += 8
+        return size
+
+    def add(self, table, data):
+        size = self.estimate_bytes(data)
+        with self.lock:
+            self.rows[table] = self.rows.get(table, 0) + len(data)
+            self.bytes[table] = self.bytes.get(table, 0) + size
+
+
+class OfflineMigrationApp(DataMigrationApp):
+    """不启用落盘缓冲的迁移应用（基准测试只读映射配置或使用本地替身，不接管本机的落盘目录）"""
+
+    def _init_spill(self):
+        self.spill = None
+
+
+class BenchMigrationApp(OfflineMigrationApp):
+    """使用本地替身的迁移应用"""
+
+    def __init__(self, source_path: str, schema: dict, stages: StageTimer, recorder: InsertRecorder, **kwargs):
+        self.source_path = source_path
+        self.schema = schema
+        self.stages = stages
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def _create_mysql_connection(self, profile: str = 'default', decoders=None):
+        return SQLiteSourceConnection(self.source_path, self.stages, raw=decoders is not None)
+
+    def _create_clickhouse_client(self):
+        return RecordingClickHouseClient(self.schema, self.recorder, self.stages)
+
+    def convert_rows(self, rows, converters):
+        with self.stages.time('convert'):
+            return super().convert_rows(rows, converters)
+
+    def update_table_status(self, *args, **kwargs):
+        with self.stages.time('sqlite_status'):
+            return super().update_table_status(*args, **kwargs)
+
+
+def column_kind(source_column: str, date_column: str) -> str:
+    """根据源列名推断合成数据类型"""
+    if source_column == date_column:
+        return 'date'
+    if any(hint in source_column for hint in STRING_HINTS):
+        return 'string'
+    if any(hint in source_column for hint in INT_HINTS):
+        return 'int'
+    return 'float'
+
+
+def build_schema(migration: DataMigrationApp) -> dict:
+    """按真实列映射生成目标表结构 {target_table: [(column, clickhouse_type)]}"""
+    type_map = {'date': 'Date', 'string': 'String', 'int': 'Int64', 'float': 'Nullable(Float64)'}
+    schema = {}
+    for target_table in migration.TARGET_TABLES:
+        date_column = migration.DATE_COLUMNS[target_table]
+        schema[target_table] = [(target, type_map[column_kind(source, date_column)])
+                                for source, target in migration.TABLE_COLUMNS[target_table].items()]
+    return schema
+
+
+def generate_source(path: str, migration: DataMigrationApp, rows_per_day: int, days: int, seed: int):
+    """生成合成源数据（SQLite文件）"""
+    rng = random.Random(seed)
+    today = datetime.now(timezone('Asia/Shanghai')).date()
+    dates = [(today - timedelta(days=day)).strftime('%Y-%m-%d') for day in range(days)]
+    conn = sqlite3.connect(path)
+
+    for source_table, target_table in zip(migration.SOURCE_TABLES, migration.TARGET_TABLES):
+        date_column = migration.DATE_COLUMNS[target_table]
+        source_columns = list(migration.TABLE_COLUMNS[target_table].keys())
+        kinds = [column_kind(column, date_column) for column in source_columns]
+        column_sql = ', '.join(f'`{column}`' for column in source_columns)
+        conn.execute(f"CREATE TABLE `{source_table}` ({column_sql})")
+        conn.execute(f"CREATE INDEX `idx_{source_table}_date` ON `{source_table}` (`{date_column}`)")
+
+        placeholders = ', '.join('?' for _ in source_columns)
+        for date_str in dates:
+            rows = []
+            for _ in range(rows_per_day):
+                row = []
+                for kind in kinds:
+                    if kind == 'date':
+                        row.append(date_str)
+                    elif kind == 'string':
+                        row.append(f"v{rng.randrange(100000):05d}-{rng.choice('abcdefgh') * rng.randint(4, 24)}")
+                    elif kind == 'int':
+                        row.append(rng.randrange(100000))
+                    else:
+                        row.append(None if rng.random() < 0.05 else round(rng.uniform(0, 10000), 4))
+                rows.append(row)
+            conn.executemany(f"INSERT INTO `{source_table}` VALUES ({placeholders})", rows)
+        conn.commit()
+
+    conn.close()
+
+
+def run_once(source_path: str, schema: dict, days: int, workers: int, batch_size: int,
+             read_mode: str, source_decode: str) -> dict:
+    """在已生成的源数据上运行一次迁移（按天重写，重复运行结果相同）"""
+    stages = StageTimer()
+    recorder = InsertRecorder()
+    migration = BenchMigrationApp(source_path, schema, stages, recorder, max_workers_per_table=workers)
+    migration.retry_delay_base = 0
+    migration.set_config('batch_size', batch_size)
+    migration.set_config('validation_enabled', False)
+    migration.set_config('trace_enabled', False)
+    migration.set_config('ods_query_days', days)
+    migration.set_config('other_tables_days', days)
+    migration.set_config('read_mode', read_mode)
+    migration.set_config('force_index', True)
+    migration.set_config('source_decode', source_decode)
+    for mapping in migration.TABLE_MAPPINGS.values():
+        # SQLite表没有主键列，用隐含的rowid分页
+        mapping.key_column = 'rowid'
+
+    process = psutil.Process()
+    peak_rss = [process.memory_info().rss]
+    sampling = threading.Event()
+
+    def sample_rss():
+        while not sampling.wait(0.02):
+            peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample_rss, name='RSSSampler', daemon=True)
+    sampler.start()
+
+    start = time.perf_counter()
+    result = migration.run_daily_migration_job()
+    elapsed = time.perf_counter() - start
+
+    sampling.set()
+    sampler.join()
+    peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+    migration.shutdown()
+
+    total_rows = sum(recorder.rows.values())
+    total_bytes = sum(recorder.bytes.values())
+    return {
+        'success': result['success'],
+        'elapsed_seconds': round(elapsed, 3),
+        'total_rows': total_rows,
+        'total_bytes': total_bytes,
+        'rows_per_sec': round(total_rows / elapsed, 1) if elapsed else 0,
+        'mb_per_sec': round(total_bytes / 1024 / 1024 / elapsed, 3) if elapsed else 0,
+        'peak_rss_mb': round(peak_rss[0] / 1024 / 1024, 1),
+        'tables': {table: {'rows': recorder.rows.get(table, 0),
+                           'mb': round(recorder.bytes.get(table, 0) / 1024 / 1024, 3)}
+                   for table in schema},
+        'stages': stages.summary()
+    }
+
+
+def run_benchmark(rows_per_day: int, days: int, workers: int, batch_size: int, seed: int,
+                  read_mode: str = 'stream', source_decode: str = 'default', repeat: int = 5) -> dict:
+    """生成一次源数据后重复运行repeat次迁移，吞吐取中位数，内存取各次峰值的最大值"""
+    work_dir = tempfile.mkdtemp(prefix='migration_bench_')
+    source_path = os.path.join(work_dir, 'source.db')
+    app.config['DATABASE'] = os.path.join(work_dir, 'migration.db')
+    init_db()
+    template = OfflineMigrationApp()
+    schema = build_schema(template)
+
+    logger.info(f"Generating synthetic source data in {source_path}")
+    generate_source(source_path, template, rows_per_day, days, seed)
+
+    runs = []
+    for run in range(repeat):
+        result = run_once(source_path, schema, days, workers, batch_size, read_mode, source_decode)
+        runs.append(result)
+        logger.info(f"Run {run + 1}/{repeat}: {result['rows_per_sec']} rows/s, {result['elapsed_seconds']}s")
+        if not result['success']:
+            break
+
+    ordered = sorted(runs, key=lambda item: item['rows_per_sec'])
+    median = ordered[len(ordered) // 2]
+    throughput = [item['rows_per_sec'] for item in runs]
+    return {
+        'params': {'rows_per_day': rows_per_day, 'days': days, 'workers': workers,
+                   'batch_size': batch_size, 'seed': seed, 'read_mode': read_mode,
+                   'source_decode': source_decode},
+        'success': all(item['success'] for item in runs),
+        'repeat': len(runs),
+        'elapsed_seconds': median['elapsed_seconds'],
+        'total_rows': median['total_rows'],
+        'total_mb': round(median['total_bytes'] / 1024 / 1024, 3),
+        'rows_per_sec': median['rows_per_sec'],
+        'mb_per_sec': median['mb_per_sec'],
+        # 各次吞吐的极差相对中位数的比例
+        'spread': round((max(throughput) - min(throughput)) / median['rows_per_sec'], 3)
+                  if median['rows_per_sec'] else 0,
+        'peak_rss_mb': max(item['peak_rss_mb'] for item in runs),
+        'tables': median['tables'],
+        'stages': median['stages']
+    }
+
+
+def machine_fingerprint() -> str:
+    """基线按机器区分：吞吐只与同一CPU型号、核数和Python版本下的参考运行比较"""
+    model = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            model = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), model)
+    except OSError:
+        pass
+    python = '.'.join(platform.python_version_tuple()[:2])
+    return f"{model} x{os.cpu_count()} / {platform.system()} / Python {python}"
+
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float) -> list:
+    """与同一机器的参考运行比较吞吐中位数与内存峰值，返回退化项列表"""
+    regressions = []
+    for key in ('rows_per_sec', 'mb_per_sec'):
+        if result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {result[key]} < baseline {baseline[key]} (-{tolerance:.0%})")
+    if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {result['peak_rss_mb']} > baseline {baseline['peak_rss_mb']} "
+                           f"(+{tolerance:.0%})")
+    return regressions
+
+
+def print_report(result: dict):
+    print("=" * 60)
+    print(f"Rows: {result['total_rows']}  Data: {result['total_mb']} MB  Elapsed: {result['elapsed_seconds']}s")
+    print(f"Throughput: {result['rows_per_sec']} rows/s  {result['mb_per_sec']} MB/s "
+          f"(median of {result['repeat']} runs, spread {result['spread']:.0%})")
+    print(f"Peak RSS: {result['peak_rss_mb']} MB")
+    print("-" * 60)
+    for table, stats in result['tables'].items():
+        print(f"{table:<24} rows={stats['rows']:<10} mb={stats['mb']}")
+    print("-" * 60)
+    print(f"{'stage':<20}{'count':>8}{'mean_ms':>12}{'p50_ms':>12}{'p95_ms':>12}{'max_ms':>12}")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<20}{stats['count']:>8}{stats['mean_ms']:>12}{stats['p50_ms']:>12}"
+              f"{stats['p95_ms']:>12}{stats['max_ms']:>12}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data migration benchmark')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per table per day')
+    parser.add_argument('--days', type=int, default=3, help='days per table')
+    parser.add_argument('--workers', type=int, default=4, help='workers per table')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5, help='migration runs, throughput is the median')
+    parser.add_argument('--read-mode', choices=['stream', 'keyset'], default='stream')
+    parser.add_argument('--source-decode', choices=['default', 'raw'], default='default')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    # 同一机器上各次调用的中位数相差可达约30%（共享主机的CPU抖动），容差需大于它
+    parser.add_argument('--tolerance', type=float, default=0.35, help='allowed regression ratio')
+    parser.add_argument('--output', help='write result JSON to file')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.rows, args.days, args.workers, args.batch_size, args.seed, args.read_mode,
+                           args.source_decode, max(args.repeat, 1))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+    if not result['success']:
+        print("Benchmark migration failed")
+        return 1
+
+    # 基线文件按机器保存参考运行，--save-baseline 只替换本机的条目
+    machine = machine_fingerprint()
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f).get('machines', {})
+
+    if args.save_baseline:
+        baselines[machine] = result
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machines': baselines}, f, indent=2, sort_keys=True)
+        print(f"Baseline for {machine} saved to {args.baseline}")
+        return 0
+
+    # 没有可比较的基线时不能算通过，避免首次运行、换机器或参数不同的运行悄悄跳过回归检查
+    baseline = baselines.get(machine)
+    if baseline is None:
+        print(f"WARNING: no baseline for this machine ({machine}) in {args.baseline}")
+        print("Run with --save-baseline on the unchanged tree first to record a reference")
+        return 2
+    if baseline.get('params') != result['params']:
+        differing = {key: (baseline.get('params', {}).get(key), value) for key, value in result['params'].items()
+                     if baseline.get('params', {}).get(key) != value}
+        print(f"WARNING: baseline parameters differ from this run (baseline, run): {differing}")
+        print("Rerun with the baseline parameters or save a new baseline with --save-baseline")
+        return 2
+
+    regressions = compare_with_baseline(result, baseline, args.tolerance)
+    if regressions:
+        print("Performance regression detected:")
+        for item in regressions:
+            print(f"  {item}")
+        return 1
+
+    print("No regression against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+# dataSim.py - 调度模拟器（trace离线回放）
+"""
+读取 migration.db 中记录的运行trace（trace_enabled），按不同的并发、批大小与优先级参数离线回放调度过程，
+预测总耗时（makespan）与内存峰值，在真实库上调整参数前先比较方案。
+
+模型：
+  - 每个任务的工作量 = 表的每行耗时 × 行数 + 每批固定开销 × 批次数 + 该任务的残差（保留重试等个体差异）。
+    每批固定开销只有在参与拟合的trace使用过不同批大小时才能估计，否则为0。
+  - 并发争用：任务实际耗时 = 工作量 × (1 + alpha × (同时运行任务数 - 1))，alpha由trace中任务耗时与平均并发拟合。
+  - 内存：基线RSS + 系数 × Σ运行中任务的 每行字节 × min(行数, 批大小)，系数用记录时的参数回放校准。
+  - 记录的总耗时与按记录参数回放的差值（任务之外的准备时间）作为固定偏移加到每个方案的预测上。
+
+用法：
+  python dataSim.py --list
+  python dataSim.py --trace 12                                   # 按记录时的参数回放（检验模型误差）
+  python dataSim.py --trace 12 --workers 4,8,16                  # 比较每表工作线程数
+  python dataSim.py --trace 12 --batch-size 5000,20000 --source-concurrency 0,8
+  python dataSim.py --trace 12 --table-workers ods_query=8 --priority ods_query=-1 --order largest
+  python dataSim.py --trace 12 --fit 10,11,12                    # 用多次运行拟合模型（不同批大小时可估计每批开销）
+"""
+import argparse
+import itertools
+import json
+import math
+import sqlite3
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_DB = 'migration.db'
+# 参与回放与拟合的任务状态（过期/收回的租约由重新执行的记录代替）
+REPLAY_STATUSES = ('success', 'failed', 'superseded')
+TASK_ORDERS = ('recent', 'oldest', 'largest')
+
+
+def load_traces(db_path: str) -> List[Dict[str, Any]]:
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('''
+        SELECT t.id, t.migration_id, t.start_time, t.duration_seconds, t.peak_rss, t.base_rss, COUNT(k.id) AS tasks,
+               SUM(k.rows) AS rows
+        FROM migration_traces t LEFT JOIN migration_trace_tasks k ON k.trace_id = t.id
+        GROUP BY t.id ORDER BY t.id DESC
+    ''').fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def load_trace(db_path: str, trace_id: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """读取trace及其任务记录（同一表同一天只保留最后一次执行）"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    trace = conn.execute('SELECT * FROM migration_traces WHERE id = ?', (trace_id,)).fetchone()
+    if trace is None:
+        raise ValueError(f"Trace {trace_id} not found in {db_path}")
+    trace = dict(trace)
+    trace['settings'] = json.loads(trace['settings'])
+    tasks = {}
+    for row in conn.execute('SELECT * FROM migration_trace_tasks WHERE trace_id = ? ORDER BY start_offset',
+                            (trace_id,)):
+        task = dict(row)
+        if task['status'] in REPLAY_STATUSES and task['duration']:
+            task['batch_size'] = trace['settings']['tables'].get(task['target_table'], {}).get(
+                'batch_size', trace['settings']['batch_size'])
+            tasks[(task['target_table'], task['task_date'])] = task
+    conn.close()
+    return trace, list(tasks.values())
+
+
+class CostModel:
+    """由trace拟合的任务耗时与内存模型"""
+
+    def __init__(self, tasks: List[Dict[str, Any]], replay: Optional[List[Dict[str, Any]]] = None):
+        """tasks 用于拟合（可合并多次运行），replay 为回放的任务（残差只取自回放的trace）"""
+        self.notes = []
+        self.alpha = self._fit_contention(tasks)
+        self.per_row, self.per_batch = self._fit_work(tasks)
+        self.residuals = {}
+        for task in replay or tasks:
+            work = self.normalized_work(task)
+            self.residuals[(task['target_table'], task['task_date'])] = work - self.base_work(
+                task['target_table'], task['rows'], task['batch_size'])
+        self.memory_factor = 1.0
+
+    def slowdown(self, running: float) -> float:
+        return 1.0 + self.alpha * max(running - 1.0, 0.0)
+
+    def normalized_work(self, task: Dict[str, Any]) -> float:
+        """去除并发争用后的任务工作量（单独运行时的耗时）"""
+        return task['duration'] / self.slowdown(task['concurrency'] or 1.0)
+
+    def _fit_contention(self, tasks: List[Dict[str, Any]]) -> float:
+        # 每行耗时按表中位数归一化后，对 (平均并发 - 1) 做线性回归：y = k × (1 + alpha × x)
+        by_table: Dict[str, List[float]] = {}
+        for task in tasks:
+            if task['rows']:
+                by_table.setdefault(task['target_table'], []).append(task['duration'] / task['rows'])
+        medians = {table: sorted(values)[len(values) // 2] for table, values in by_table.items()}
+        points = [((task['concurrency'] or 1.0) - 1.0, task['duration'] / task['rows'] / medians[task['target_table']])
+                  for task in tasks if task['rows'] and medians[task['target_table']] > 0]
+        slope, intercept = _linear_fit(points)
+        if slope is None or intercept <= 0:
+            self.notes.append("contention not identifiable (concurrency barely varied), alpha=0")
+            return 0.0
+        return max(slope / intercept, 0.0)
+
+    def _fit_work(self, tasks: List[Dict[str, Any]]) -> Tuple[Dict[str, float], float]:
+        # 每行工作量 = p(表) + q × 批次数/行数；表内去均值后合并回归q，不同批大小的trace越多越准
+        samples: Dict[str, List[Tuple[float, float]]] = {}
+        for task in tasks:
+            if task['rows']:
+                batches = task['batches'] or math.ceil(task['rows'] / task['batch_size'])
+                samples.setdefault(task['target_table'], []).append(
+                    (batches / task['rows'], self.normalized_work(task) / task['rows']))
+        means = {table: (sum(x for x, _ in points) / len(points), sum(y for _, y in points) / len(points))
+                 for table, points in samples.items()}
+        sxx = sxy = 0.0
+        for table, points in samples.items():
+            mean_x, mean_y = means[table]
+            for x, y in points:
+                sxx += (x - mean_x) ** 2
+                sxy += (x - mean_x) * (y - mean_y)
+        batch_sizes = {task['batch_size'] for task in tasks}
+        if len(batch_sizes) < 2 or sxx <= 0:
+            self.notes.append("per-batch overhead needs traces recorded with different batch sizes, assumed 0")
+            per_batch = 0.0
+        else:
+            per_batch = max(sxy / sxx, 0.0)
+        per_row = {table: max(mean_y - per_batch * mean_x, 0.0) for table, (mean_x, mean_y) in means.items()}
+        return per_row, per_batch
+
+    def base_work(self, table: str, rows: int, batch_size: int) -> float:
+        return self.per_row.get(table, 0.0) * rows + self.per_batch * math.ceil(rows / max(batch_size, 1))
+
+    def task_work(self, task: Dict[str, Any], batch_size: int) -> float:
+        residual = self.residuals.get((task['target_table'], task['task_date']), 0.0)
+        return max(self.base_work(task['target_table'], task['rows'], batch_size) + residual, 1e-6)
+
+    @staticmethod
+    def batch_memory(task: Dict[str, Any], batch_size: int) -> float:
+        if not task['rows']:
+            return 0.0
+        return task['bytes'] / task['rows'] * min(task['rows'], batch_size)
+
+
+def _linear_fit(points: List[Tuple[float, float]]) -> Tuple[Optional[float], float]:
+    if len(points) < 3:
+        return None, 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    if sxx < 1e-6:
+        return None, 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+    return slope, mean_y - slope * mean_x
+
+
+def simulate(tasks: List[Dict[str, Any]], model: CostModel, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """离散事件回放：每表固定工作线程按任务顺序取任务；源库并发上限满时按 (表priority, 到达顺序) 等待；
+    运行中的任务共享争用（processor sharing）"""
+    tables = settings['tables']
+    queues: Dict[str, List[Dict[str, Any]]] = {}
+    for task in tasks:
+        queues.setdefault(task['target_table'], []).append(task)
+    for table, queue in queues.items():
+        if settings['order'] == 'oldest':
+            queue.sort(key=lambda task: -task['priority'])
+        elif settings['order'] == 'largest':
+            queue.sort(key=lambda task: -task['rows'])
+        else:
+            queue.sort(key=lambda task: task['priority'])
+
+    idle = {table: tables[table]['workers'] for table in queues}
+    cap = settings['source_concurrency']
+    waiting: List[Tuple[int, int, Dict[str, Any]]] = []
+    running: List[Dict[str, Any]] = []
+    arrivals = itertools.count()
+    now = 0.0
+    peak_memory = 0.0
+    table_finish: Dict[str, float] = {}
+    busy_integral = 0.0
+
+    def dispatch():
+        for table, queue in queues.items():
+            while idle[table] and queue:
+                idle[table] -= 1
+                task = queue.pop(0)
+                waiting.append((tables[table]['priority'], next(arrivals), task))
+        waiting.sort(key=lambda item: (item[0], item[1]))
+        while waiting and (not cap or len(running) < cap):
+            task = waiting.pop(0)[2]
+            batch_size = tables[task['target_table']]['batch_size']
+            running.append({'task': task, 'remaining': model.task_work(task, batch_size),
+                            'memory': model.batch_memory(task, batch_size)})
+
+    dispatch()
+    while running:
+        factor = model.slowdown(len(running))
+        peak_memory = max(peak_memory, sum(item['memory'] for item in running))
+        step = min(item['remaining'] for item in running) * factor
+        busy_integral += len(running) * step
+        now += step
+        for item in running:
+            item['remaining'] -= step / factor
+        for item in [item for item in running if item['remaining'] <= 1e-9]:
+            running.remove(item)
+            table = item['task']['target_table']
+            idle[table] += 1
+            table_finish[table] = now
+        dispatch()
+
+    return {'makespan': now, 'peak_batch_bytes': peak_memory, 'table_finish': table_finish,
+            'mean_concurrency': busy_integral / now if now else 0.0}
+
+
+def recorded_settings(trace: Dict[str, Any], tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    recorded = trace['settings']
+    tables = {}
+    for table in {task['target_table'] for task in tasks}:
+        entry = recorded['tables'].get(table, {})
+        tables[table] = {'workers': entry.get('workers', recorded['workers_per_table']),
+                         'batch_size': entry.get('batch_size', recorded['batch_size']),
+                         'priority': entry.get('priority', 0)}
+    return {'tables': tables, 'source_concurrency': recorded.get('mysql_max_concurrency') or 0, 'order': 'recent'}
+
+
+def parse_list(value: Optional[str], cast) -> List[Any]:
+    return [cast(item) for item in value.split(',')] if value else [None]
+
+
+def parse_overrides(values: List[str], cast) -> Dict[str, Any]:
+    overrides = {}
+    for value in values or []:
+        table, _, setting = value.partition('=')
+        if not setting:
+            raise ValueError(f"Expected table=value, got {value!r}")
+        overrides[table] = cast(setting)
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migration scheduler simulator (trace replay)')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--list', action='store_true', help='list recorded traces')
+    parser.add_argument('--trace', type=int, help='trace id to replay (default: latest)')
+    parser.add_argument('--fit', help='comma separated trace ids used to fit the model (default: --trace)')
+    parser.add_argument('--workers', help='workers per table, comma separated values to compare')
+    parser.add_argument('--batch-size', help='batch size, comma separated values to compare')
+    parser.add_argument('--source-concurrency', help='MySQL max concurrent queries (0 = unlimited), comma separated')
+    parser.add_argument('--table-workers', action='append', help='per table workers, e.g. ods_query=8')
+    parser.add_argument('--priority', action='append', help='per table priority (lower first), e.g. ods_query=-1')
+    parser.add_argument('--order', choices=TASK_ORDERS, default='recent', help='task order within a table')
+    parser.add_argument('--output', help='write results JSON to file')
+    args = parser.parse_args()
+
+    traces = load_traces(args.db)
+    if args.list or not traces:
+        print(f"{'id':>6}  {'start_time':<28}{'seconds':>10}{'tasks':>8}{'rows':>12}{'peak_rss_mb':>13}")
+        for trace in traces:
+            print(f"{trace['id']:>6}  {str(trace['start_time']):<28}{trace['duration_seconds']:>10.1f}"
+                  f"{trace['tasks']:>8}{trace['rows'] or 0:>12}{(trace['peak_rss'] or 0) / 1048576:>13.1f}")
+        return 0 if traces else 1
+
+    trace, tasks = load_trace(args.db, args.trace or traces[0]['id'])
+    if not tasks:
+        print(f"Trace {trace['id']} has no completed tasks")
+        return 1
+    fit_tasks = list(tasks)
+    for trace_id in parse_list(args.fit, int):
+        if trace_id is not None and trace_id != trace['id']:
+            fit_tasks.extend(load_trace(args.db, trace_id)[1])
+    model = CostModel(fit_tasks, tasks)
+
+    # 按记录时的参数回放，校准内存系数并给出模型误差
+    baseline_settings = recorded_settings(trace, tasks)
+    baseline = simulate(tasks, model, baseline_settings)
+    if baseline['peak_batch_bytes'] > 0:
+        model.memory_factor = max((trace['peak_rss'] - trace['base_rss']) / baseline['peak_batch_bytes'], 0.0)
+
+    print("=" * 72)
+    print(f"Trace {trace['id']}: {len(tasks)} tasks, recorded makespan {trace['duration_seconds']:.1f}s, "
+          f"replayed {baseline['makespan']:.1f}s")
+    print(f"Model: contention alpha={model.alpha:.3f}, per-batch overhead={model.per_batch * 1000:.2f}ms, "
+          f"memory factor={model.memory_factor:.2f}")
+    for note in model.notes:
+        print(f"  note: {note}")
+    print("-" * 72)
+
+    table_workers = parse_overrides(args.table_workers, int)
+    priorities = parse_overrides(args.priority, int)
+    # 记录的总耗时包含任务之外的准备时间（结构检查等），作为固定偏移加到预测上
+    offset = trace['duration_seconds'] - baseline['makespan']
+    results = []
+    for workers, batch_size, concurrency in itertools.product(parse_list(args.workers, int),
+                                                              parse_list(args.batch_size, int),
+                                                              parse_list(args.source_concurrency, int)):
+        settings = json.loads(json.dumps(baseline_settings))
+        settings['order'] = args.order
+        if concurrency is not None:
+            settings['source_concurrency'] = concurrency
+        for table, entry in settings['tables'].items():
+            if workers is not None:
+                entry['workers'] = workers
+            if batch_size is not None:
+                entry['batch_size'] = batch_size
+            entry['workers'] = table_workers.get(table, entry['workers'])
+            entry['priority'] = priorities.get(table, entry['priority'])
+        result = simulate(tasks, model, settings)
+        results.append({
+            'workers': workers, 'batch_size': batch_size, 'source_concurrency': settings['source_concurrency'],
+            'makespan_seconds': round(max(result['makespan'] + offset, 0.0), 1),
+            'peak_rss_mb': round((trace['base_rss'] + model.memory_factor * result['peak_batch_bytes']) / 1048576, 1),
+            'mean_concurrency': round(result['mean_concurrency'], 1),
+            'tables': {table: round(max(seconds + offset, 0.0), 1) for table, seconds in result['table_finish'].items()}
+        })
+
+    print(f"{'workers':>8}{'batch_size':>12}{'src_conc':>10}{'makespan_s':>12}{'peak_rss_mb':>13}{'concurrency':>13}")
+    for result in sorted(results, key=lambda item: item['makespan_seconds']):
+        print(f"{result['workers'] or '-':>8}{result['batch_size'] or '-':>12}{result['source_concurrency'] or '-':>10}"
+              f"{result['makespan_seconds']:>12}{result['peak_rss_mb']:>13}{result['mean_concurrency']:>13}")
+    print("=" * 72)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'trace': trace['id'], 'alpha': model.alpha, 'per_batch': model.per_batch,
+                       'memory_factor': model.memory_factor, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
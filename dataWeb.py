@@ -1,10 +1,20 @@
 # app.py - Web界面
 import json
 import logging
-from datetime import datetime, timedelta
+import logging.handlers
+from datetime import datetime, timedelta, date
+from decimal import Decimal
 from typing import List, Dict, Tuple, Optional, Any
 import pymysql
 import clickhouse_connect
+from clickhouse_connect.driver.exceptions import OperationalError, DatabaseError
+from clickhouse_connect.driver.compression import get_compressor
+from clickhouse_connect.driver.insert import InsertContext
+from clickhouse_connect.driver.transform import NativeTransform
+from clickhouse_connect.driver.tools import insert_file
+from clickhouse_connect.driver.httputil import get_pool_manager
+from clickhouse_connect.driver.summary import QuerySummary
+from clickhouse_connect.datatypes.registry import get_from_name
 import re
 import time
 import tempfile
@@ -17,32 +27,131 @@ import psutil
 import gc
 from dataclasses import dataclass, field
 from threading import Lock, Semaphore, BoundedSemaphore, Event
-import schedule
 from pytz import timezone
 import sys
 import os
 import traceback
 import random
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext, closing
 import heapq
+import hashlib
+import zlib
+import cProfile
+import pstats
+import tracemalloc
+import io
+from collections import Counter, deque
+from bisect import bisect_left
 from functools import total_ordering
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash
 import atexit
 from werkzeug.middleware.proxy_fix import ProxyFix
 import sqlite3
 from pathlib import Path
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(process)d:%(threadName)s] [%(name)s] %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('data_migration.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+LOG_FORMAT = '%(asctime)s [%(process)d:%(threadName)s] [%(name)s] %(levelname)s - %(message)s'
+LOG_BUFFER_SIZE = 2000
+
+
+class JsonLineFormatter(logging.Formatter):
+    """结构化日志：每条记录一行JSON（异常堆栈已在入队时并入message）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogRingBuffer(logging.Handler):
+    """最近日志的内存环形缓冲：页面按序号增量读取，不再读日志文件"""
+
+    def __init__(self, capacity: int = LOG_BUFFER_SIZE):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.sequence = 0
+
+    def emit(self, record: logging.LogRecord):
+        # 只由QueueListener线程调用，序号无需额外加锁
+        self.sequence += 1
+        self.records.append({
+            'seq': self.sequence,
+            'time': datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        })
+
+    def since(self, after: int = 0, level: int = logging.NOTSET, limit: int = 500) -> List[Dict[str, Any]]:
+        entries = [entry for entry in list(self.records)
+                   if entry['seq'] > after and logging.getLevelName(entry['level']) >= level]
+        return entries[-limit:]
+
+
+class LogRateLimiter(logging.Filter):
+    """按调用位置限流：每个位置每 interval 秒最多 limit 条（WARNING以下），被丢弃的条数附在下一条输出中"""
+
+    def __init__(self, limit: int = 0, interval: float = 10.0):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._lock = Lock()
+        self._windows: Dict[Tuple[str, int], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.limit or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+# 工作线程只把记录放入队列，文件/控制台/环形缓冲的写入都在QueueListener线程中完成
+log_file_handler = logging.FileHandler('data_migration.log', encoding='utf-8')
+log_stream_handler = logging.StreamHandler()
+for _handler in (log_file_handler, log_stream_handler):
+    _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+log_buffer = LogRingBuffer()
+log_rate_limiter = LogRateLimiter()
+_log_queue_handler = logging.handlers.QueueHandler(Queue(-1))
+# 入队前只格式化消息本身（异常堆栈并入消息），时间/线程等由各输出端格式化
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_queue_handler.addFilter(log_rate_limiter)
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
+log_listener = logging.handlers.QueueListener(_log_queue_handler.queue, log_file_handler, log_stream_handler,
+                                              log_buffer, respect_handler_level=True)
+log_listener.start()
+# 最先注册、最后执行：其它退出处理的日志都能写出
+atexit.register(log_listener.stop)
 logger = logging.getLogger('DataMigrationApp')
 
+
+def configure_logging(json_lines: bool = False, rate_limit: int = 0, rate_interval: float = 10.0):
+    """运行时切换日志文件格式（文本/JSON Lines）与调用位置限流"""
+    log_file_handler.setFormatter(JsonLineFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    log_rate_limiter.limit = int(rate_limit or 0)
+    log_rate_limiter.interval = float(rate_interval)
+
 # Flask应用
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-in-production'  # 生产环境需要修改
@@ -92,27 +201,278 @@ def init_db():
             )
         ''')
 
+        # 创建运行trace表（dataSim.py 离线回放）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS migration_traces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                migration_id INTEGER,
+                start_time TIMESTAMP,
+                duration_seconds REAL,
+                settings TEXT,
+                base_rss INTEGER,
+                peak_rss INTEGER
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS migration_trace_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trace_id INTEGER,
+                target_table TEXT,
+                task_date TEXT,
+                priority INTEGER,
+                worker TEXT,
+                start_offset REAL,
+                duration REAL,
+                status TEXT,
+                attempts INTEGER,
+                rows INTEGER,
+                bytes INTEGER,
+                batches INTEGER,
+                read_seconds REAL,
+                convert_seconds REAL,
+                insert_seconds REAL,
+                stages TEXT,
+                concurrency REAL,
+                errors TEXT
+            )
+        ''')
+
+        # 旧库补充校验结果列
+        ensure_columns(cursor, 'table_status', {
+            'validation_status': 'TEXT',
+            'validation_detail': 'TEXT',
+            'validated_at': 'TIMESTAMP'
+        })
+
         db.commit()
 
 
+def ensure_columns(cursor, table_name: str, columns: Dict[str, str]):
+    """为已存在的SQLite表补充缺失列"""
+    cursor.execute(f'PRAGMA table_info({table_name})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column} {column_type}')
+
+
+# 线程本地的SQLite连接
+_db_local = threading.local()
+
+
 def get_db():
     """获取数据库连接"""
-    if not hasattr(threading.local(), 'db'):
-        threading.local().db = sqlite3.connect(app.config['DATABASE'])
-        threading.local().db.row_factory = sqlite3.Row
-    return threading.local().db
+    if not hasattr(_db_local, 'db'):
+        _db_local.db = sqlite3.connect(app.config['DATABASE'])
+        _db_local.db.row_factory = sqlite3.Row
+    return _db_local.db
 
 
 @app.teardown_appcontext
 def close_db(error):
     """关闭数据库连接"""
-    if hasattr(threading.local(), 'db'):
-        threading.local().db.close()
+    if hasattr(_db_local, 'db'):
+        _db_local.db.close()
+        del _db_local.db
 
 
 # 数据迁移应用
 migration_app = None
 
+# 表映射配置文件
+TABLE_MAPPINGS_FILE = os.environ.get('TABLE_MAPPINGS_FILE', str(Path(__file__).with_name('table_mappings.json')))
+# 落盘缓冲目录（只能通过环境变量修改，不接受 /api/config）
+SPILL_DIR = os.environ.get('SPILL_DIR', str(Path(__file__).with_name('spill')))
+
+# 传输模式：insert 逐批写入ClickHouse；file 先导出为本地文件再整文件导入；
+# pushdown 由ClickHouse通过mysql()表函数直接拉取（仅适用于无需转换的列重命名）
+TRANSFER_MODES = ('insert', 'file', 'pushdown', 'delta')
+# 源表读取方式：stream 单条查询流式读取；keyset 按主键范围分页（WHERE key > last ORDER BY key LIMIT n）
+READ_MODES = ('stream', 'keyset')
+# 可通过 /api/config 实时调整的源库限流配置
+SOURCE_LIMIT_KEYS = ('mysql_qps', 'mysql_rows_per_sec', 'mysql_max_concurrency',
+                     'mysql_backoff_lag_seconds', 'mysql_backoff_latency_seconds')
+# 源数据解码方式：default 使用pymysql默认解码（Decimal/str）；raw 字符串保持bytes直接写入String列，DECIMAL解码为float
+SOURCE_DECODE_MODES = ('default', 'raw')
+# 可通过 /api/config 实时调整的写入限流配置
+PARTS_THROTTLE_KEYS = ('parts_soft_ratio', 'parts_max_delay', 'parts_max_wait')
+# 可通过 /api/config 实时调整的日志配置
+LOG_KEYS = ('log_json', 'log_rate_limit', 'log_rate_interval')
+
+
+def parse_optimize_window(value: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """解析低峰窗口 'HH:MM-HH:MM'，返回 ((开始时, 分), (结束时, 分))；格式或时间不合法时抛出ValueError"""
+    start_text, end_text = str(value).split('-')
+    start = datetime.strptime(start_text.strip(), '%H:%M')
+    end = datetime.strptime(end_text.strip(), '%H:%M')
+    return (start.hour, start.minute), (end.hour, end.minute)
+
+
+def _decode_source_decimal(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('ascii')
+    return Decimal(value)
+
+
+def _decode_source_datetime(value):
+    try:
+        return datetime.fromisoformat(value.decode('ascii') if isinstance(value, (bytes, bytearray)) else value)
+    except ValueError:
+        # 零日期等非标准值交给pymysql原解码器处理
+        return pymysql.converters.convert_datetime(value)
+
+
+def _decode_source_date(value):
+    try:
+        return date.fromisoformat(value.decode('ascii') if isinstance(value, (bytes, bytearray)) else value)
+    except ValueError:
+        return pymysql.converters.convert_date(value)
+
+
+def _build_source_decoders(decimal) -> Dict[int, Any]:
+    """raw解码使用的pymysql conv映射（配合use_unicode=False，文本列保持bytes）
+
+    pymysql按键类型拆分conv：int键为解码器，类型键为参数编码器，因此以完整的 conversions 为底，
+    只传解码器会让 cursor.execute 的参数转义（如keyset分页的 key > %s）报 no default type converter。
+    """
+    FIELD_TYPE = pymysql.constants.FIELD_TYPE
+    decoders = dict(pymysql.converters.conversions)
+    decoders[FIELD_TYPE.DECIMAL] = decoders[FIELD_TYPE.NEWDECIMAL] = decimal
+    decoders[FIELD_TYPE.DATETIME] = decoders[FIELD_TYPE.TIMESTAMP] = _decode_source_datetime
+    decoders[FIELD_TYPE.DATE] = decoders[FIELD_TYPE.NEWDATE] = _decode_source_date
+    return decoders
+
+
+# 按目标表类型选择：目标表没有Decimal列时DECIMAL直接解码为float，否则保留Decimal
+SOURCE_DECODERS = {
+    'float': _build_source_decoders(float),
+    'decimal': _build_source_decoders(_decode_source_decimal)
+}
+
+
+class TaskCancelled(Exception):
+    """同一任务的另一次执行已提交，本次执行取消"""
+
+
+class TaskRace:
+    """任务的原执行与推测副本之间的提交竞争：先完成者提交，另一方取消。
+    推测副本获胜时需等待原执行进行中的写入结束，之后原执行不能再写入"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # None 尚未提交，False 原执行提交，True 推测副本提交
+        self.winner: Optional[bool] = None
+        self.speculated = False
+        self.inflight = 0
+        # 远程租约失效后双方都不能再写入或提交（已提交的一方也一样）
+        self.fenced = False
+
+    def cancelled(self, speculative: bool) -> bool:
+        return self.fenced or (self.winner is not None and self.winner != speculative)
+
+    def fence(self):
+        """租约失效：之后的写入抛出TaskCancelled，进行中的写入照常结束"""
+        with self.condition:
+            self.fenced = True
+
+    @contextmanager
+    def write(self, speculative: bool):
+        """写入目标表前登记，另一方已提交时抛出TaskCancelled"""
+        with self.condition:
+            if self.cancelled(speculative):
+                raise TaskCancelled()
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.inflight -= 1
+                self.condition.notify_all()
+
+    def claim(self, speculative: bool) -> bool:
+        """争取提交权，返回是否获胜（重复调用结果不变）"""
+        with self.condition:
+            if self.fenced:
+                return False
+            if self.winner is None:
+                self.winner = speculative
+                while speculative and self.inflight:
+                    self.condition.wait()
+            return self.winner == speculative
+
+
+class TaskLeases:
+    """远程工作节点持有的任务租约：到期未续约的租约由协调端收回，任务重新入队"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.leases: Dict[str, Dict[str, Any]] = {}
+        self.workers: Dict[str, Dict[str, Any]] = {}
+
+    def _worker(self, worker: str) -> Dict[str, Any]:
+        entry = self.workers.setdefault(worker, {'completed': 0, 'failed': 0, 'records': 0, 'expired': 0})
+        entry['last_seen'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return entry
+
+    def grant(self, worker: str, table_key: str, task: 'MigrationTask', ttl: float) -> str:
+        lease_id = f"{task.task_id}-{random.getrandbits(32):08x}"
+        with self.lock:
+            self._worker(worker)
+            self.leases[lease_id] = {'worker': worker, 'table_key': table_key, 'task': task, 'rows': 0,
+                                     'expires': time.monotonic() + ttl}
+        return lease_id
+
+    def renew(self, worker: str, rows: Dict[str, int], ttl: float) -> Tuple[List[Tuple['MigrationTask', int]], List[str]]:
+        """续约工作节点上报的租约，返回 ([(任务, 新增行数)], 已失效的租约)"""
+        added, lost = [], []
+        with self.lock:
+            self._worker(worker)
+            for lease_id, rows_done in rows.items():
+                lease = self.leases.get(lease_id)
+                if lease is None or lease['worker'] != worker:
+                    lost.append(lease_id)
+                    continue
+                lease['expires'] = time.monotonic() + ttl
+                added.append((lease['task'], max(int(rows_done) - lease['rows'], 0)))
+                lease['rows'] = max(int(rows_done), lease['rows'])
+        return added, lost
+
+    def release(self, worker: str, lease_id: str, records: int = 0, success: bool = True) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None or lease['worker'] != worker:
+                return None
+            del self.leases[lease_id]
+            entry = self._worker(worker)
+            entry['completed' if success else 'failed'] += 1
+            entry['records'] += records
+        return lease
+
+    def expired(self, grace: float = 0.0) -> List[Dict[str, Any]]:
+        """收回到期超过grace秒的租约（给失联的工作节点留出自行中止的时间）"""
+        now = time.monotonic()
+        with self.lock:
+            lapsed = [lease_id for lease_id, lease in self.leases.items() if lease['expires'] + grace < now]
+            leases = [self.leases.pop(lease_id) for lease_id in lapsed]
+            for lease in leases:
+                self.workers[lease['worker']]['expired'] += 1
+        return leases
+
+    def revoke_all(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            leases = list(self.leases.values())
+            self.leases.clear()
+        return leases
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'leases': [{'lease_id': lease_id, 'worker': lease['worker'], 'table': lease['task'].target_table,
+                            'date': lease['task'].date_str, 'rows': lease['rows']}
+                           for lease_id, lease in self.leases.items()],
+                'workers': {worker: dict(entry) for worker, entry in self.workers.items()}
+            }
+
 
 @dataclass(order=True)
 class MigrationTask:
@@ -136,17 +496,161 @@ class MigrationTask:
         self.date_str = date_str
         self.columns = columns
         self.table_index = table_index
+        # 本次执行是否有批次写入了落盘缓冲
+        self.spilled = False
+        # 文件传输模式下已导出的分片文件（重试时直接导入，不再查询MySQL）
+        self.exports: Dict[str, Dict[str, Any]] = {}
+        self.race = TaskRace()
+        self.speculative = False
+        # 持有该任务租约的远程工作节点（本地执行时为None）
+        self.worker: Optional[str] = None
+        self.trace = TaskTrace()
+
+    def speculate(self) -> 'MigrationTask':
+        """创建推测执行副本（与原任务共享提交竞争）"""
+        clone = MigrationTask(self.source_table, self.target_table, self.day, self.date_str, self.columns,
+                              task_id=self.task_id, priority=self.priority, table_index=self.table_index)
+        clone.race = self.race
+        clone.speculative = True
+        return clone
 
     def __repr__(self):
-        return f"MigrationTask(id={self.task_id}, priority={self.priority}, date={self.date_str}, table={self.target_table})"
+        suffix = ', speculative' if self.speculative else ''
+        return (f"MigrationTask(id={self.task_id}, priority={self.priority}, date={self.date_str}, "
+                f"table={self.target_table}{suffix})")
+
+
+@dataclass
+class SourceShard:
+    """源数据分片：连接配置名 + 源表名"""
+    profile: str
+    source_table: str
+
+
+@dataclass
+class TableMapping:
+    """单表迁移映射（来自映射配置文件）"""
+    source_table: str
+    target_table: str
+    columns: Dict[str, str]
+    partition_column: str
+    batch_size: Optional[int] = None
+    workers: Optional[int] = None
+    days: Optional[int] = None
+    priority: int = 0
+    enabled: bool = True
+    validation_columns: List[str] = field(default_factory=list)
+    validation_key: Optional[str] = None
+    shards: List[SourceShard] = field(default_factory=list)
+    transfer_mode: Optional[str] = None
+    insert_settings: Dict[str, Any] = field(default_factory=dict)
+    read_mode: Optional[str] = None
+    key_column: Optional[str] = None
+    # True 自动选择以分区列开头的索引，字符串为指定索引名
+    force_index: Any = None
+    source_decode: Optional[str] = None
+    # delta模式的行主键（默认取 validation.key，其次 key_column）
+    delta_key: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TableMapping':
+        for key in ('source_table', 'target_table', 'columns', 'partition_column'):
+            if not data.get(key):
+                raise ValueError(f"Table mapping missing '{key}': {data.get('target_table', data)}")
+        columns = data['columns']
+        if not isinstance(columns, dict):
+            raise ValueError(f"Table mapping columns must be an object: {data['target_table']}")
+        if data['partition_column'] not in columns:
+            raise ValueError(f"Partition column {data['partition_column']} is not mapped: {data['target_table']}")
+        for key in ('batch_size', 'workers', 'days'):
+            if data.get(key) is not None and int(data[key]) <= 0:
+                raise ValueError(f"Table mapping {key} must be positive: {data['target_table']}")
+        if data.get('transfer_mode') and data['transfer_mode'] not in TRANSFER_MODES:
+            raise ValueError(f"Unknown transfer_mode {data['transfer_mode']}: {data['target_table']}")
+        if data.get('read_mode') and data['read_mode'] not in READ_MODES:
+            raise ValueError(f"Unknown read_mode {data['read_mode']}: {data['target_table']}")
+        if data.get('source_decode') and data['source_decode'] not in SOURCE_DECODE_MODES:
+            raise ValueError(f"Unknown source_decode {data['source_decode']}: {data['target_table']}")
+        if not isinstance(data.get('insert_settings') or {}, dict):
+            raise ValueError(f"Table mapping insert_settings must be an object: {data['target_table']}")
+
+        validation = data.get('validation') or {}
+        # 未配置分片时只读默认连接
+        shards = [SourceShard(shard.get('source', 'default'), shard.get('source_table', data['source_table']))
+                  for shard in data.get('shards') or []]
+        return cls(
+            source_table=data['source_table'],
+            target_table=data['target_table'],
+            columns=dict(columns),
+            partition_column=data['partition_column'],
+            batch_size=data.get('batch_size'),
+            workers=data.get('workers'),
+            days=data.get('days'),
+            priority=int(data.get('priority', 0)),
+            enabled=bool(data.get('enabled', True)),
+            validation_columns=list(validation.get('columns', [])),
+            validation_key=validation.get('key'),
+            shards=shards or [SourceShard('default', data['source_table'])],
+            transfer_mode=data.get('transfer_mode'),
+            insert_settings=dict(data.get('insert_settings') or {}),
+            read_mode=data.get('read_mode'),
+            key_column=data.get('key_column'),
+            force_index=data.get('force_index'),
+            source_decode=data.get('source_decode'),
+            delta_key=data.get('delta_key')
+        )
+
+
+def read_mapping_file(path: str) -> Dict[str, Any]:
+    """读取JSON或YAML映射文件"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # 仅使用YAML映射文件时需要PyYAML
+            return yaml.safe_load(f) or {}
+        return json.load(f) or {}
+
+
+def resolve_mapping_file(path: str) -> str:
+    """校验通过API指定的映射文件路径：只允许应用目录（或默认映射文件所在目录）下的JSON/YAML文件"""
+    allowed = {Path(__file__).resolve().parent, Path(TABLE_MAPPINGS_FILE).resolve().parent}
+    candidate = Path(path)
+    if not candidate.is_absolute():
+        candidate = Path(__file__).resolve().parent / candidate
+    candidate = candidate.resolve()
+    if candidate.parent not in allowed:
+        raise ValueError(f"Mapping file must be in {', '.join(sorted(str(d) for d in allowed))}")
+    if candidate.suffix not in ('.json', '.yaml', '.yml'):
+        raise ValueError("Mapping file must be a .json, .yaml or .yml file")
+    if not candidate.is_file():
+        raise ValueError(f"Mapping file not found: {candidate}")
+    return str(candidate)
+
+
+def load_source_profiles(path: str) -> Dict[str, Dict[str, Any]]:
+    """加载额外的MySQL源连接配置（映射文件中的 sources 段）"""
+    return dict(read_mapping_file(path).get('sources') or {})
+
+
+def load_table_mappings(path: str) -> List[TableMapping]:
+    """从JSON或YAML文件加载表映射，按priority排序"""
+    data = read_mapping_file(path)
+    mappings = [TableMapping.from_dict(item) for item in data.get('tables', [])]
+    targets = [mapping.target_table for mapping in mappings]
+    duplicates = {target for target in targets if targets.count(target) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate target tables in mapping file: {sorted(duplicates)}")
+    if not mappings:
+        raise ValueError(f"No tables defined in mapping file: {path}")
+    return sorted(mappings, key=lambda mapping: mapping.priority)
 
 
 class ColumnDefinition:
     """列定义类"""
 
-    def __init__(self, name: str, data_type: str):
+    def __init__(self, name: str, data_type: str, source_name: Optional[str] = None):
         self.name = name
         self.type = data_type
+        self.source_name = source_name or name
 
     def get_name(self) -> str:
         return self.name
@@ -172,6 +676,1260 @@ class ThreadSafeCounter:
             return self.value
 
 
+class LatencyHistogram:
+    """延迟直方图（Prometheus累积桶）"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, seconds: float):
+        index = bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        """返回 (累积桶计数, 总数, 总和)"""
+        with self.lock:
+            counts = list(self.bucket_counts)
+            count, total = self.count, self.sum
+        cumulative = []
+        running = 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return cumulative, count, total
+
+
+class TaskTrace:
+    """单个任务的执行记录：各阶段累计耗时、行数/字节/批次、重试错误与运行期间的平均并发任务数"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.stages: Dict[str, float] = {}
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.attempts = 0
+        self.errors: List[str] = []
+        self.worker = None
+        self.start_offset = None
+        self.duration = None
+        self.status = None
+        # 运行期间 并发任务数 × 时间 的积分，结束时除以时长得到平均并发
+        self.busy = 0.0
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_batch(self, rows: int, nbytes: int):
+        with self.lock:
+            self.rows += rows
+            self.bytes += nbytes
+            self.batches += 1
+
+    def merge(self, data: Dict[str, Any]):
+        """合并远程工作节点上报的执行记录"""
+        with self.lock:
+            for stage, seconds in (data.get('stages') or {}).items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + float(seconds)
+            self.rows += int(data.get('rows') or 0)
+            self.bytes += int(data.get('bytes') or 0)
+            self.batches += int(data.get('batches') or 0)
+            self.attempts = max(self.attempts, int(data.get('attempts') or 0))
+            self.errors.extend(data.get('errors') or [])
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'stages': dict(self.stages), 'rows': self.rows, 'bytes': self.bytes, 'batches': self.batches,
+                    'attempts': self.attempts, 'errors': list(self.errors)}
+
+
+class TraceRecorder:
+    """一次迁移运行的任务trace：任务起止、并发与进程内存峰值，运行结束后写入migration.db"""
+
+    def __init__(self, settings: Dict[str, Any], rss_interval: float = 0.5):
+        self.lock = Lock()
+        self.settings = settings
+        self.started = time.monotonic()
+        self.process = psutil.Process()
+        self.base_rss = self.process.memory_info().rss
+        self.peak_rss = self.base_rss
+        self.tasks: List[Tuple['MigrationTask', TaskTrace]] = []
+        self.active: List[TaskTrace] = []
+        self._last_change = self.started
+        # 内存峰值出现在批次处理中间，只在任务起止时采样会偏低（dataSim 的 memory_factor 由它拟合）
+        self.rss_interval = rss_interval
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self._sample_loop, name="TraceMemory", daemon=True)
+        self.sampler.start()
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.rss_interval):
+            try:
+                with self.lock:
+                    self._sample_rss()
+            except psutil.Error as e:
+                logger.debug(f"Error sampling process memory: {str(e)}")
+                return
+
+    def stop(self):
+        """停止采样线程（运行结束时调用）"""
+        self.stop_event.set()
+        self.sampler.join(timeout=5)
+        with self.lock:
+            self._sample_rss()
+
+    def _advance(self, now: float):
+        running = len(self.active)
+        for trace in self.active:
+            trace.busy += running * (now - self._last_change)
+        self._last_change = now
+
+    def _sample_rss(self):
+        rss = self.process.memory_info().rss
+        if rss > self.peak_rss:
+            self.peak_rss = rss
+
+    def begin(self, task: 'MigrationTask', trace: TaskTrace, worker: str):
+        now = time.monotonic()
+        with self.lock:
+            self._advance(now)
+            trace.worker = worker
+            trace.start_offset = now - self.started
+            self.active.append(trace)
+            self.tasks.append((task, trace))
+            self._sample_rss()
+
+    def end(self, trace: TaskTrace, status: str):
+        now = time.monotonic()
+        with self.lock:
+            if trace not in self.active:
+                return
+            self._advance(now)
+            self.active.remove(trace)
+            trace.duration = now - self.started - trace.start_offset
+            trace.status = status
+            self._sample_rss()
+
+
+class MigrationMetrics:
+    """迁移指标：阶段延迟直方图 + 按表行数/字节计数"""
+
+    STAGES = ('mysql_query', 'mysql_fetch', 'convert', 'clickhouse_insert', 'spill', 'sqlite_status')
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.rows: Dict[str, ThreadSafeCounter] = {}
+        self.bytes: Dict[str, ThreadSafeCounter] = {}
+        self.lock = Lock()
+        # 当前线程正在执行的任务trace（阶段耗时与行数同时计入）
+        self.trace_local = threading.local()
+
+    def _histogram(self, stage: str, table: str) -> LatencyHistogram:
+        key = (stage, table)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def _counter(self, counters: Dict[str, ThreadSafeCounter], table: str) -> ThreadSafeCounter:
+        counter = counters.get(table)
+        if counter is None:
+            with self.lock:
+                counter = counters.setdefault(table, ThreadSafeCounter())
+        return counter
+
+    def observe(self, stage: str, table: str, seconds: float):
+        self._histogram(stage, table).observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str, table: str):
+        """阶段计时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._histogram(stage, table).observe(elapsed)
+            trace = getattr(self.trace_local, 'current', None)
+            if trace is not None:
+                trace.observe(stage, elapsed)
+
+    @contextmanager
+    def trace(self, task_trace: TaskTrace):
+        """在当前线程内把阶段耗时与行数计入任务trace（分片线程各自进入）"""
+        previous = getattr(self.trace_local, 'current', None)
+        self.trace_local.current = task_trace
+        try:
+            yield
+        finally:
+            self.trace_local.current = previous
+
+    def add_rows(self, table: str, rows: int, nbytes: int):
+        self._counter(self.rows, table).increment(rows)
+        self._counter(self.bytes, table).increment(nbytes)
+        trace = getattr(self.trace_local, 'current', None)
+        if trace is not None:
+            trace.add_batch(rows, nbytes)
+
+    @staticmethod
+    def estimate_batch_bytes(rows) -> int:
+        """按首行估算一批源数据的字节数（避免逐单元格计算）"""
+        if not rows:
+            return 0
+        row_bytes = 0
+        for value in rows[0]:
+            if isinstance(value, (str, bytes)):
+                row_bytes += len(value)
+            elif value is not None:
+                row_bytes += 8
+        return row_bytes * len(rows)
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """输出Prometheus文本格式"""
+        lines = [
+            '# HELP migration_stage_duration_seconds Migration stage latency',
+            '# TYPE migration_stage_duration_seconds histogram'
+        ]
+        for (stage, table), histogram in sorted(self.histograms.items()):
+            cumulative, count, total = histogram.snapshot()
+            labels = f'stage="{stage}",table="{table}"'
+            for bound, value in zip(LatencyHistogram.BUCKETS, cumulative):
+                lines.append(f'migration_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'migration_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative[-1]}')
+            lines.append(f'migration_stage_duration_seconds_sum{{{labels}}} {total}')
+            lines.append(f'migration_stage_duration_seconds_count{{{labels}}} {count}')
+
+        for name, counters, help_text in (('migration_rows_total', self.rows, 'Rows migrated per table'),
+                                          ('migration_bytes_total', self.bytes, 'Source bytes read per table')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for table, counter in sorted(counters.items()):
+                lines.append(f'{name}{{table="{table}"}} {counter.get()}')
+
+        for name, value in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class MigrationProfiler:
+    """在线性能剖析：cProfile（工作线程按批次启用）/ 采样（sys._current_frames）/ tracemalloc"""
+
+    MODES = ('cprofile', 'sampling')
+    MAX_SECONDS = 600
+
+    def __init__(self):
+        self.lock = Lock()
+        self.idle = threading.Condition(self.lock)
+        self.cprofile_active = False
+        self.running = False
+        self.session = None
+        self.result = None
+        self.profiles = []
+        self.in_flight = 0
+        self.skipped = 0
+
+    def start(self, mode: str = 'sampling', seconds: float = 30, interval: float = 0.01,
+              trace_memory: bool = True, top: int = 30) -> Dict[str, Any]:
+        """启动剖析会话（后台运行seconds秒）"""
+        if mode not in self.MODES:
+            return {"success": False, "message": f"Unknown profile mode: {mode}"}
+        seconds = max(1.0, min(float(seconds), self.MAX_SECONDS))
+
+        with self.lock:
+            if self.running:
+                return {"success": False, "message": "Profiling is already running"}
+            self.running = True
+            self.profiles = []
+            self.skipped = 0
+            self.result = None
+            self.session = {'mode': mode, 'seconds': seconds, 'interval': max(0.001, float(interval)),
+                            'trace_memory': trace_memory, 'top': int(top),
+                            'started_at': datetime.now().isoformat()}
+
+        thread = threading.Thread(target=self._run_session, name="Profiler", daemon=True)
+        thread.start()
+        return {"success": True, "message": f"{mode} profiling started for {seconds:.0f}s", "session": self.session}
+
+    @contextmanager
+    def scope(self):
+        """工作线程热路径钩子：cProfile会话期间剖析当前批次
+
+        同一时刻只剖析一个批次：Python 3.12+ 的 cProfile 基于 sys.monitoring，
+        并发 enable() 会抛 ValueError。其他线程的批次照常执行，只计入 skipped。
+        """
+        if not self.cprofile_active:
+            yield
+            return
+
+        with self.lock:
+            if self.in_flight:
+                self.skipped += 1
+                profile = None
+            else:
+                self.in_flight += 1
+                profile = cProfile.Profile()
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # 已有其他剖析器在运行（如外部 cProfile / 调试器）
+                with self.lock:
+                    self.skipped += 1
+                    self.in_flight -= 1
+                    self.idle.notify_all()
+                profile = None
+        if profile is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+                self.in_flight -= 1
+                self.idle.notify_all()
+
+    def _run_session(self):
+        session = self.session
+        started_tracing = False
+        stacks = None
+        try:
+            if session['trace_memory'] and not tracemalloc.is_tracing():
+                tracemalloc.start(1)
+                started_tracing = True
+
+            if session['mode'] == 'cprofile':
+                self.cprofile_active = True
+                time.sleep(session['seconds'])
+                self.cprofile_active = False
+                # 等待进行中的批次交回剖析结果
+                with self.lock:
+                    self.idle.wait_for(lambda: self.in_flight == 0, timeout=60)
+            else:
+                stacks = self._sample_stacks(session['seconds'], session['interval'])
+
+            result = {'session': session, 'finished_at': datetime.now().isoformat()}
+            if stacks is not None:
+                result['samples'] = sum(stacks.values())
+                result['collapsed'] = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+            else:
+                with self.lock:
+                    profiles = list(self.profiles)
+                    skipped = self.skipped
+                result['batches'] = len(profiles)
+                result['skipped_batches'] = skipped
+                result['stats'] = self._merge_profiles(profiles)
+                result['stats_text'] = self._format_stats(result['stats'], session['top'])
+
+            if tracemalloc.is_tracing():
+                result['allocations'] = self._top_allocations(session['top'])
+        except Exception as e:
+            logger.error(f"Profiler error: {str(e)}", exc_info=True)
+            result = {'session': session, 'error': str(e)}
+        finally:
+            self.cprofile_active = False
+            if started_tracing:
+                tracemalloc.stop()
+
+        with self.lock:
+            self.result = result
+            self.running = False
+
+    @staticmethod
+    def _sample_stacks(seconds: float, interval: float) -> Counter:
+        """按固定间隔采样所有线程调用栈，返回折叠栈计数"""
+        stacks = Counter()
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                thread_name = re.sub(r'_\d+$', '', names.get(ident, str(ident)))
+                stacks[';'.join([thread_name] + frames[::-1])] += 1
+            time.sleep(interval)
+        return stacks
+
+    @staticmethod
+    def _merge_profiles(profiles) -> Optional[pstats.Stats]:
+        stats = None
+        for profile in profiles:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    @staticmethod
+    def _format_stats(stats: Optional[pstats.Stats], top: int) -> str:
+        if stats is None:
+            return 'No batches were profiled'
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(top)
+        return stream.getvalue()
+
+    @staticmethod
+    def _top_allocations(top: int) -> List[Dict[str, Any]]:
+        snapshot = tracemalloc.take_snapshot()
+        allocations = []
+        for stat in snapshot.statistics('lineno')[:top]:
+            frame = stat.traceback[0]
+            allocations.append({'location': f"{frame.filename}:{frame.lineno}",
+                                'size_kb': round(stat.size / 1024, 1), 'count': stat.count})
+        return allocations
+
+    def get_result(self) -> Dict[str, Any]:
+        """获取剖析状态与结果（不含pstats对象）"""
+        with self.lock:
+            result = dict(self.result) if self.result else None
+            status = {'running': self.running, 'session': self.session}
+        if result:
+            result.pop('stats', None)
+        status['result'] = result
+        return status
+
+    def dump_pstats(self, path: str) -> bool:
+        """将cProfile结果写入pstats文件"""
+        with self.lock:
+            stats = self.result.get('stats') if self.result else None
+        if stats is None:
+            return False
+        stats.dump_stats(path)
+        return True
+
+
+class DayProgress:
+    """单表单天进度（只由执行该任务的工作线程写入，读取方直接读属性，无需加锁）"""
+
+    EWMA_ALPHA = 0.3
+
+    __slots__ = ('table', 'date_str', 'state', 'rows_done', 'rows_estimated', 'rows_per_sec',
+                 'started_at', 'finished_at', '_last_time', '_last_rows')
+
+    def __init__(self, table: str, date_str: str):
+        self.table = table
+        self.date_str = date_str
+        self.state = 'pending'
+        self.rows_done = 0
+        self.rows_estimated = None
+        self.rows_per_sec = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._last_time = None
+        self._last_rows = 0
+
+    def start(self):
+        now = time.monotonic()
+        self.state = 'running'
+        self.rows_done = 0
+        self.rows_per_sec = 0.0
+        self.started_at = now
+        self.finished_at = None
+        self._last_time = now
+        self._last_rows = 0
+
+    def add_rows(self, rows: int):
+        """批次完成后累计行数并更新指数加权速率"""
+        self.rows_done += rows
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            instant = (self.rows_done - self._last_rows) / elapsed
+            if self.rows_per_sec:
+                self.rows_per_sec = self.EWMA_ALPHA * instant + (1 - self.EWMA_ALPHA) * self.rows_per_sec
+            else:
+                self.rows_per_sec = instant
+            self._last_time = now
+            self._last_rows = self.rows_done
+
+    def finish(self, state: str):
+        self.finished_at = time.monotonic()
+        self.state = state
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'date': self.date_str,
+            'state': self.state,
+            'rows_done': self.rows_done,
+            'rows_estimated': self.rows_estimated,
+            'rows_per_sec': round(self.rows_per_sec, 1)
+        }
+
+
+class ProgressTracker:
+    """迁移进度模型：按表按天记录状态、行数、估算行数与吞吐，计算ETA"""
+
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str], DayProgress] = {}
+        self.tables: Dict[str, List[DayProgress]] = {}
+        self.table_started: Dict[str, float] = {}
+        self.seed_estimates: Dict[str, float] = {}
+
+    def reset(self, seed_estimates: Optional[Dict[str, float]] = None):
+        """新任务开始时重置（seed_estimates：上次运行的每天平均行数）"""
+        self.entries = {}
+        self.tables = {}
+        self.table_started = {}
+        self.seed_estimates = seed_estimates or {}
+
+    def register(self, table: str, date_str: str) -> DayProgress:
+        entry = DayProgress(table, date_str)
+        entry.rows_estimated = self.seed_estimates.get(table)
+        self.entries[(table, date_str)] = entry
+        self.tables.setdefault(table, []).append(entry)
+        self.table_started.setdefault(table, time.monotonic())
+        return entry
+
+    def get(self, table: str, date_str: str) -> Optional[DayProgress]:
+        return self.entries.get((table, date_str))
+
+    def _table_snapshot(self, table: str, entries: List[DayProgress]) -> Dict[str, Any]:
+        done = [entry for entry in entries if entry.state == 'success']
+        running = [entry for entry in entries if entry.state == 'running']
+        failed = [entry for entry in entries if entry.state == 'failed']
+        rows_done = sum(entry.rows_done for entry in entries)
+
+        # 已完成天的平均行数优先，其次使用上次运行的估算
+        if done:
+            per_day = sum(entry.rows_done for entry in done) / len(done)
+        else:
+            per_day = self.seed_estimates.get(table)
+
+        remaining_rows = None
+        if per_day is not None:
+            remaining_rows = 0.0
+            for entry in entries:
+                if entry.state in ('pending', 'running'):
+                    remaining_rows += max(per_day - entry.rows_done, 0)
+
+        # 运行中任务的EWMA速率之和；无运行任务时使用表平均速率
+        rows_per_sec = sum(entry.rows_per_sec for entry in running)
+        if not rows_per_sec:
+            elapsed = time.monotonic() - self.table_started.get(table, time.monotonic())
+            rows_per_sec = rows_done / elapsed if elapsed > 0 else 0.0
+
+        if remaining_rows is not None and not running and len(done) + len(failed) == len(entries):
+            eta = 0.0
+        elif remaining_rows is not None and rows_per_sec > 0:
+            eta = remaining_rows / rows_per_sec
+        else:
+            eta = None
+
+        return {
+            'days_total': len(entries),
+            'days_done': len(done),
+            'days_running': len(running),
+            'days_failed': len(failed),
+            'rows_done': rows_done,
+            'rows_estimated': round(rows_done + remaining_rows) if remaining_rows is not None else None,
+            'rows_per_sec': round(rows_per_sec, 1),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'days': [entry.to_dict() for entry in entries]
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """进度快照（供get_status使用）"""
+        tables = {table: self._table_snapshot(table, list(entries)) for table, entries in list(self.tables.items())}
+        etas = [info['eta_seconds'] for info in tables.values()]
+        return {
+            'tables': tables,
+            'rows_done': sum(info['rows_done'] for info in tables.values()),
+            'rows_per_sec': round(sum(info['rows_per_sec'] for info in tables.values()), 1),
+            # 表之间并行，整体ETA取最慢的表
+            'eta_seconds': max(etas) if etas and None not in etas else None
+        }
+
+
+class CronExpression:
+    """五段式cron表达式（分 时 日 月 周），支持 * , - / """
+
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = self.expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression (need 5 fields): {expression}")
+
+        parsed = [self._parse_field(value, low, high) for value, (low, high) in zip(fields, self.FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # 周日既可写0也可写7
+        if 7 in self.weekdays:
+            self.weekdays.discard(7)
+            self.weekdays.add(0)
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(value: str, low: int, high: int) -> set:
+        result = set()
+        for part in value.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step: {value}")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(item) for item in part.split('-', 1))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > (7 if high == 6 else high) or start > end:
+                raise ValueError(f"Cron field out of range: {value}")
+            result.update(range(start, end + 1, step))
+        return result
+
+    def _day_matches(self, value: datetime) -> bool:
+        # cron语义：日与周同时限定时满足其一即可
+        day_ok = value.day in self.days
+        weekday_ok = (value.isoweekday() % 7) in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_fire(self, after: datetime) -> datetime:
+        """返回严格晚于after的下一次触发时间（after为本地时区的naive时间）"""
+        value = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = value + timedelta(days=366 * 5)
+        while value <= limit:
+            if value.month not in self.months:
+                value = (value.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(value):
+                value = value.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if value.hour not in self.hours:
+                value = value.replace(minute=0) + timedelta(hours=1)
+                continue
+            if value.minute not in self.minutes:
+                value += timedelta(minutes=1)
+                continue
+            return value
+        raise ValueError(f"Cron expression never fires: {self.expression}")
+
+    def __repr__(self):
+        return f"CronExpression('{self.expression}')"
+
+
+class SchemaCache:
+    """表结构缓存：{(side, table): (加载时间, {列名: 类型})}，超过TTL后重新读取"""
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.entries: Dict[Tuple[str, str], Tuple[float, Dict[str, str]]] = {}
+        self.lock = Lock()
+
+    def get(self, side: str, table: str, loader) -> Dict[str, str]:
+        key = (side, table)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        columns = loader(table)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), columns)
+        return columns
+
+    def invalidate(self, table: Optional[str] = None):
+        with self.lock:
+            if table is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[1] == table]:
+                    del self.entries[key]
+
+
+class TokenBucket:
+    """令牌桶：rate为每秒令牌数（0表示不限速）；获取时先扣减（允许透支），再等待透支部分恢复"""
+
+    def __init__(self, rate: float = 0.0):
+        self.lock = Lock()
+        self.tokens = 0.0
+        self.configure(rate)
+
+    def configure(self, rate: float):
+        with self.lock:
+            self.rate = float(rate or 0)
+            # 最多积攒1秒的令牌
+            self.burst = max(self.rate, 1.0)
+            self.tokens = min(self.tokens, self.burst)
+            self.updated = time.monotonic()
+
+    def acquire(self, amount: float = 1.0, stop_event: Optional[Event] = None) -> float:
+        """获取令牌，返回等待的秒数"""
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            wait_seconds = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait_seconds > 0:
+            if stop_event is not None:
+                stop_event.wait(wait_seconds)
+            else:
+                time.sleep(wait_seconds)
+        return wait_seconds
+
+
+class SourceRateLimiter:
+    """MySQL源库全局限流：查询/秒与行/秒令牌桶 + 并发查询上限，复制延迟或查询延迟升高时按比例降速"""
+
+    MIN_FACTOR = 0.1
+
+    def __init__(self):
+        self.query_bucket = TokenBucket()
+        self.row_bucket = TokenBucket()
+        self.condition = threading.Condition()
+        self.active = 0
+        self.qps = 0.0
+        self.rows_per_sec = 0.0
+        self.max_concurrency = 0
+        self.lag_threshold = 30.0
+        self.latency_threshold = 10.0
+        # 降速系数（1为不降速）、查询延迟EWMA、最近一次复制延迟
+        self.factor = 1.0
+        self.latency: Optional[float] = None
+        self.lag: Optional[float] = None
+        self.throttled_seconds = 0.0
+
+    def configure(self, qps: float = 0, rows_per_sec: float = 0, max_concurrency: int = 0,
+                  lag_threshold: float = 30, latency_threshold: float = 10):
+        self.qps = float(qps or 0)
+        self.rows_per_sec = float(rows_per_sec or 0)
+        self.max_concurrency = int(max_concurrency or 0)
+        self.lag_threshold = float(lag_threshold or 0)
+        self.latency_threshold = float(latency_threshold or 0)
+        self._apply()
+
+    def _apply(self):
+        self.query_bucket.configure(self.qps * self.factor)
+        self.row_bucket.configure(self.rows_per_sec * self.factor)
+        with self.condition:
+            self.condition.notify_all()
+
+    def concurrency_limit(self) -> int:
+        if not self.max_concurrency:
+            return 0
+        return max(1, int(self.max_concurrency * self.factor))
+
+    @contextmanager
+    def query(self, stop_event: Optional[Event] = None):
+        """占用一个查询并发名额并获取一个查询令牌"""
+        with self.condition:
+            while self.concurrency_limit() and self.active >= self.concurrency_limit():
+                if stop_event is not None and stop_event.is_set():
+                    raise RuntimeError("Migration stopped")
+                self.condition.wait(1.0)
+            self.active += 1
+        try:
+            self.throttled_seconds += self.query_bucket.acquire(1, stop_event)
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def consume_rows(self, rows: int, stop_event: Optional[Event] = None):
+        self.throttled_seconds += self.row_bucket.acquire(rows, stop_event)
+
+    def observe_latency(self, seconds: float):
+        with self.condition:
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+    def update_backoff(self, lag: Optional[float]) -> float:
+        """根据复制延迟与查询延迟调整降速系数：过载时减半，恢复后逐步放开"""
+        self.lag = lag
+        overloaded = ((lag is not None and self.lag_threshold and lag > self.lag_threshold)
+                      or (self.latency is not None and self.latency_threshold
+                          and self.latency > self.latency_threshold))
+        factor = max(self.MIN_FACTOR, self.factor * 0.5) if overloaded else min(1.0, self.factor * 1.25)
+        if factor != self.factor:
+            logger.info(f"MySQL source throttle factor {self.factor:.2f} -> {factor:.2f} "
+                        f"(lag={lag}, latency={self.latency})")
+            self.factor = factor
+            self._apply()
+        return factor
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'qps': self.qps,
+            'rows_per_sec': self.rows_per_sec,
+            'max_concurrency': self.max_concurrency,
+            'active_queries': self.active,
+            'factor': round(self.factor, 3),
+            'replica_lag': self.lag,
+            'query_latency': round(self.latency, 3) if self.latency is not None else None,
+            'throttled_seconds': round(self.throttled_seconds, 3)
+        }
+
+
+class PartsThrottle:
+    """按目标表活跃part数对写入降速：单分区part数超过 parts_to_delay_insert × soft_ratio 后逐步加大延迟，
+    达到上限且仍有合并在进行时阻塞写入，等待合并追上"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.soft_ratio = 0.5
+        self.max_delay = 10.0
+        self.max_wait = 300.0
+        self.limit = 0
+        # 表名 -> {parts: 单分区最大活跃part数, merges: 进行中的合并数}
+        self.tables: Dict[str, Dict[str, int]] = {}
+        self.throttled_seconds = 0.0
+
+    def configure(self, soft_ratio: float = 0.5, max_delay: float = 10, max_wait: float = 300):
+        self.soft_ratio = min(max(float(soft_ratio), 0.0), 0.99)
+        self.max_delay = float(max_delay or 0)
+        self.max_wait = float(max_wait or 0)
+
+    def update(self, table: str, parts: int, merges: int, limit: Optional[int] = None):
+        with self.lock:
+            self.tables[table] = {'parts': int(parts), 'merges': int(merges)}
+            if limit:
+                self.limit = int(limit)
+
+    def report_too_many_parts(self, table: str):
+        """写入被ClickHouse拒绝（TOO_MANY_PARTS）时按已达上限处理，直到下次监控刷新"""
+        with self.lock:
+            state = self.tables.setdefault(table, {'parts': 0, 'merges': 1})
+            state['parts'] = max(state['parts'], self.limit)
+            state['merges'] = max(state['merges'], 1)
+
+    def delay(self, table: str) -> float:
+        """当前应延迟的秒数（按part数在软阈值与上限之间二次增长）"""
+        with self.lock:
+            state = self.tables.get(table)
+            limit = self.limit
+        if not state or not limit or not self.max_delay:
+            return 0.0
+        soft = limit * self.soft_ratio
+        if state['parts'] <= soft:
+            return 0.0
+        ratio = min(1.0, (state['parts'] - soft) / (limit - soft))
+        return self.max_delay * ratio * ratio
+
+    def blocked(self, table: str) -> bool:
+        with self.lock:
+            state = self.tables.get(table)
+            return bool(state and self.limit and state['parts'] >= self.limit and state['merges'] > 0)
+
+    def wait(self, table: str, stop_event: Optional[Event] = None) -> float:
+        """写入前等待，返回等待秒数"""
+        sleep = stop_event.wait if stop_event is not None else time.sleep
+        start = time.monotonic()
+        delay = self.delay(table)
+        if delay:
+            sleep(delay)
+        # 达到上限时等待合并把part数降下来（无合并进行时等待无益，交给ClickHouse自身的延迟写入）
+        blocked = False
+        while self.blocked(table) and time.monotonic() - start < self.max_wait:
+            blocked = True
+            if sleep(1.0):
+                break
+        waited = time.monotonic() - start if delay or blocked else 0.0
+        if waited:
+            with self.lock:
+                self.throttled_seconds += waited
+        return waited
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'soft_ratio': self.soft_ratio,
+                'tables': {table: dict(state) for table, state in self.tables.items()},
+                'throttled_seconds': round(self.throttled_seconds, 3)
+            }
+
+
+class BinlogEventSource:
+    """MySQL binlog行事件源（需要mysql-replication包），事件统一为
+    {table, type: insert/update/delete, rows: [{列名: 值}], log_file, log_pos, timestamp}，空闲心跳时产出None；
+    事务提交（XidEvent，非事务表为 QueryEvent COMMIT）产出 {type: commit, log_file, log_pos}，
+    其位置是下一个事务的起点，只有这里才能作为检查点恢复（事务中间的位置缺少前面的TableMapEvent）"""
+
+    def __init__(self, connection: Dict[str, Any], server_id: int, tables: List[str],
+                 log_file: Optional[str], log_pos: Optional[int], heartbeat: float):
+        from pymysqlreplication import BinLogStreamReader  # 仅CDC模式需要mysql-replication
+        from pymysqlreplication.event import HeartbeatLogEvent, QueryEvent, XidEvent
+        from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+        self.event_types = {WriteRowsEvent: 'insert', UpdateRowsEvent: 'update', DeleteRowsEvent: 'delete'}
+        self.xid_event, self.query_event = XidEvent, QueryEvent
+        self.stream = BinLogStreamReader(
+            connection_settings={'host': connection['host'], 'port': connection.get('port', 3306),
+                                 'user': connection['user'], 'passwd': connection['password']},
+            server_id=server_id,
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, XidEvent, QueryEvent, HeartbeatLogEvent],
+            only_schemas=[connection['database']],
+            only_tables=tables,
+            log_file=log_file,
+            log_pos=log_pos,
+            resume_stream=log_file is not None,
+            blocking=True,
+            slave_heartbeat=heartbeat
+        )
+
+    def __iter__(self):
+        for event in self.stream:
+            if isinstance(event, self.xid_event) or (isinstance(event, self.query_event)
+                                                      and event.query.strip().upper() == 'COMMIT'):
+                yield {'type': 'commit', 'log_file': self.stream.log_file, 'log_pos': self.stream.log_pos,
+                       'timestamp': event.timestamp}
+                continue
+            event_type = self.event_types.get(type(event))
+            if event_type is None:
+                yield None
+                continue
+            # 更新事件取变更后的行
+            rows = [row['after_values'] if event_type == 'update' else row['values'] for row in event.rows]
+            yield {'table': event.table, 'type': event_type, 'rows': rows, 'log_file': self.stream.log_file,
+                   'log_pos': self.stream.log_pos, 'timestamp': event.timestamp}
+
+    def close(self):
+        self.stream.close()
+
+
+class RecordedEventSource:
+    """录制的binlog事件流（JSON Lines，每行一个BinlogEventSource格式的事件），用于本地测试与回放"""
+
+    def __init__(self, path: str, log_file: Optional[str] = None, log_pos: Optional[int] = None):
+        self.path = path
+        # 检查点是某个事务提交后的位置，之后的事件都属于未提交完成的事务
+        self.checkpoint = (log_file, log_pos) if log_file else None
+        self.file = open(path, encoding='utf-8')
+
+    def __iter__(self):
+        for line in self.file:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            # 跳过检查点之前（含）的事件
+            if self.checkpoint and (event['log_file'], event['log_pos']) <= self.checkpoint:
+                continue
+            yield event
+
+    def close(self):
+        self.file.close()
+
+
+# 落盘缓冲压缩算法（按优先级排列，zstd/lz4为可选依赖）
+SPILL_CODECS = {}
+try:
+    import zstandard
+    SPILL_CODECS['zstd'] = (lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+                            lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+try:
+    import lz4.frame
+    SPILL_CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+SPILL_CODECS['zlib'] = (lambda data: zlib.compress(data, 1), zlib.decompress)
+
+# 落盘目录的进程间互斥（Windows上没有fcntl，不加锁）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 落盘缓冲的列编码：JSON不能表示的类型按列记录类型名并转为字符串（datetime是date的子类，须先判断）
+SPILL_VALUE_TYPES = (
+    ('datetime', datetime, datetime.isoformat, datetime.fromisoformat),
+    ('date', date, date.isoformat, date.fromisoformat),
+    ('decimal', Decimal, str, Decimal),
+    ('bytes', bytes, bytes.hex, bytes.fromhex),
+)
+
+
+def encode_spill_column(values: list) -> Tuple[str, list]:
+    """按列的首个非空值确定类型，返回 (类型名, 可JSON序列化的值列表)"""
+    sample = next((value for value in values if value is not None), None)
+    for name, value_type, encode, _ in SPILL_VALUE_TYPES:
+        if isinstance(sample, value_type):
+            return name, [None if value is None else encode(value) for value in values]
+    return 'json', values
+
+
+def decode_spill_column(kind: str, values: list) -> list:
+    if kind == 'json':
+        return values
+    decode = next(decode for name, _, _, decode in SPILL_VALUE_TYPES if name == kind)
+    return [None if value is None else decode(value) for value in values]
+
+
+class SpillBuffer:
+    """ClickHouse不可用时的本地落盘缓冲：每个批次按列压缩为一个文件，按写入顺序回灌"""
+
+    FORMAT = 'json-columns'
+
+    def __init__(self, directory: str, max_bytes: int, codec: Optional[str] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # 缓冲内容会被写入目标库，目录只允许本进程用户访问
+        info = self.directory.stat()
+        if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+            raise RuntimeError(f"Spill directory {self.directory} is owned by another user")
+        if info.st_mode & 0o077:
+            os.chmod(self.directory, 0o700)
+        # 同一目录只能由一个实例写入和回灌，否则两边会各自回灌同一批文件
+        self.lock_file = open(self.directory / '.lock', 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.lock_file.close()
+                raise RuntimeError(f"Spill directory {self.directory} is in use by another process")
+        self.max_bytes = max_bytes
+        self.codec = codec or next(iter(SPILL_CODECS))
+        if codec is None and self.codec == 'zlib':
+            logger.warning("Neither zstandard nor lz4 is installed, spill files are compressed with zlib "
+                           "(slower, larger); pip install zstandard")
+        self.lock = Lock()
+        # 回灌与丢弃互斥，写入不受影响
+        self.drain_lock = Lock()
+        self.target_down = False
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self.seq = 0
+        self._scan()
+
+    def _scan(self):
+        """加载上次运行遗留的缓冲文件"""
+        for path in self.directory.glob('*.tmp'):
+            path.unlink()
+        for path in sorted(self.directory.glob('*.spill')):
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+            if header.get('format') != self.FORMAT:
+                # 旧版本（pickle）的缓冲文件不再加载
+                logger.warning(f"Ignoring spill file {path.name} in unsupported format, renamed to .legacy")
+                os.replace(path, path.with_suffix('.legacy'))
+                continue
+            self.manifest[path.name] = header
+            self.seq = max(self.seq, int(path.stem))
+
+    def write(self, table: str, date_str: str, column_names: List[str], rows: List[list],
+              delete_first: bool = False) -> int:
+        """按列压缩写入一个批次，返回压缩后字节数"""
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in column_names]
+        encoded = [encode_spill_column(column) for column in columns]
+        compress = SPILL_CODECS[self.codec][0]
+        payload = compress(json.dumps({'types': [kind for kind, _ in encoded],
+                                       'columns': [values for _, values in encoded]}).encode('utf-8'))
+        header = {'table': table, 'date': date_str, 'columns': column_names, 'rows': len(rows),
+                  'codec': self.codec, 'format': self.FORMAT, 'delete_first': delete_first,
+                  'bytes': len(payload), 'created': time.time()}
+
+        with self.lock:
+            if self.pending_bytes() + len(payload) > self.max_bytes:
+                raise RuntimeError(f"Spill buffer full ({self.max_bytes} bytes)")
+            self.seq += 1
+            name = f"{self.seq:012d}.spill"
+
+        # 先写临时文件再改名，回灌线程不会读到半个文件
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(payload)
+        os.replace(f.name, self.directory / name)
+        with self.lock:
+            self.manifest[name] = header
+        return len(payload)
+
+    def read(self, name: str) -> Tuple[Dict[str, Any], List[list]]:
+        with open(self.directory / name, 'rb') as f:
+            header = json.loads(f.readline())
+            body = json.loads(SPILL_CODECS[header['codec']][1](f.read()))
+        columns = [decode_spill_column(kind, values) for kind, values in zip(body['types'], body['columns'])]
+        return header, columns
+
+    def pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self.lock:
+            return sorted(self.manifest.items())
+
+    def close(self):
+        """释放目录锁"""
+        self.lock_file.close()
+
+    def pending_bytes(self) -> int:
+        return sum(header['bytes'] for header in self.manifest.values())
+
+    def remove(self, name: str, suffix: Optional[str] = None):
+        """回灌完成后删除；指定suffix时改名保留（如无法写入的批次）"""
+        with self.lock:
+            self.manifest.pop(name, None)
+        path = self.directory / name
+        if suffix:
+            os.replace(path, path.with_suffix(suffix))
+        elif path.exists():
+            path.unlink()
+
+    def discard(self, table: str, date_str: str) -> int:
+        """丢弃某表某天的缓冲（该天重新迁移时调用）"""
+        with self.drain_lock:
+            names = [name for name, header in self.pending()
+                     if header['table'] == table and header['date'] == date_str]
+            for name in names:
+                self.remove(name)
+        return len(names)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            headers = list(self.manifest.values())
+        return {
+            'directory': str(self.directory),
+            'codec': self.codec,
+            'target_down': self.target_down,
+            'files': len(headers),
+            'rows': sum(header['rows'] for header in headers),
+            'bytes': sum(header['bytes'] for header in headers),
+            'oldest': min((header['created'] for header in headers), default=None)
+        }
+
+
+class NativeExportWriter:
+    """按ClickHouse Native格式把批次逐列序列化写入本地文件
+
+    压缩按数据块进行：zstd/lz4 每块一个独立帧（文件为多帧拼接，ClickHouse按一个流解压），gzip/deflate 为一条流。
+
+    序列化借用 clickhouse_connect 的内部实现（InsertContext / NativeTransform 及 current_block 状态），
+    这些不是公开接口，行为按 0.7.x 编写（requirements.txt 固定为 0.7.3），其他版本需先核对后再放开检查。
+    """
+
+    fmt = 'Native'
+    SUPPORTED_CLIENT_VERSIONS = ('0.7.',)
+
+    def __init__(self, path: str, columns: List['ColumnDefinition'], compression: Optional[str] = 'zstd'):
+        client_version = clickhouse_connect.common.version()
+        if not client_version.startswith(self.SUPPORTED_CLIENT_VERSIONS):
+            raise RuntimeError(f"Native export relies on clickhouse_connect 0.7.x internals (found {client_version}), "
+                               f"use export_format Parquet")
+        self.path = path
+        self.compression = compression or None
+        self.column_names = [column.get_name() for column in columns]
+        self.column_types = [get_from_name(column.get_type()) for column in columns]
+        self.compressor = get_compressor(self.compression)
+        self.file = open(path, 'wb')
+
+    def write(self, data: List[list], column_names: List[str]):
+        context = InsertContext(self.path, self.column_names, self.column_types, data)
+        # 首块默认带 INSERT ... FORMAT Native 前缀，文件中只保留数据块
+        context.current_block = 1
+        for chunk in NativeTransform.build_insert(context):
+            if context.insert_exception is not None:
+                raise context.insert_exception
+            self.file.write(self.compressor.compress_block(chunk))
+
+    def close(self):
+        if self.file.closed:
+            return
+        footer = self.compressor.flush()
+        if footer:
+            self.file.write(footer)
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """按Parquet格式写入本地文件（每个批次一个row group，需要pyarrow）
+
+    Arrow schema按目标列的ClickHouse类型生成，不从首个批次推断（首批某列全为NULL时会推断成null类型，
+    后续批次写入失败）；没有写入任何行时不创建文件。
+    """
+
+    fmt = 'Parquet'
+    INT_TYPES = {'Int8': 'int8', 'Int16': 'int16', 'Int32': 'int32', 'Int64': 'int64',
+                 'UInt8': 'uint8', 'UInt16': 'uint16', 'UInt32': 'uint32', 'UInt64': 'uint64'}
+    DECIMAL_PRECISION = {'Decimal32': 9, 'Decimal64': 18, 'Decimal128': 38, 'Decimal256': 76}
+
+    def __init__(self, path: str, columns: List['ColumnDefinition'], compression: Optional[str] = 'zstd'):
+        import pyarrow  # 仅使用Parquet导出时需要pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.path = path
+        # Parquet自带列压缩，传输时不再额外压缩
+        self.compression = None
+        self.codec = compression or 'none'
+        self.column_names = [column.get_name() for column in columns]
+        self.schema = pyarrow.schema([(column.get_name(), self.arrow_type(column.get_type())) for column in columns])
+        self.writer = None
+
+    def arrow_type(self, column_type: str):
+        """ClickHouse列类型对应的Arrow类型（与build_converter的输出一致，未识别的类型按字符串写入）"""
+        pa = self.pyarrow
+        base_type = column_type
+        while base_type.startswith(('Nullable(', 'LowCardinality(')):
+            base_type = base_type[base_type.index('(') + 1:-1]
+        name, _, args = base_type.partition('(')
+        args = [arg.strip() for arg in args.rstrip(')').split(',')] if args else []
+        if name in self.INT_TYPES:
+            return getattr(pa, self.INT_TYPES[name])()
+        if name in ('Int128', 'Int256', 'UInt128', 'UInt256'):
+            return pa.decimal256(76, 0)
+        if name == 'Float32':
+            return pa.float32()
+        if name == 'Float64':
+            return pa.float64()
+        if name.startswith('Decimal'):
+            # Decimal(P, S) 或 Decimal32(S) 等
+            precision, scale = (int(args[0]), int(args[1])) if name == 'Decimal' else \
+                (self.DECIMAL_PRECISION[name], int(args[0]))
+            return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+        if name == 'DateTime64':
+            precision = int(args[0]) if args else 3
+            return pa.timestamp('ms' if precision <= 3 else 'us' if precision <= 6 else 'ns')
+        if name == 'DateTime':
+            return pa.timestamp('s')
+        if name in ('Date', 'Date32'):
+            return pa.date32()
+        if name == 'Bool':
+            return pa.bool_()
+        if name in ('String', 'FixedString'):
+            # raw解码时值为bytes，ClickHouse的String本身即字节串
+            return pa.binary()
+        return pa.string()
+
+    def write(self, data: List[list], column_names: List[str]):
+        if not data:
+            return
+        columns = dict(zip(self.column_names, (list(column) for column in zip(*data))))
+        table = self.pyarrow.Table.from_pydict(columns, schema=self.schema)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.codec)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+EXPORT_WRITERS = {'Native': NativeExportWriter, 'Parquet': ParquetExportWriter}
+
+
 class DataMigrationApp:
     def __init__(self, max_workers_per_table: int = 4, schedule_enabled: bool = False):
         # ClickHouse连接配置
@@ -201,120 +1959,61 @@ class DataMigrationApp:
             'write_timeout': 60
         }
 
-        # 表名映射
-        self.SOURCE_TABLES = ["ods_Query", "ods_campain", "ods_campaign_dsp", "ods_aws_asin_philips"]
-        self.TARGET_TABLES = ["ods_query", "ods_campain", "ods_campaign_dsp", "ods_aws_asin_philips"]
-
-        # 列名映射定义
-        self.ods_campain = ["Time", "Campaign Name", "Profile Name", "Portfolio Name", "Status", "Impression", "Click",
-                            "Spend", "CTR", "CPC", "CVR 14d", "ACOS 14d", "ROAS 14d", "Order 14d", "Sale Units 14d",
-                            "Sales 14d", "Campaign Type", "Campaign Tag", "DPV 14天", "活动Id"]
-        self.tods_campain = ["time", "campaign_name", "profile_name", "portfolio_name", "status", "impression", "click",
-                             "spend", "ctr", "cpc", "cvr14d", "acos14d", "roas14d", "order14d", "sale_units14d",
-                             "sales14d", "campaign_type", "campaign_tag", "dpv14d", "campaign_id"]
-
-        self.ods_campain_dsp = ["TimeColumn", "IntervalStart", "IntervalEnd", "EntityName", "EntityId",
-                                "AdvertiserName", "AdvertiserId", "CountryCode", "OrderName", "OrderId", "LineItemName",
-                                "LineItemId", "LineItemType", "CreativeName", "CreativeId", "CreativeSize",
-                                "Creative Tag", "Lineitem Tag", "Order Tag", "TotalCost", "Impressions",
-                                "ClickThroughs", "CTR", "ATC", "Purchases", "PercentOfPurchasesNewToBrand",
-                                "ConversionRate", "eCPM", "eCPC", "DPV", "DPVR", "eCPDPV", "ATCR", "PurchaseRate",
-                                "eCPP", "NewToBrandPurchases", "NewToBrandeCPP", "eCPATC", "UnitsSold", "TotalSales",
-                                "SalesUSD", "ProductSales", "ROAS", "TotalROAS", "TotalATC", "TotalUnitsSold",
-                                "TotalDPV", "TotalDPVR", "TotalPurchases", "TotalPurchaseRate", "TotaleCPP",
-                                "TotalNewToBrandPurchases", "TotalPercentOfPurchasesNewToBrand", "TotalProductSales",
-                                "TotalNewToBrandUnitsSold", "TotalNewToBrandProductSales", "TotalNewToBrandROAS",
-                                "TotalSnSS", "TotalSnSSRate", "TotalNewToBrandeCPP", "TotalNewToBrandPurchaseRate",
-                                "NTB Sales", "T-Pixel", "T-Pixel CPA", "T-Pixel CVR", "SnSSR", "NTBROAS",
-                                "ExchangeCode", "Video Start", "Video Complete", "PurchaseButton", "PurchaseButtonCPA",
-                                "PurchaseButtonCVR", "OffAmazonPurchases", "OffAmazonConversions", "OffAmazonCVR",
-                                "OffAmazonCPA", "OffAmazonProductSales", "OffAmazonUnitsSold", "OffAmazonROAS",
-                                "OffAmazoneRPM", "OffAmazonPurchasesRate", "OffAmazoneCPP", "CombinedPurchasesRate",
-                                "CombinedeCPP", "CombinedROAS", "CombinedeRPM", "CombinedPurchases",
-                                "CombinedUnitsSold", "CombinedProductSales", "BrandSearch", "BrandSearchsRate",
-                                "eCP Branded Search", "Original Currency", "Exchange Rate", "ATSC", "ATSC CVR",
-                                "ATSC CPA", "ATSC value sum", "ATSC value average", "Checkout", "Checkout CVR",
-                                "Checkout CPA", "Checkout value sum", "Checkout value average", "PageView",
-                                "PageView CVR", "PageView CPA", "PageView value sum", "PageView value average",
-                                "SignUp", "SignUp CVR", "SignUp CPA", "SignUp value sum", "SignUp value average",
-                                "Application", "Application CVR", "Application CPA", "Application value sum",
-                                "Application value average", "Contact", "Contact CVR", "Contact CPA",
-                                "Contact value sum", "Contact value average", "Lead", "Lead CVR", "Lead CPA",
-                                "Lead value sum", "Lead value average", "Search CVR", "Search CPA", "Search value sum",
-                                "Search", "Search value average", "TotaleCPDPV", "TotaleCPATC"]
-        self.tods_campain_dsp = ["time_column", "interval_start", "interval_end", "entity_name", "entity_id",
-                                 "advertiser_name", "advertiser_id", "country_code", "order_name", "order_id",
-                                 "line_item_name", "line_item_id", "line_item_type", "creative_name", "creative_id",
-                                 "creative_size", "creative_tag", "line_item_tag", "order_tag", "total_cost",
-                                 "impressions", "click_throughs", "ctr", "atc", "purchases",
-                                 "percent_of_purchases_new_to_brand", "conversion_rate", "ecpm", "ecpc", "dpv", "dpvr",
-                                 "ecpdpv", "atcr", "purchase_rate", "ecpp", "new_to_brand_purchases",
-                                 "new_to_brande_cpp", "ecpatc", "units_sold", "total_sales", "sales_usd",
-                                 "product_sales", "roas", "total_roas", "total_atc", "total_units_sold", "total_dpv",
-                                 "total_dpvr", "total_purchases", "total_purchase_rate", "total_ecpp",
-                                 "total_new_to_brand_purchases", "total_percent_of_purchases_new_to_brand",
-                                 "total_product_sales", "total_new_to_brand_units_sold",
-                                 "total_new_to_brand_product_sales", "total_new_to_brand_roas", "total_sn_ss",
-                                 "total_sn_ss_rate", "total_new_to_brande_cpp", "total_new_to_brand_purchase_rate",
-                                 "ntb_sales", "tpixel", "tpixel_cpa", "tpixel_cvr", "sn_ssr", "ntbroas",
-                                 "exchange_code", "video_start", "video_complete", "purchase_button",
-                                 "purchase_button_cpa", "purchase_button_cvr", "off_amazon_purchases",
-                                 "off_amazon_conversions", "Off_Amazon_CVR", "off_amazon_cpa",
-                                 "off_amazon_product_sales", "off_amazon_units_sold", "off_amazon_roas",
-                                 "off_amazon_erpm", "off_amazon_purchases_rate", "off_amazone_cpp",
-                                 "combined_purchases_rate", "combinede_cpp", "combined_roas", "combined_erpm",
-                                 "combined_purchases", "combined_units_sold", "combined_product_sales", "brand_search",
-                                 "brand_searchs_rate", "ecp_branded_search", "original_currency", "exchange_rate",
-                                 "atsc", "atsc_cvr", "atsc_cpa", "atsc_value_sum", "atsc_value_average", "checkout",
-                                 "checkout_cvr", "checkout_cpa", "checkout_value_sum", "checkout_value_average",
-                                 "pageview", "pageview_cvr", "pageview_cpa", "pageview_value_sum",
-                                 "pageview_value_average", "sign_up", "sign_up_cvr", "sign_up_cpa", "sign_up_value_sum",
-                                 "sign_up_value_average", "application", "application_cvr", "application_cpa",
-                                 "application_value_sum", "application_value_average", "contact", "contact_cvr",
-                                 "contact_cpa", "contact_value_sum", "contact_value_average", "lead", "lead_cvr",
-                                 "lead_cpa", "lead_value_sum", "lead_value_average", "search_cvr", "search_cpa",
-                                 "search_value_sum", "search", "search_value_average", "totale_cpdpv", "totale_cpatc"]
-
-        self.ods_aws_asin_philips = ["Time", "ASIN", "Profile_Name", "SKU", "Title", "Brand", "Image_Url", "Impression",
-                                     "Click", "Spend", "CTR", "CPC", "CVR_14d", "ACOS_14d", "ROAS_14d", "Order_14d",
-                                     "Sale_Units_14d", "Sales_14d", "ASIN_Tag", "Status", "Profile_Id", "Philips_ALL",
-                                     "CVR_1d", "CVR_7d", "CVR_30d", "ACOS_1d", "ACOS_7d", "ACOS_30d", "ROAS_1d",
-                                     "ROAS_7d", "ROAS_30d", "CPA_1d", "CPA_7d", "CPA_14d", "CPA_30d", "Order_1d",
-                                     "Order_7d", "Order_30d", "Sale_Units_1d", "Sale_Units_7d", "Sale_Units_30d",
-                                     "Sales_1d", "Sales_7d", "Sales_30d", "Orders_NTB_14d", "Orders_NTB_Percentage_14d",
-                                     "Order_Rate_NTB_14d", "Sales_NTB_14d", "Sales_NTB_Percentage_14d",
-                                     "Units_Ordered_NTB_14d", "SameSKU_Sales_1d", "SameSKU_Sales_7d",
-                                     "SameSKU_Sales_14d", "SameSKU_Sales_30d", "SameSKU_Orders_1d", "SameSKU_Orders_7d",
-                                     "SameSKU_Orders_14d", "SameSKU_Orders_30d", "SameSKU_Sale_Units_1d",
-                                     "SameSKU_Sale_Units_7d", "SameSKU_Sale_Units_14d", "SameSKU_Sale_Units_30d",
-                                     "Other_Sales_1d", "Other_Sales_7d", "Other_Sales_14d", "Other_Sales_30d",
-                                     "Kindle_Pages_Read_14d", "Kindle_Pages_Royalties_14d"]
-        self.tods_aws_asin_philips = ["time", "ASIN", "profile_name", "sku", "title", "brand", "image_url",
-                                      "impression", "click", "spend", "ctr", "cpc", "cvr14d", "acos14d", "roas14d",
-                                      "order14d", "sale_units14d", "sales14d", "asin_tag", "status", "profile_id",
-                                      "philips_all", "cvr1d", "cvr7d", "cvr30d", "acos1d", "acos7d", "acos30d",
-                                      "roas1d", "roas7d", "roas30d", "cpa1d", "cpa7d", "cpa14d", "cpa30d", "order1d",
-                                      "order7d", "order30d", "sale_units1d", "sale_units7d", "sale_units30d", "sales1d",
-                                      "sales7d", "sales30d", "orders_ntb14d", "orders_ntb_percentage14d",
-                                      "order_rate_ntb14d", "sales_ntb14d", "sales_ntb_percentage14d",
-                                      "units_ordered_ntb14d", "same_sku_sales1d", "same_sku_sales7d",
-                                      "same_sku_sales14d", "same_sku_sales30d", "same_sku_orders1d",
-                                      "same_sku_orders7d", "same_sku_orders14d", "same_sku_orders30d",
-                                      "same_sku_sale_units1d", "same_sku_sale_units7d", "same_sku_sale_units14d",
-                                      "same_sku_sale_units30d", "other_sales1d", "other_sales7d", "other_sales14d",
-                                      "other_sales30d", "kindle_pages_read14d", "kindle_pages_royalties14d"]
-
-        self.ods_query = ["Time", "Query", "Keyword Text", "Profile Name", "Current Bid", "Campaign Name", "Adgroup",
-                          "Impression", "Impression.rank", "Impression.share", "Click", "Spend", "CTR", "CPC",
-                          "CVR 14d", "ACOS 14d", "ROAS 14d", "Order 14d", "Sale Units 14d", "Sales 14d", "DPV 14天",
-                          "广告活动标签", "活动类型"]
-        self.tods_query = ["time", "query", "keyword_text", "profile_name", "current_bid", "campaign_name", "adgroup",
-                           "impression", "impression_rank", "impression_share", "click", "spend", "ctr", "cpc",
-                           "cvr14d", "acos14d", "roas14d", "order14d", "sale_units14d", "sales14d", "dpv14d",
-                           "campaign_tag", "activity_type"]
-
-        # 表列映射
+        # MySQL源连接配置（default 即 MYSQL_CONFIG，其余分片来自映射文件的 sources 段）
+        self.MYSQL_SOURCES = {'default': self.MYSQL_CONFIG}
+        self.source_limits: Dict[str, BoundedSemaphore] = {}
+        # 各源在ClickHouse端的named collection（pushdown使用，不属于pymysql连接参数）
+        self.source_collections: Dict[str, str] = {}
+        self.shard_executor = None
+
+        # ClickHouse不可用时的落盘缓冲与回灌线程
+        self.spill: Optional[SpillBuffer] = None
+        self.spill_thread = None
+        self.spill_stop = threading.Event()
+        self.spilled_records = ThreadSafeCounter()
+
+        # binlog增量同步（每个源连接一个线程）
+        self.cdc_threads: Dict[str, threading.Thread] = {}
+        self.cdc_target_tables: set = set()
+        self.cdc_stop = threading.Event()
+        self.cdc_stats: Dict[str, Dict[str, Any]] = {}
+
+        # 表映射配置文件
+        self.mapping_file = TABLE_MAPPINGS_FILE
+        self.TABLE_MAPPINGS: Dict[str, TableMapping] = {}
+
+        # 表列映射（由映射配置生成）
+        self.SOURCE_TABLES = []
+        self.TARGET_TABLES = []
         self.TABLE_COLUMNS = {}
+        self.DATE_COLUMNS = {}
+        self.VALIDATION_COLUMNS = {}
+        self.VALIDATION_KEYS = {}
+        self.SOURCE_BY_TARGET = {}
+        self.validation_results = {}
+        self.schema_cache = SchemaCache()
+        self.schema_reports = {}
+        self.slow_queries = deque(maxlen=200)
+        self.slow_query_count = ThreadSafeCounter()
+        # MySQL源库全局限流与延迟监控
+        self.source_limiter = SourceRateLimiter()
+        self.source_monitor_stop = threading.Event()
+        # 目标表part数写入限流与导入后的合并调度
+        self.parts_throttle = PartsThrottle()
+        self.parts_monitor_stop = threading.Event()
+        self.touched_days: Dict[str, set] = {}
+        self.optimize_thread = None
+        self.optimize_stop = threading.Event()
+        self.optimize_lock = Lock()
+        # 推测执行：每个表运行中的任务（按日期）与统计
+        self.running_tasks: Dict[str, Dict[str, MigrationTask]] = {}
+        self.speculated_tasks = ThreadSafeCounter()
+        self.speculation_wins = ThreadSafeCounter()
+        # 分布式模式：远程工作节点的任务租约
+        self.task_leases = TaskLeases()
+        self.lease_monitor_stop = threading.Event()
+        # 本次运行的任务trace（trace_enabled关闭时为None）
+        self.trace_recorder: Optional[TraceRecorder] = None
         self.queryCount = 0
 
         # 线程控制
@@ -323,6 +2022,9 @@ class DataMigrationApp:
         self.completed_tasks = ThreadSafeCounter()
         self.failed_tasks = ThreadSafeCounter()
         self.total_records = ThreadSafeCounter()
+        self.table_records = {}
+        self.metrics = MigrationMetrics()
+        self.profiler = MigrationProfiler()
 
         # 表任务队列
         self.table_queues = {}
@@ -334,25 +2036,31 @@ class DataMigrationApp:
         self.is_running = False
         self.current_job = None
         self.scheduler_thread = None
+        self.scheduler_stop = threading.Event()
+        self.scheduler_plans = {}
 
         # 停止标志
         self.shutdown_event = threading.Event()
 
-        # 连接池
+        # 连接池（ClickHouse客户端共享同一个HTTP keep-alive连接池）
         self.clickhouse_clients = {}
         self.mysql_connections = {}
         self.connection_lock = Lock()
+        # 任务结束时通知等待推测执行的空闲工作线程
+        self.task_finished = threading.Condition(self.connection_lock)
+        self.http_pool = None
 
         # 性能调优参数
         self.max_retries = 3
         self.retry_delay_base = 1
         self.lock_timeout = 30
+        self.batch_size = 10000
 
         # Web状态
         self.current_migration_id = None
         self.migration_start_time = None
         self.last_error = None
-        self.progress_info = {}
+        self.progress = ProgressTracker()
 
         # 初始化列映射
         self._init_table_columns()
@@ -362,49 +2070,215 @@ class DataMigrationApp:
 
         # 初始化默认配置
         self._init_default_config()
-
-    def _init_table_columns(self):
-        """初始化表列映射"""
-        # ods_campain
-        tc = {}
-        for i in range(len(self.ods_campain)):
-            tc[self.ods_campain[i]] = self.tods_campain[i]
-        self.TABLE_COLUMNS["ods_campain"] = tc
-
-        # ods_campaign_dsp
-        tc = {}
-        for i in range(len(self.ods_campain_dsp)):
-            tc[self.ods_campain_dsp[i]] = self.tods_campain_dsp[i]
-        self.TABLE_COLUMNS["ods_campaign_dsp"] = tc
-
-        # ods_aws_asin_philips
-        tc = {}
-        for i in range(len(self.ods_aws_asin_philips)):
-            tc[self.ods_aws_asin_philips[i]] = self.tods_aws_asin_philips[i]
-        self.TABLE_COLUMNS["ods_aws_asin_philips"] = tc
-
-        # ods_query
-        tc = {}
-        for i in range(len(self.ods_query):
-            tc[self.ods_query[i]] = self.tods_query[i]
-        self.TABLE_COLUMNS["ods_query"] = tc
+        self._configure_source_limiter()
+        self._configure_parts_throttle()
+        self._configure_logging()
+
+        # 初始化落盘缓冲（遗留的缓冲文件立即开始回灌）
+        self._init_spill()
+
+    def _init_source_profiles(self, profiles: Dict[str, Dict[str, Any]]):
+        """初始化MySQL源连接配置与各源并发上限；源的 replicas 列表展开为 源名@host:port 的只读副本"""
+        sources = {'default': self.MYSQL_CONFIG}
+        limits = {}
+        collections = {}
+        replica_sets = {}
+        for name, profile in profiles.items():
+            profile = dict(profile)
+            max_concurrency = profile.pop('max_concurrency', None)
+            replicas = profile.pop('replicas', None) or []
+            collection = profile.pop('clickhouse_named_collection', None)
+            if collection:
+                collections[name] = collection
+            # 未指定的连接参数沿用默认连接
+            sources[name] = {**self.MYSQL_CONFIG, **profile}
+            if max_concurrency:
+                limits[name] = BoundedSemaphore(int(max_concurrency))
+            for replica in replicas:
+                replica = dict(replica)
+                weight = float(replica.pop('weight', 1))
+                if weight <= 0:
+                    raise ValueError(f"Replica weight must be positive: {name} {replica.get('host')}")
+                replica_concurrency = replica.pop('max_concurrency', max_concurrency)
+                # 副本未指定的连接参数沿用所属的源
+                config = {**sources[name], **replica}
+                replica_name = f"{name}@{config['host']}:{config.get('port', 3306)}"
+                sources[replica_name] = config
+                if replica_concurrency:
+                    limits[replica_name] = BoundedSemaphore(int(replica_concurrency))
+                replica_sets.setdefault(name, []).append((replica_name, weight))
+        self.MYSQL_SOURCES = sources
+        self.source_limits = limits
+        self.source_collections = collections
+        self.SOURCE_REPLICAS = replica_sets
+        self.replica_health = {replica_name: {'healthy': None, 'lag': None, 'latency': None, 'error': None,
+                                              'checked_at': None, 'checking': False, 'active': 0, 'routed': 0}
+                               for replicas in replica_sets.values() for replica_name, _ in replicas}
+        # 各连接可用的复制状态语句（MySQL 8.4 移除了 SHOW SLAVE STATUS）与已告警过延迟未知的副本
+        self.replica_status_statements = {}
+        self.replica_lag_warned = set()
+
+    def _init_table_columns(self, mappings: Optional[List[TableMapping]] = None,
+                            profiles: Optional[Dict[str, Dict[str, Any]]] = None):
+        """根据映射配置初始化表列映射"""
+        if mappings is None:
+            mappings = load_table_mappings(self.mapping_file)
+            profiles = load_source_profiles(self.mapping_file)
+        mappings = [mapping for mapping in mappings if mapping.enabled]
+        self._init_source_profiles(profiles or {})
+
+        self.TABLE_MAPPINGS = {mapping.target_table: mapping for mapping in mappings}
+        self.SOURCE_TABLES = [mapping.source_table for mapping in mappings]
+        self.TARGET_TABLES = [mapping.target_table for mapping in mappings]
+        self.TABLE_COLUMNS = {mapping.target_table: mapping.columns for mapping in mappings}
+        self.DATE_COLUMNS = {mapping.target_table: mapping.partition_column for mapping in mappings}
+        self.VALIDATION_COLUMNS = {mapping.target_table: mapping.validation_columns for mapping in mappings}
+        self.VALIDATION_KEYS = {mapping.target_table: mapping.validation_key for mapping in mappings}
+        self.SOURCE_BY_TARGET = dict(zip(self.TARGET_TABLES, self.SOURCE_TABLES))
 
     def _init_table_queues(self):
         """初始化表队列"""
         for i in range(len(self.SOURCE_TABLES)):
             table_key = f"{self.SOURCE_TABLES[i]}_{self.TARGET_TABLES[i]}"
-            self.table_queues[table_key] = Queue()
+            if table_key not in self.table_queues:
+                self.table_queues[table_key] = Queue()
+
+    def reload_table_mappings(self, path: Optional[str] = None) -> Dict[str, Any]:
+        """热加载表映射配置（迁移运行中不允许）"""
+        if self.is_running:
+            return {"success": False, "message": "Cannot reload table mappings while migration is running"}
+        path = path or self.mapping_file
+        try:
+            mappings = load_table_mappings(path)
+            profiles = load_source_profiles(path)
+            for mapping in mappings:
+                for shard in mapping.shards:
+                    if shard.profile != 'default' and shard.profile not in profiles:
+                        raise ValueError(f"Unknown source '{shard.profile}' in {mapping.target_table}")
+        except Exception as e:
+            logger.error(f"Error loading table mappings from {path}: {str(e)}")
+            return {"success": False, "message": f"Invalid table mappings: {str(e)}"}
+
+        self.mapping_file = path
+        self.config['mapping_file'] = path
+        self._init_table_columns(mappings, profiles)
+        self._init_table_queues()
+        self.schema_cache.invalidate()
+        logger.info(f"Table mappings reloaded from {path}: {', '.join(self.TARGET_TABLES)}")
+        return {"success": True, "message": f"Loaded {len(self.TARGET_TABLES)} table mappings",
+                "tables": self.get_table_mappings()}
+
+    def get_table_mappings(self) -> List[Dict[str, Any]]:
+        """表映射摘要（不含列清单）"""
+        return [{'source_table': mapping.source_table, 'target_table': mapping.target_table,
+                 'partition_column': mapping.partition_column, 'columns': len(mapping.columns),
+                 'batch_size': mapping.batch_size, 'workers': mapping.workers,
+                 'days': self.get_table_days(mapping.target_table), 'priority': mapping.priority,
+                 'shards': [f"{shard.profile}:{shard.source_table}" for shard in mapping.shards],
+                 'transfer_mode': self.get_transfer_mode(mapping.target_table),
+                 'insert_settings': self.get_insert_settings(mapping.target_table),
+                 'read_mode': mapping.read_mode or self.get_config('read_mode', 'stream'),
+                 'source_decode': mapping.source_decode or self.get_config('source_decode', 'default'),
+                 'delta_key': mapping.delta_key}
+                for mapping in self.TABLE_MAPPINGS.values()]
 
     def _init_default_config(self):
         """初始化默认配置"""
         self.config = {
+            'mapping_file': self.mapping_file,
             'workers_per_table': self.max_workers_per_table,
             'lock_timeout': self.lock_timeout,
             'max_retries': self.max_retries,
+            'batch_size': self.batch_size,
             'ods_query_days': 24,
             'other_tables_days': 60,
             'schedule_enabled': self.schedule_enabled,
             'schedule_time': '09:00',
+            'shard_workers': 16,
+            'spill_enabled': True,
+            'spill_dir': SPILL_DIR,
+            'spill_max_bytes': 5 * 1024 ** 3,
+            'spill_drain_interval': 10,
+            # ClickHouse传输：请求压缩（lz4/zstd/gzip/false）、共享HTTP连接池大小、全局写入设置（表级insert_settings覆盖）
+            'clickhouse_compression': 'lz4',
+            'clickhouse_pool_size': 32,
+            'clickhouse_insert_settings': {},
+            'transfer_mode': 'insert',
+            # binlog增量同步：目标表需为 ReplacingMergeTree(版本列[, 删除标记列])
+            'cdc_tables': None,
+            'cdc_batch_size': 5000,
+            'cdc_flush_interval': 5,
+            'cdc_server_id': 4271,
+            'cdc_version_column': '_version',
+            'cdc_deleted_column': '_is_deleted',
+            # 设置后从录制的事件文件读取（本地测试）；cdc_record_file 把读到的binlog事件录制到文件
+            'cdc_event_file': None,
+            'cdc_record_file': None,
+            'pushdown_fallback': True,
+            # delta模式：按 CRC32(key) 分桶比较两端行哈希，只传输变化的行（版本列/删除标记列沿用cdc配置）
+            'delta_buckets': 256,
+            'delta_hash_column': '_row_hash',
+            'read_mode': 'stream',
+            'force_index': False,
+            'slow_query_seconds': 5.0,
+            'source_decode': 'default',
+            # MySQL源库全局限流（0表示不限），复制延迟/查询延迟超过阈值时自动降速
+            'mysql_qps': 0,
+            'mysql_rows_per_sec': 0,
+            'mysql_max_concurrency': 0,
+            'mysql_backoff_lag_seconds': 30,
+            'mysql_backoff_latency_seconds': 10,
+            'mysql_monitor_interval': 10,
+            # 目标表单分区活跃part数超过 parts_to_delay_insert × parts_soft_ratio 后写入逐步降速（parts_limit为0时读取服务端设置）
+            'parts_throttle_enabled': True,
+            'parts_limit': 0,
+            'parts_soft_ratio': 0.5,
+            'parts_max_delay': 10,
+            'parts_max_wait': 300,
+            'parts_monitor_interval': 5,
+            # 迁移写入过的分区在低峰窗口（schedule_timezone）内执行 OPTIMIZE TABLE ... PARTITION
+            'optimize_enabled': True,
+            'optimize_window': '02:00-06:00',
+            'optimize_final': False,
+            # 拖尾任务推测执行：运行时间超过本表已完成任务耗时的 speculation_percentile 分位 × speculation_multiplier
+            # （且不少于 speculation_min_seconds）时，由空闲工作线程启动副本，先完成者提交
+            'speculation_enabled': True,
+            'speculation_percentile': 0.5,
+            'speculation_multiplier': 2.0,
+            'speculation_min_seconds': 30,
+            'speculation_min_samples': 3,
+            # 只读副本路由：最近 replica_recent_days 天读主库；副本复制延迟超过 replica_max_lag 秒
+            # 或连接延迟超过 replica_max_latency 秒时不参与路由，健康状态每 replica_check_interval 秒刷新
+            'replica_routing_enabled': True,
+            'replica_recent_days': 2,
+            'replica_max_lag': 60,
+            'replica_max_latency': 1.0,
+            'replica_check_interval': 10,
+            # 远程工作节点的任务租约超过 worker_lease_ttl + worker_lease_grace 秒未续约即收回重新入队；
+            # 工作节点 ttl/2 内续约不成功就自行中止，其间留给进行中的写入结束，避免与重新执行的任务同时写入
+            'worker_lease_ttl': 60,
+            'worker_lease_grace': 30,
+            # 记录每次运行的任务trace（大小、各阶段耗时、错误）到migration.db，供 dataSim.py 离线回放；
+            # 进程内存峰值每 trace_rss_interval 秒采样一次
+            'trace_enabled': True,
+            'trace_rss_interval': 0.5,
+            # 日志文件写为JSON Lines；同一调用位置每 log_rate_interval 秒最多输出 log_rate_limit 条INFO/DEBUG（0为不限）
+            'log_json': False,
+            'log_rate_limit': 20,
+            'log_rate_interval': 10,
+            'export_format': 'Native',
+            'export_compression': 'zstd',
+            'export_dir': os.path.join(tempfile.gettempdir(), 'oceanwing_export'),
+            'export_keep_files': False,
+            'schema_cache_ttl': 3600,
+            'schema_auto_map': True,
+            'validation_enabled': True,
+            'validation_tolerance': 1e-6,
+            'validation_sample_rows': 200,
+            'schedule_timezone': 'Asia/Shanghai',
+            'schedule_catch_up': True,
+            # 为空时按 schedule_time 错峰生成，格式: [{name, tables, cron, days}]
+            'schedules': None,
             'auto_start': False
         }
 
@@ -423,97 +2297,2174 @@ class DataMigrationApp:
             self.lock_timeout = value
         elif key == 'max_retries':
             self.max_retries = value
+        elif key == 'batch_size':
+            self.batch_size = value
         elif key == 'schedule_enabled':
             self.schedule_enabled = value
+        elif key in ('spill_enabled', 'spill_dir'):
+            self._init_spill()
+        elif key == 'spill_max_bytes' and self.spill is not None:
+            self.spill.max_bytes = value
+        elif key in SOURCE_LIMIT_KEYS:
+            self._configure_source_limiter()
+        elif key in PARTS_THROTTLE_KEYS:
+            self._configure_parts_throttle()
+        elif key in LOG_KEYS:
+            self._configure_logging()
+        elif key in ('read_mode', 'force_index'):
+            # 读取计划随结构缓存一起重新生成
+            self.schema_cache.invalidate()
+        elif key == 'clickhouse_pool_size':
+            # 新建的客户端使用新连接池
+            self.http_pool = None
+
+    def _configure_logging(self):
+        configure_logging(json_lines=self.get_config('log_json', False),
+                          rate_limit=self.get_config('log_rate_limit', 20),
+                          rate_interval=self.get_config('log_rate_interval', 10))
+
+    def get_status(self):
+        """获取状态"""
+        return {
+            'is_running': self.is_running,
+            'current_migration_id': self.current_migration_id,
+            'migration_start_time': self.migration_start_time,
+            'last_error': self.last_error,
+            'total_records': self.total_records.get(),
+            'completed_tasks': self.completed_tasks.get(),
+            'failed_tasks': self.failed_tasks.get(),
+            'progress_info': self.progress.snapshot(),
+            'scheduler': self.get_scheduler_status(),
+            'schema_drift': [table for table, report in self.schema_reports.items() if report['drift']],
+            'spill': self.spill.stats() if self.spill else None,
+            'slow_queries': self.slow_query_count.get(),
+            'source_limiter': self.source_limiter.snapshot(),
+            'parts_throttle': self.parts_throttle.snapshot(),
+            'optimize_pending': self.get_optimize_pending(),
+            'speculation': {'started': self.speculated_tasks.get(), 'won': self.speculation_wins.get()},
+            'replicas': self.get_replica_status(),
+            'remote_workers': self.task_leases.snapshot(),
+            'cdc': self.cdc_stats,
+            'config': self.config
+        }
+
+    def save_migration_history(self, start_time, end_time, status, tables_migrated,
+                               total_records, error_message=None):
+        """保存迁移历史到数据库"""
+        try:
+            duration = (end_time - start_time).total_seconds() if end_time else 0
+
+            db = get_db()
+            cursor = db.cursor()
+            cursor.execute('''
+                INSERT INTO migration_history 
+                (start_time, end_time, status, tables_migrated, total_records, error_message, duration_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (start_time, end_time, status, tables_migrated, total_records, error_message, duration))
+            db.commit()
+
+            return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Error saving migration history: {str(e)}")
+            return None
+
+    def update_table_status(self, table_name, last_sync_time, records_count, status, last_error=None,
+                            validation=None):
+        """更新表状态"""
+        try:
+            with self.metrics.timer('sqlite_status', table_name):
+                db = get_db()
+                cursor = db.cursor()
+
+                # 检查是否已存在
+                cursor.execute('SELECT id FROM table_status WHERE table_name = ?', (table_name,))
+                existing = cursor.fetchone()
+
+                if existing:
+                    cursor.execute('''
+                        UPDATE table_status 
+                        SET last_sync_time = ?, records_count = ?, status = ?, last_error = ?
+                        WHERE table_name = ?
+                    ''', (last_sync_time, records_count, status, last_error, table_name))
+                else:
+                    cursor.execute('''
+                        INSERT INTO table_status (table_name, last_sync_time, records_count, status, last_error)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (table_name, last_sync_time, records_count, status, last_error))
+
+                if validation is not None:
+                    cursor.execute('''
+                        UPDATE table_status 
+                        SET validation_status = ?, validation_detail = ?, validated_at = ?
+                        WHERE table_name = ?
+                    ''', (validation['status'], json.dumps(validation, default=str), last_sync_time, table_name))
+
+                db.commit()
+        except Exception as e:
+            logger.error(f"Error updating table status: {str(e)}")
+
+    def get_migration_history(self, limit=50):
+        """获取迁移历史"""
+        try:
+            db = get_db()
+            cursor = db.cursor()
+            cursor.execute('''
+                SELECT * FROM migration_history 
+                ORDER BY start_time DESC 
+                LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting migration history: {str(e)}")
+            return []
+
+    def get_table_status(self):
+        """获取所有表状态"""
+        try:
+            db = get_db()
+            cursor = db.cursor()
+            cursor.execute('SELECT * FROM table_status ORDER BY table_name')
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting table status: {str(e)}")
+            return []
+
+    def get_progress_estimates(self) -> Dict[str, float]:
+        """根据上次同步记录估算各表每天行数"""
+        estimates = {}
+        for row in self.get_table_status():
+            if row['status'] == 'success' and row['records_count']:
+                estimates[row['table_name']] = row['records_count'] / self.get_table_days(row['table_name'])
+        return estimates
+
+    # ==================== 连接管理 ====================
+
+    def _create_clickhouse_client(self):
+        """创建ClickHouse客户端（请求压缩 + 共享keep-alive连接池）"""
+        return clickhouse_connect.get_client(**self.CLICKHOUSE_CONFIG,
+                                             compress=self.get_config('clickhouse_compression', 'lz4') or False,
+                                             pool_mgr=self.get_http_pool())
+
+    def get_http_pool(self):
+        """所有工作线程共享的HTTP连接池，大小需覆盖并发写入线程数，否则多出的连接用完即丢弃"""
+        pool = self.http_pool
+        if pool is None:
+            size = self.get_config('clickhouse_pool_size', 32)
+            pool = get_pool_manager(maxsize=size, num_pools=1, block=False,
+                                    verify=self.CLICKHOUSE_CONFIG.get('verify', True))
+            self.http_pool = pool
+        return pool
+
+    def get_insert_settings(self, target_table: str) -> Dict[str, Any]:
+        """表的写入设置（如 max_insert_block_size、insert_quorum）：表级配置覆盖全局配置"""
+        settings = dict(self.get_config('clickhouse_insert_settings') or {})
+        mapping = self.TABLE_MAPPINGS.get(target_table)
+        if mapping:
+            settings.update(mapping.insert_settings)
+        return settings
+
+    def _create_mysql_connection(self, profile: str = 'default', decoders: Optional[str] = None):
+        """创建MySQL连接；decoders为SOURCE_DECODERS的键时使用raw解码（文本列返回bytes）"""
+        config = self.MYSQL_SOURCES[profile]
+        if decoders:
+            config = dict(config, use_unicode=False, conv=SOURCE_DECODERS[decoders])
+        return pymysql.connect(**config)
+
+    def get_clickhouse_client(self):
+        """获取当前线程的ClickHouse客户端"""
+        key = threading.get_ident()
+        with self.connection_lock:
+            client = self.clickhouse_clients.get(key)
+        if client is None:
+            client = self._create_clickhouse_client()
+            with self.connection_lock:
+                self.clickhouse_clients[key] = client
+        return client
+
+    def get_mysql_connection(self, profile: str = 'default', decoders: Optional[str] = None):
+        """获取当前线程指定源的MySQL连接（raw解码使用单独的连接）"""
+        key = (profile, threading.get_ident(), decoders)
+        with self.connection_lock:
+            conn = self.mysql_connections.get(key)
+        if conn is None:
+            conn = self._create_mysql_connection(profile, decoders)
+            with self.connection_lock:
+                self.mysql_connections[key] = conn
+        return conn
+
+    def reset_thread_connections(self, mysql: bool = True):
+        """丢弃当前线程的连接（出错后重建）；mysql=False时只丢弃ClickHouse连接"""
+        ident = threading.get_ident()
+        with self.connection_lock:
+            resources = [self.clickhouse_clients.pop(ident, None)]
+            for key in [key for key in self.mysql_connections if mysql and key[1] == ident]:
+                resources.append(self.mysql_connections.pop(key))
+        for resource in resources:
+            if resource is not None:
+                try:
+                    resource.close()
+                except:
+                    pass
+
+    # ==================== 表结构发现 ====================
+
+    def _load_source_schema(self, source_table: str, profile: str = 'default') -> Dict[str, str]:
+        """从MySQL information_schema读取源表结构"""
+        conn = self.get_mysql_connection(profile)
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.columns
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
+                ORDER BY ORDINAL_POSITION
+            ''', (self.MYSQL_SOURCES[profile]['database'], source_table))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def _load_target_schema(self, target_table: str) -> Dict[str, str]:
+        """从ClickHouse system.columns读取目标表结构"""
+        client = self.get_clickhouse_client()
+        result = client.query(
+            "SELECT name, type FROM system.columns WHERE database = {database:String} AND table = {table:String} "
+            "ORDER BY position",
+            parameters={'database': self.CLICKHOUSE_CONFIG['database'], 'table': target_table}
+        )
+        return {row[0]: row[1] for row in result.result_rows}
+
+    @staticmethod
+    def _normalize_column_name(name: str) -> str:
+        return re.sub(r'[^0-9a-z]', '', name.lower())
+
+    def _diff_schema(self, side: str, table: str, columns: Dict[str, str]) -> Dict[str, Any]:
+        """与上次记录的结构快照比较，并保存新快照"""
+        key = f"schema_snapshot:{side}:{table}"
+        previous_json = self._load_config_value(key)
+        previous = json.loads(previous_json) if previous_json else None
+        current_json = json.dumps(columns, ensure_ascii=False)
+        if previous_json != current_json:
+            self._save_config_value(key, current_json)
+        if previous is None:
+            return {'added': [], 'removed': [], 'retyped': []}
+        return {
+            'added': [column for column in columns if column not in previous],
+            'removed': [column for column in previous if column not in columns],
+            'retyped': [{'column': column, 'old': previous[column], 'new': columns[column]}
+                        for column in columns if column in previous and previous[column] != columns[column]]
+        }
+
+    def check_schema(self, target_table: str) -> Dict[str, Any]:
+        """读取两端表结构，检测漂移并生成投影（源列 -> 目标列）"""
+        source_table = self.SOURCE_BY_TARGET[target_table]
+        # 分片结构一致，以第一个分片为准
+        shard = self.TABLE_MAPPINGS[target_table].shards[0]
+        source_columns = self.schema_cache.get(
+            'mysql', source_table, lambda table: self._load_source_schema(shard.source_table, shard.profile))
+        target_columns = self.schema_cache.get('clickhouse', target_table, self._load_target_schema)
+        mapping = self.TABLE_COLUMNS[target_table]
+
+        projection = {source: target for source, target in mapping.items()
+                      if source in source_columns and target in target_columns}
+
+        # 新增的上游列：目标表存在同名（忽略大小写与分隔符）列时自动映射
+        unmapped = [column for column in source_columns if column not in mapping]
+        auto_mapped = {}
+        if self.get_config('schema_auto_map', True):
+            mapped_targets = set(mapping.values())
+            target_by_normalized = {self._normalize_column_name(column): column for column in target_columns
+                                    if column not in mapped_targets}
+            for column in unmapped:
+                target = target_by_normalized.get(self._normalize_column_name(column))
+                if target:
+                    auto_mapped[column] = target
+            projection.update(auto_mapped)
+
+        report = {
+            'source_table': source_table,
+            'target_table': target_table,
+            'checked_at': datetime.now().isoformat(),
+            'source': self._diff_schema('mysql', source_table, source_columns),
+            'target': self._diff_schema('clickhouse', target_table, target_columns),
+            'mapping_missing_source': [column for column in mapping if column not in source_columns],
+            'mapping_missing_target': [target for target in mapping.values() if target not in target_columns],
+            'unmapped_source': [column for column in unmapped if column not in auto_mapped],
+            'auto_mapped': auto_mapped,
+            'projection_size': len(projection)
+        }
+        report['drift'] = bool(report['mapping_missing_source'] or report['mapping_missing_target']
+                               or report['unmapped_source'] or auto_mapped
+                               or any(report[side][kind] for side in ('source', 'target')
+                                      for kind in ('added', 'removed', 'retyped')))
+        if report['drift']:
+            logger.warning(f"Schema drift detected for {source_table} -> {target_table}: "
+                           f"{json.dumps(report, ensure_ascii=False)}")
+
+        self.schema_reports[target_table] = report
+        return {'report': report, 'projection': projection, 'target_columns': target_columns}
+
+    def get_table_columns(self, target_table: str) -> List[ColumnDefinition]:
+        """获取目标表列定义（按结构缓存生成的投影，带ClickHouse类型）"""
+        schema = self.check_schema(target_table)
+        target_columns = schema['target_columns']
+        return [ColumnDefinition(target, target_columns[target], source)
+                for source, target in schema['projection'].items()]
+
+
+    # ==================== 数据迁移 ====================
+
+    @staticmethod
+    def _default_value(base_type: str):
+        """非Nullable列的空值默认值"""
+        if base_type.startswith(('Int', 'UInt')):
+            return 0
+        if base_type.startswith('Float'):
+            return 0.0
+        if base_type.startswith('Decimal'):
+            return Decimal(0)
+        if base_type.startswith('DateTime'):
+            return datetime(1970, 1, 1)
+        if base_type.startswith('Date'):
+            return date(1970, 1, 1)
+        return ''
+
+    @staticmethod
+    def _parse_number(value):
+        """解析带千分位或百分号的数值字符串"""
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', errors='replace')
+        if isinstance(value, str):
+            value = value.strip().replace(',', '').rstrip('%')
+            if not value:
+                return None
+        return value
+
+    @staticmethod
+    def _parse_date_text(value) -> Optional[datetime]:
+        """解析日期/日期时间文本"""
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', errors='replace')
+        value = str(value).strip()
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value[:19] if len(value) >= 19 else value[:10])
+        except ValueError:
+            # 兼容未补零的日期（如 2024-1-5）
+            return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S' if len(value) >= 19 else '%Y-%m-%d')
+
+    def build_converter(self, column_type: str, raw: bool = False):
+        """根据ClickHouse列类型构建值转换函数；raw=True时String列输出bytes（配合raw解码）"""
+        nullable = column_type.startswith('Nullable(')
+        base_type = column_type[9:-1] if nullable else column_type
+        if base_type.startswith('LowCardinality('):
+            base_type = base_type[15:-1]
+        if base_type.startswith('Nullable('):
+            nullable = True
+            base_type = base_type[9:-1]
+        default = None if nullable else self._default_value(base_type)
+        parse_number = self._parse_number
+        parse_date_text = self._parse_date_text
+        # 驱动解码结果已是目标类型时直接透传
+        passthrough = ()
+
+        if base_type.startswith(('Int', 'UInt')):
+            passthrough = (int,)
+
+            def cast(value):
+                value = parse_number(value)
+                return None if value is None else int(float(value))
+        elif base_type.startswith('Float'):
+            passthrough = (float,)
+
+            def cast(value):
+                value = parse_number(value)
+                return None if value is None else float(value)
+        elif base_type.startswith('Decimal'):
+            passthrough = (Decimal,)
+
+            def cast(value):
+                value = parse_number(value)
+                return None if value is None else Decimal(str(value))
+        elif base_type.startswith('DateTime'):
+            passthrough = (datetime,)
+
+            def cast(value):
+                if isinstance(value, datetime):
+                    return value
+                if isinstance(value, date):
+                    return datetime(value.year, value.month, value.day)
+                return parse_date_text(value)
+        elif base_type.startswith('Date'):
+            passthrough = (date,)
+
+            def cast(value):
+                if isinstance(value, datetime):
+                    return value.date()
+                if isinstance(value, date):
+                    return value
+                value = parse_date_text(value)
+                return None if value is None else value.date()
+        elif base_type.startswith(('String', 'FixedString')) and raw:
+            # 同一列必须全部为bytes，clickhouse_connect按首个值决定是否编码
+            passthrough = (bytes,)
+            if default == '':
+                default = b''
+
+            def cast(value):
+                if isinstance(value, str):
+                    return value.encode('utf-8')
+                if isinstance(value, bytearray):
+                    return bytes(value)
+                return str(value).encode('utf-8')
+        elif base_type.startswith(('String', 'FixedString')):
+            passthrough = (str,)
+
+            def cast(value):
+                if isinstance(value, bytes):
+                    return value.decode('utf-8', errors='replace')
+                return str(value)
+        else:
+            def cast(value):
+                return value
+
+        def convert(value):
+            if value.__class__ in passthrough:
+                return value
+            if value is None:
+                return default
+            try:
+                result = cast(value)
+            except (ValueError, TypeError, ArithmeticError):
+                return default
+            return default if result is None else result
+
+        return convert
+
+    def get_source_decoders(self, target_table: str, columns: List[ColumnDefinition]) -> Optional[str]:
+        """表的源数据解码方式：None为pymysql默认解码，否则为SOURCE_DECODERS的键"""
+        mapping = self.TABLE_MAPPINGS[target_table]
+        if (mapping.source_decode or self.get_config('source_decode', 'default')) != 'raw':
+            return None
+        decimal = any('Decimal' in column.get_type() for column in columns)
+        return 'decimal' if decimal else 'float'
+
+    def convert_rows(self, rows, converters) -> List[list]:
+        """将一批MySQL行转换为ClickHouse插入数据"""
+        return [[convert(value) for convert, value in zip(converters, row)] for row in rows]
+
+    def migrate_task(self, task: MigrationTask) -> int:
+        """迁移单个表单天的数据（多分片时并行读取并写入同一天分区），返回迁移记录数"""
+        mode = self.get_transfer_mode(task.target_table)
+        if mode == 'file':
+            return self._migrate_task_via_files(task)
+        if mode == 'delta':
+            records = self._migrate_task_via_delta(task)
+            if records is not None:
+                return records
+        if mode == 'pushdown':
+            try:
+                return self._migrate_task_via_pushdown(task)
+            except OperationalError:
+                raise
+            except Exception as e:
+                # ClickHouse端无法拉取或转换失败时回退到本进程逐批迁移
+                if not self.get_config('pushdown_fallback', True):
+                    raise
+                logger.warning(f"{task} pushdown failed, falling back to insert mode: {str(e)}")
+
+        task.spilled = False
+        # 推测副本已提交时不能再清理目标日期
+        with task.race.write(task.speculative):
+            spill = self.spill
+            # 重新迁移该天时，之前尚未回灌的缓冲已失效
+            if spill is not None and spill.discard(task.target_table, task.date_str):
+                logger.info(f"{task} discarded stale spilled batches")
+
+            # 先清理目标日期数据，保证重跑幂等；ClickHouse不可用时清理随缓冲一起延后
+            if spill is not None and spill.target_down:
+                self._spill_batch(task, [], [], delete_first=True)
+            else:
+                try:
+                    self._delete_target_day(self.get_clickhouse_client(), task.target_table, task.date_str)
+                except OperationalError as e:
+                    if spill is None:
+                        raise
+                    logger.warning(f"{task} ClickHouse unavailable, spilling to disk: {str(e)}")
+                    spill.target_down = True
+                    self.reset_thread_connections(mysql=False)
+                    self._spill_batch(task, [], [], delete_first=True)
+
+        return sum(self._run_shards(task, self._migrate_shard))
+
+    def _run_shards(self, task: MigrationTask, func) -> List[Any]:
+        """对任务的每个源分片执行func(task, shard, progress_lock)，多分片时并行"""
+        shards = self.TABLE_MAPPINGS[task.target_table].shards
+        if len(shards) == 1:
+            return [func(task, shards[0], nullcontext())]
+
+        # 多个分片的批次会同时更新同一个进度条目
+        progress_lock = Lock()
+        futures = [self.get_shard_executor().submit(func, task, shard, progress_lock) for shard in shards]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def get_shard_executor(self) -> ThreadPoolExecutor:
+        """分片读取线程池（按需创建）"""
+        with self.connection_lock:
+            if self.shard_executor is None:
+                self.shard_executor = ThreadPoolExecutor(max_workers=self.get_config('shard_workers', 16),
+                                                         thread_name_prefix="Shard")
+            return self.shard_executor
+
+    def _migrate_shard(self, task: MigrationTask, shard: SourceShard, progress_lock, sink=None) -> int:
+        """从单个源分片读取当天数据，逐批交给sink(data, column_names)，默认写入ClickHouse"""
+        if sink is None:
+            sink = lambda data, names: self._insert_batch(task, data, names)
+        columns = task.columns
+        column_names = [column.get_name() for column in columns]
+        table = task.target_table
+        decoders = self.get_source_decoders(table, columns)
+        converters = [self.build_converter(column.get_type(), raw=decoders is not None) for column in columns]
+        # 目标表有行哈希列时整天重写也写入与delta模式相同的MySQL端哈希，否则下次delta会把这些行全部判为变化
+        hash_column = self._row_hash_column(table)
+        if hash_column:
+            column_names.append(hash_column)
+
+        metrics = self.metrics
+        profiler = self.profiler
+        # 推测副本在提交前不计入进度，避免与原执行重复
+        progress = None if task.speculative and task.race.winner is not True else self.progress.get(table, task.date_str)
+        batch_size = self.TABLE_MAPPINGS[table].batch_size or self.batch_size
+        records = 0
+
+        try:
+            # 历史日期可路由到只读副本，并发上限按实际读取的源计算
+            with metrics.trace(task.trace), self.route_shard(task, shard) as shard, \
+                    self.source_limits.get(shard.profile) or nullcontext():
+                plan = dict(self.get_read_plan(table, shard), decoders=decoders,
+                            row_hash=self._mysql_row_hash(columns) if hash_column else None)
+                if plan['mode'] == 'keyset':
+                    batches = self._read_keyset(task, shard, plan, batch_size)
+                else:
+                    batches = self._read_stream(task, shard, plan, batch_size)
+                with closing(batches):
+                    for rows in batches:
+                        if self.shutdown_event.is_set():
+                            raise RuntimeError("Migration stopped")
+                        if task.race.cancelled(task.speculative):
+                            raise TaskCancelled()
+                        with profiler.scope():
+                            with metrics.timer('convert', table):
+                                data = self.convert_rows(rows, converters)
+                                if hash_column:
+                                    # 哈希在查询结果的最后一列
+                                    for values, row in zip(data, rows):
+                                        values.append(int(row[-1]))
+                            sink(data, column_names)
+                        metrics.add_rows(table, len(data), metrics.estimate_batch_bytes(rows))
+                        if progress is not None:
+                            with progress_lock:
+                                progress.add_rows(len(data))
+                        records += len(data)
+        except Exception:
+            # 分片线程与任务线程不同，需各自丢弃出错的连接
+            if len(self.TABLE_MAPPINGS[table].shards) > 1:
+                self.reset_thread_connections()
+            raise
+
+        return records
+
+    # ==================== 源表读取 ====================
+
+    def _load_source_indexes(self, shard: SourceShard) -> Tuple[Dict[str, List[str]], set]:
+        """通过SHOW INDEX读取源表索引：({索引名: [列名...]}, 唯一索引名集合)"""
+        conn = self.get_mysql_connection(shard.profile)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SHOW INDEX FROM `{shard.source_table}`")
+            names = [description[0] for description in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        indexes: Dict[str, List[Tuple[int, str]]] = {}
+        unique = set()
+        for row in rows:
+            indexes.setdefault(row['Key_name'], []).append((int(row['Seq_in_index']), row['Column_name']))
+            if not int(row['Non_unique']):
+                unique.add(row['Key_name'])
+        return {name: [column for _, column in sorted(parts)] for name, parts in indexes.items()}, unique
+
+    def get_read_plan(self, target_table: str, shard: SourceShard) -> Dict[str, Any]:
+        """确定分片的读取方式：分页键与强制索引（随表结构缓存按TTL刷新）"""
+        return self.schema_cache.get(f'read_plan:{shard.profile}', shard.source_table,
+                                     lambda table: self._build_read_plan(target_table, shard))
+
+    def _build_read_plan(self, target_table: str, shard: SourceShard) -> Dict[str, Any]:
+        mapping = self.TABLE_MAPPINGS[target_table]
+        mode = mapping.read_mode or self.get_config('read_mode', 'stream')
+        force_index = mapping.force_index if mapping.force_index is not None else self.get_config('force_index', False)
+        plan = {'mode': 'stream', 'key': None, 'index': None}
+        if mode != 'keyset' and not force_index:
+            return plan
+
+        indexes, unique = self._load_source_indexes(shard)
+        date_column = self.DATE_COLUMNS[target_table]
+        if mode == 'keyset':
+            primary = indexes.get('PRIMARY', [])
+            key = mapping.key_column or (primary[0] if len(primary) == 1 else None)
+            # 分页键必须唯一：重复值跨页时 key > last 会跳过与上页末行同键的行
+            if key and not any(indexes[name] == [key] for name in unique):
+                logger.warning(f"key_column {key} of {shard.source_table} is not a single-column primary or "
+                               f"unique key, keyset reads would skip rows; falling back to stream")
+            elif key:
+                plan.update(mode='keyset', key=key)
+            else:
+                logger.warning(f"{shard.source_table} has no single-column primary key, "
+                               f"set key_column to use keyset reads; falling back to stream")
+
+        if force_index is True:
+            # 二级索引隐含主键，(分区列) 索引即可按 分区列=day AND key>last ORDER BY key 范围扫描
+            plan['index'] = next((name for name, columns in indexes.items()
+                                  if name != 'PRIMARY' and columns[0] == date_column), None)
+        elif force_index:
+            plan['index'] = force_index if force_index in indexes else None
+        if force_index and plan['index'] is None:
+            logger.warning(f"No usable index {force_index!r} on {shard.source_table}, reading without index hint")
+        return plan
+
+    def _configure_source_limiter(self):
+        self.source_limiter.configure(
+            qps=self.get_config('mysql_qps', 0),
+            rows_per_sec=self.get_config('mysql_rows_per_sec', 0),
+            max_concurrency=self.get_config('mysql_max_concurrency', 0),
+            lag_threshold=self.get_config('mysql_backoff_lag_seconds', 30),
+            latency_threshold=self.get_config('mysql_backoff_latency_seconds', 10)
+        )
+
+    REPLICA_STATUS_STATEMENTS = ('SHOW REPLICA STATUS', 'SHOW SLAVE STATUS')
+
+    def get_replica_lag(self, profile: str = 'default') -> Optional[float]:
+        """读取源库复制延迟（秒），非从库或无权限时返回None
+
+        MySQL 8.0.22+ 使用 SHOW REPLICA STATUS（8.4 起 SHOW SLAVE STATUS 已移除），
+        更早的版本与 MariaDB 回退到 SHOW SLAVE STATUS；可用的语句按连接配置缓存。
+        """
+        statements = self.REPLICA_STATUS_STATEMENTS
+        cached = self.replica_status_statements.get(profile)
+        if cached:
+            statements = (cached,) + tuple(s for s in statements if s != cached)
+        try:
+            conn = self.get_mysql_connection(profile)
+            status = None
+            last_error = None
+            for statement in statements:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(statement)
+                        row = cursor.fetchone()
+                        if row:
+                            status = dict(zip([description[0] for description in cursor.description], row))
+                except pymysql.err.ProgrammingError as e:
+                    # 语法不被当前版本支持，尝试下一条语句
+                    last_error = e
+                    continue
+                self.replica_status_statements[profile] = statement
+                break
+            else:
+                raise last_error
+        except Exception as e:
+            logger.debug(f"Error reading replica lag for {profile}: {str(e)}")
+            return None
+        if not status:
+            return None
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return float(lag) if lag is not None else None
+
+    def _source_monitor_loop(self):
+        """迁移期间定期检查源库复制延迟并调整限流"""
+        while not self.source_monitor_stop.wait(self.get_config('mysql_monitor_interval', 10)):
+            # 只读副本的延迟由路由剔除，不参与全局降速
+            lags = [lag for lag in (self.get_replica_lag(profile) for profile in self.MYSQL_SOURCES
+                                    if profile not in self.replica_health)
+                    if lag is not None]
+            self.source_limiter.update_backoff(max(lags) if lags else None)
+
+    def check_replica(self, name: str) -> Dict[str, Any]:
+        """检查只读副本的连接延迟与复制延迟，更新健康状态"""
+        health = self.replica_health[name]
+        try:
+            start = time.perf_counter()
+            self.get_mysql_connection(name).ping(reconnect=True)
+            latency = time.perf_counter() - start
+            lag = self.get_replica_lag(name)
+            error = None
+        except Exception as e:
+            latency, lag, error = None, None, str(e)
+            self.reset_thread_connections()
+        # 复制延迟未知（复制中断或无权限）时不路由，避免读到陈旧数据
+        healthy = (error is None and lag is not None and lag <= self.get_config('replica_max_lag', 60)
+                   and latency <= self.get_config('replica_max_latency', 1.0))
+        with self.connection_lock:
+            if error is None and lag is None and name not in self.replica_lag_warned:
+                # 副本可连接但报告不出延迟时只告警一次，否则路由会无声地全部退回主库
+                self.replica_lag_warned.add(name)
+                logger.warning(f"Replica {name} reports no replication lag (not replicating, or the user "
+                               f"lacks REPLICATION CLIENT); reads will not be routed to it")
+            elif lag is not None:
+                self.replica_lag_warned.discard(name)
+            if healthy != health['healthy'] and health['healthy'] is not None:
+                logger.warning(f"Replica {name} is now {'healthy' if healthy else 'unhealthy'} "
+                               f"(lag={lag}, latency={latency}, error={error})")
+            health.update(healthy=healthy, lag=lag, latency=round(latency, 4) if latency is not None else None,
+                          error=error, checked_at=time.monotonic(), checking=False)
+        return health
+
+    def _replica_health(self, name: str) -> Dict[str, Any]:
+        """副本健康状态，超过 replica_check_interval 时由当前线程刷新（其他线程沿用旧值）"""
+        health = self.replica_health[name]
+        with self.connection_lock:
+            stale = (health['checked_at'] is None
+                     or time.monotonic() - health['checked_at'] >= self.get_config('replica_check_interval', 10))
+            refresh = stale and (not health['checking'] or health['checked_at'] is None)
+            if refresh:
+                health['checking'] = True
+        return self.check_replica(name) if refresh else health
+
+    @contextmanager
+    def route_shard(self, task: MigrationTask, shard: SourceShard):
+        """为任务选择读取的副本：近期日期读主库，历史日期在健康副本间按权重分散（加权最少连接）"""
+        replicas = self.SOURCE_REPLICAS.get(shard.profile)
+        if (not replicas or not self.get_config('replica_routing_enabled', True)
+                or task.day < self.get_config('replica_recent_days', 2)):
+            yield shard
+            return
+
+        healthy = [(name, weight) for name, weight in replicas if self._replica_health(name)['healthy']]
+        if not healthy:
+            logger.warning(f"{task} no healthy replica for source {shard.profile}, reading from primary")
+            yield shard
+            return
+        with self.connection_lock:
+            health = self.replica_health
+            name, _ = min(healthy, key=lambda item: ((health[item[0]]['active'] + 1) / item[1],
+                                                     health[item[0]]['lag'], health[item[0]]['latency']))
+            health[name]['active'] += 1
+            health[name]['routed'] += 1
+        try:
+            yield SourceShard(name, shard.source_table)
+        finally:
+            with self.connection_lock:
+                health[name]['active'] -= 1
+
+    def get_replica_status(self) -> Dict[str, List[Dict[str, Any]]]:
+        """各源的只读副本状态"""
+        with self.connection_lock:
+            return {profile: [{'name': name, 'weight': weight,
+                               **{key: value for key, value in self.replica_health[name].items()
+                                  if key not in ('checking', 'checked_at')}}
+                              for name, weight in replicas]
+                    for profile, replicas in self.SOURCE_REPLICAS.items()}
+
+    @contextmanager
+    def _source_query(self, table: str, shard: SourceShard, sql: str, params):
+        """源查询计时，超过 slow_query_seconds 时记录慢查询"""
+        start = time.perf_counter()
+        with self.metrics.timer('mysql_query', table):
+            yield
+        elapsed = time.perf_counter() - start
+        self.source_limiter.observe_latency(elapsed)
+        if elapsed >= self.get_config('slow_query_seconds', 5.0):
+            self.slow_query_count.increment()
+            self.slow_queries.append({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'table': table,
+                'source': f"{shard.profile}:{shard.source_table}",
+                'seconds': round(elapsed, 3),
+                'sql': sql,
+                'params': [str(param) for param in params]
+            })
+            logger.warning(f"Slow source query on {shard.profile}:{shard.source_table} ({elapsed:.1f}s): {sql} {params}")
+
+    def _source_select(self, task: MigrationTask, shard: SourceShard, plan: Dict[str, Any],
+                       extra_columns: Tuple[str, ...] = ()) -> str:
+        select_columns = ', '.join(f"`{name}`" for name in
+                                   [column.source_name for column in task.columns] + list(extra_columns))
+        if plan.get('row_hash'):
+            select_columns += f", {plan['row_hash']}"
+        hint = f" FORCE INDEX (`{plan['index']}`)" if plan['index'] else ''
+        date_column = self.DATE_COLUMNS[task.target_table]
+        return f"SELECT {select_columns} FROM `{shard.source_table}`{hint} WHERE `{date_column}` = %s"
+
+    def _read_stream(self, task: MigrationTask, shard: SourceShard, plan: Dict[str, Any], batch_size: int):
+        """单条查询 + SSCursor流式读取"""
+        table = task.target_table
+        sql = self._source_select(task, shard, plan)
+        limiter = self.source_limiter
+        conn = self.get_mysql_connection(shard.profile, plan['decoders'])
+        # 流式查询在读完前一直占用并发名额
+        with limiter.query(self.shutdown_event), conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            with self.profiler.scope(), self._source_query(table, shard, sql, (task.date_str,)):
+                cursor.execute(sql, (task.date_str,))
+            while True:
+                with self.profiler.scope(), self.metrics.timer('mysql_fetch', table):
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                limiter.consume_rows(len(rows), self.shutdown_event)
+                yield rows
+
+    def _read_keyset(self, task: MigrationTask, shard: SourceShard, plan: Dict[str, Any], batch_size: int):
+        """按主键范围分页读取：每页一条短查询，不长时间占用源库连接"""
+        table = task.target_table
+        key = plan['key']
+        source_names = [column.source_name for column in task.columns]
+        # 分页键不在迁移列中时追加到末尾，转换时按列数截断
+        extra_columns = () if key in source_names else (key,)
+        key_index = source_names.index(key) if key in source_names else len(source_names)
+        base_sql = self._source_select(task, shard, plan, extra_columns)
+        first_sql = f"{base_sql} ORDER BY `{key}` LIMIT {int(batch_size)}"
+        next_sql = f"{base_sql} AND `{key}` > %s ORDER BY `{key}` LIMIT {int(batch_size)}"
+
+        limiter = self.source_limiter
+        conn = self.get_mysql_connection(shard.profile, plan['decoders'])
+        last_key = None
+        while True:
+            sql, params = (first_sql, (task.date_str,)) if last_key is None else (next_sql, (task.date_str, last_key))
+            with limiter.query(self.shutdown_event), conn.cursor() as cursor:
+                with self.profiler.scope(), self._source_query(table, shard, sql, params):
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+            if not rows:
+                return
+            limiter.consume_rows(len(rows), self.shutdown_event)
+            last_key = rows[-1][key_index]
+            yield rows
+            if len(rows) < batch_size:
+                return
+
+    def _delete_target_day(self, client, target_table: str, date_str: str):
+        """删除目标表某天的数据"""
+        date_column = self.DATE_COLUMNS[target_table]
+        target_date_column = self.TABLE_COLUMNS[target_table][date_column]
+        client.command(
+            f"ALTER TABLE {target_table} DELETE WHERE toDate(`{target_date_column}`) = '{date_str}'",
+            settings={'mutations_sync': 2}
+        )
+
+    # ==================== 落盘缓冲 ====================
+
+    def _init_spill(self):
+        """按配置创建落盘缓冲，存在遗留文件时启动回灌"""
+        previous = getattr(self, 'spill', None)
+        if previous is not None:
+            previous.close()
+        if not self.get_config('spill_enabled', True):
+            self.spill = None
+            return
+        try:
+            self.spill = SpillBuffer(self.get_config('spill_dir'), self.get_config('spill_max_bytes', 5 * 1024 ** 3))
+        except Exception as e:
+            logger.error(f"Error initializing spill buffer: {str(e)}")
+            self.spill = None
+            return
+        if self.spill.manifest:
+            logger.info(f"Found {len(self.spill.manifest)} spilled batches, draining in background")
+            self.ensure_spill_drainer()
+
+    def ensure_spill_drainer(self):
+        """启动回灌线程（已运行则忽略；上次停止的线程先等它交回当前批次）"""
+        with self.connection_lock:
+            thread = self.spill_thread
+            if thread is not None and thread.is_alive() and not self.spill_stop.is_set():
+                return
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=60)
+        with self.connection_lock:
+            if self.spill_thread is not thread or (thread is not None and thread.is_alive()):
+                return
+            self.spill_stop.clear()
+            self.spill_thread = threading.Thread(target=self._spill_drain_loop, name="SpillDrainer", daemon=True)
+            self.spill_thread.start()
+
+    def _spill_drain_loop(self):
+        while not self.spill_stop.wait(self.get_config('spill_drain_interval', 10)):
+            try:
+                self.drain_spill()
+            except Exception as e:
+                logger.error(f"Error draining spill buffer: {str(e)}")
+
+    def _spill_batch(self, task: MigrationTask, column_names: List[str], data: List[list],
+                     delete_first: bool = False):
+        """把批次写入落盘缓冲，之后该任务的批次都走缓冲"""
+        with self.metrics.timer('spill', task.target_table):
+            self.spill.write(task.target_table, task.date_str, column_names, data, delete_first)
+        task.spilled = True
+        self.spilled_records.increment(len(data))
+        self.ensure_spill_drainer()
+
+    def _insert_batch(self, task: MigrationTask, data: List[list], column_names: List[str]):
+        """写入ClickHouse；目标不可用时写入落盘缓冲，MySQL读取不中断"""
+        with task.race.write(task.speculative):
+            spill = self.spill
+            if spill is not None and (task.spilled or spill.target_down):
+                self._spill_batch(task, column_names, data)
+                return
+            try:
+                self._throttled_insert(task.target_table, data, column_names)
+            except OperationalError as e:
+                if spill is None:
+                    raise
+                logger.warning(f"{task} ClickHouse insert failed, spilling to disk: {str(e)}")
+                spill.target_down = True
+                # 只丢弃ClickHouse连接，MySQL流式游标还在读取
+                self.reset_thread_connections(mysql=False)
+                self._spill_batch(task, column_names, data)
+
+    def drain_spill(self) -> int:
+        """按写入顺序把缓冲批次写回ClickHouse，返回回灌行数"""
+        spill = self.spill
+        if spill is None:
+            return 0
+        pending = spill.pending()
+        if not pending:
+            spill.target_down = False
+            return 0
+
+        try:
+            client = self.get_clickhouse_client()
+            client.command('SELECT 1')
+        except Exception as e:
+            spill.target_down = True
+            self.reset_thread_connections()
+            logger.warning(f"ClickHouse still unavailable, {len(pending)} spilled batches pending: {str(e)}")
+            return 0
+
+        drained = 0
+        for name, header in pending:
+            if self.spill_stop.is_set():
+                break
+            with spill.drain_lock:
+                if name not in spill.manifest:
+                    continue
+                try:
+                    _, columns = spill.read(name)
+                    if header['delete_first']:
+                        self._delete_target_day(client, header['table'], header['date'])
+                    if header['rows']:
+                        self.parts_throttle.wait(header['table'], self.spill_stop)
+                        # 超时但实际已提交的插入重放时按令牌去重（非Replicated表需设置 non_replicated_deduplication_window）
+                        settings = {**self.get_insert_settings(header['table']),
+                                    'insert_deduplication_token': f"spill-{header['created']}-{name}"}
+                        with self.metrics.timer('clickhouse_insert', header['table']):
+                            client.insert(header['table'], columns, column_names=header['columns'],
+                                          column_oriented=True, settings=settings)
+                    spill.remove(name)
+                    drained += header['rows']
+                except OperationalError as e:
+                    spill.target_down = True
+                    self.reset_thread_connections()
+                    logger.warning(f"ClickHouse unavailable while draining spill buffer: {str(e)}")
+                    break
+                except Exception as e:
+                    # 目标可用但批次无法写入（如结构不兼容），多次失败后改名保留以免阻塞后续批次
+                    header['attempts'] = header.get('attempts', 0) + 1
+                    logger.error(f"Error draining spilled batch {name} ({header['table']} {header['date']}): {str(e)}")
+                    if header['attempts'] >= self.max_retries:
+                        spill.remove(name, suffix='.failed')
+                    break
+
+        if not spill.manifest:
+            spill.target_down = False
+        if drained:
+            logger.info(f"Drained {drained} spilled records to ClickHouse")
+        return drained
+
+    # ==================== 写入限流与合并调度 ====================
+
+    def _configure_parts_throttle(self):
+        self.parts_throttle.configure(
+            soft_ratio=self.get_config('parts_soft_ratio', 0.5),
+            max_delay=self.get_config('parts_max_delay', 10),
+            max_wait=self.get_config('parts_max_wait', 300)
+        )
+
+    @staticmethod
+    def _is_too_many_parts(error: Exception) -> bool:
+        message = str(error)
+        return 'TOO_MANY_PARTS' in message or 'Code: 252' in message
+
+    def _throttled_insert(self, target_table: str, data: List[list], column_names: List[str]):
+        """按目标表part数限流后写入；被拒绝（TOO_MANY_PARTS）时等待合并后重试"""
+        attempts = 3
+        for attempt in range(1, attempts + 1):
+            self.parts_throttle.wait(target_table, self.shutdown_event)
+            try:
+                with self.metrics.timer('clickhouse_insert', target_table):
+                    self.get_clickhouse_client().insert(target_table, data, column_names=column_names,
+                                                        settings=self.get_insert_settings(target_table))
+                return
+            except OperationalError:
+                raise
+            except DatabaseError as e:
+                if not self._is_too_many_parts(e) or attempt == attempts:
+                    raise
+                logger.warning(f"{target_table} has too many parts, waiting for merges "
+                               f"(attempt {attempt}/{attempts})")
+                self.parts_throttle.report_too_many_parts(target_table)
+
+    def refresh_parts_state(self, tables: List[str]):
+        """读取目标表单分区最大活跃part数与进行中的合并数"""
+        client = self.get_clickhouse_client()
+        parameters = {'database': self.CLICKHOUSE_CONFIG['database'], 'tables': list(tables)}
+        limit = self.get_config('parts_limit', 0)
+        if not limit:
+            rows = client.query("SELECT value FROM system.merge_tree_settings "
+                                "WHERE name = 'parts_to_delay_insert'").result_rows
+            limit = int(rows[0][0]) if rows else 150
+        parts = dict(client.query(
+            "SELECT table, max(parts) FROM ("
+            " SELECT table, partition_id, count() AS parts FROM system.parts"
+            " WHERE database = {database:String} AND table IN {tables:Array(String)} AND active"
+            " GROUP BY table, partition_id) GROUP BY table",
+            parameters=parameters
+        ).result_rows)
+        merges = dict(client.query(
+            "SELECT table, count() FROM system.merges "
+            "WHERE database = {database:String} AND table IN {tables:Array(String)} GROUP BY table",
+            parameters=parameters
+        ).result_rows)
+        for table in tables:
+            self.parts_throttle.update(table, parts.get(table, 0), merges.get(table, 0), limit)
+
+    def _parts_monitor_loop(self, tables: List[str]):
+        """迁移期间定期刷新目标表part状态"""
+        while True:
+            if self.get_config('parts_throttle_enabled', True):
+                try:
+                    self.refresh_parts_state(tables)
+                except Exception as e:
+                    logger.debug(f"Error reading ClickHouse parts state: {str(e)}")
+                    self.reset_thread_connections(mysql=False)
+            if self.parts_monitor_stop.wait(self.get_config('parts_monitor_interval', 5)):
+                break
+
+    def mark_day_touched(self, task: MigrationTask):
+        with self.connection_lock:
+            self.touched_days.setdefault(task.target_table, set()).add(task.date_str)
 
-    def get_status(self):
-        """获取状态"""
-        return {
-            'is_running': self.is_running,
-            'current_migration_id': self.current_migration_id,
-            'migration_start_time': self.migration_start_time,
-            'last_error': self.last_error,
-            'total_records': self.total_records.get(),
-            'completed_tasks': self.completed_tasks.get(),
-            'failed_tasks': self.failed_tasks.get(),
-            'progress_info': self.progress_info,
-            'config': self.config
-        }
+    def get_optimize_pending(self) -> Dict[str, List[str]]:
+        """等待低峰合并的分区 {表名: [partition_id...]}"""
+        value = self._load_config_value('optimize_pending')
+        return json.loads(value) if value else {}
 
-    def save_migration_history(self, start_time, end_time, status, tables_migrated,
-                               total_records, error_message=None):
-        """保存迁移历史到数据库"""
+    def schedule_optimize(self):
+        """把本次运行写入过的分区加入低峰合并队列"""
+        with self.connection_lock:
+            touched, self.touched_days = self.touched_days, {}
+        if not touched or not self.get_config('optimize_enabled', True):
+            return
+        partitions = {}
         try:
-            duration = (end_time - start_time).total_seconds() if end_time else 0
+            client = self.get_clickhouse_client()
+            for table, days in touched.items():
+                date_column = self.TABLE_COLUMNS[table][self.DATE_COLUMNS[table]]
+                # 分区裁剪后只读日期列，得到这些日期所在的分区
+                rows = client.query(
+                    f"SELECT DISTINCT _partition_id FROM {table} "
+                    f"WHERE toDate(`{date_column}`) IN {{days:Array(Date)}}",
+                    parameters={'days': [date.fromisoformat(day) for day in sorted(days)]}
+                ).result_rows
+                if rows:
+                    partitions[table] = {row[0] for row in rows}
+        except Exception as e:
+            logger.error(f"Error resolving partitions to optimize: {str(e)}")
+            return
+        if not partitions:
+            return
+        with self.optimize_lock:
+            pending = self.get_optimize_pending()
+            for table, ids in partitions.items():
+                pending[table] = sorted(set(pending.get(table, [])) | ids)
+            self._save_config_value('optimize_pending', json.dumps(pending))
+        logger.info(f"Scheduled OPTIMIZE for {sum(len(ids) for ids in pending.values())} partitions "
+                    f"in window {self.get_config('optimize_window', '02:00-06:00')}")
+        self.ensure_optimizer()
+
+    def seconds_until_optimize_window(self, now: Optional[datetime] = None) -> float:
+        """距低峰窗口开始的秒数，已在窗口内返回0（窗口可跨零点，如 22:00-04:00）"""
+        tz = timezone(self.get_config('schedule_timezone', 'Asia/Shanghai'))
+        now = now or datetime.now(tz).replace(tzinfo=None)
+        (start_hour, start_minute), (end_hour, end_minute) = parse_optimize_window(
+            self.get_config('optimize_window', '02:00-06:00'))
+        start = now.replace(hour=start_hour, minute=start_minute, second=0, microsecond=0)
+        end = now.replace(hour=end_hour, minute=end_minute, second=0, microsecond=0)
+        if end <= start:
+            # 跨零点：当前若在零点之后的那一段，窗口从前一天开始
+            if now < end:
+                start -= timedelta(days=1)
+            else:
+                end += timedelta(days=1)
+        if start <= now < end:
+            return 0.0
+        if now >= end:
+            start += timedelta(days=1)
+        return (start - now).total_seconds()
+
+    def ensure_optimizer(self):
+        """启动合并调度线程（已运行则忽略）"""
+        with self.connection_lock:
+            if self.optimize_thread is not None and self.optimize_thread.is_alive():
+                return
+            self.optimize_stop.clear()
+            self.optimize_thread = threading.Thread(target=self._optimize_loop, name="Optimizer", daemon=True)
+            self.optimize_thread.start()
 
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('''
-                INSERT INTO migration_history 
-                (start_time, end_time, status, tables_migrated, total_records, error_message, duration_seconds)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (start_time, end_time, status, tables_migrated, total_records, error_message, duration))
-            db.commit()
+    def _optimize_loop(self):
+        try:
+            while not self.optimize_stop.is_set():
+                delay = self.seconds_until_optimize_window()
+                # 迁移运行中不做合并，与写入争抢资源
+                if delay > 0 or self.is_running:
+                    self.optimize_stop.wait(min(max(delay, 1), 60))
+                    continue
+                if not self.run_pending_optimize():
+                    break
+        except Exception as e:
+            logger.error(f"Optimizer error: {str(e)}", exc_info=True)
+        finally:
+            self.reset_thread_connections(mysql=False)
+
+    def run_pending_optimize(self) -> bool:
+        """在窗口内逐个分区执行OPTIMIZE，返回是否还有未完成的分区"""
+        final = ' FINAL' if self.get_config('optimize_final', False) else ''
+        pending = self.get_optimize_pending()
+        for table in list(pending):
+            for partition_id in list(pending[table]):
+                if self.optimize_stop.is_set() or self.is_running or self.seconds_until_optimize_window() > 0:
+                    return True
+                try:
+                    client = self.get_clickhouse_client()
+                    parts = client.query(
+                        "SELECT count() FROM system.parts WHERE database = {database:String} "
+                        "AND table = {table:String} AND partition_id = {partition:String} AND active",
+                        parameters={'database': self.CLICKHOUSE_CONFIG['database'], 'table': table,
+                                    'partition': partition_id}
+                    ).result_rows[0][0]
+                    # 只剩一个part时合并无意义（FINAL除外）
+                    if parts > 1 or final:
+                        start = time.perf_counter()
+                        client.command(f"OPTIMIZE TABLE {table} PARTITION ID '{partition_id}'{final}")
+                        logger.info(f"Optimized {table} partition {partition_id} ({parts} parts) "
+                                    f"in {time.perf_counter() - start:.1f}s")
+                except Exception as e:
+                    logger.error(f"Error optimizing {table} partition {partition_id}: {str(e)}")
+                    self.reset_thread_connections(mysql=False)
+                    self.optimize_stop.wait(60)
+                    continue
+                with self.optimize_lock:
+                    # 合并期间可能有新的运行加入分区，重新读取后再移除
+                    current = self.get_optimize_pending()
+                    if partition_id in current.get(table, []):
+                        current[table].remove(partition_id)
+                        if not current[table]:
+                            del current[table]
+                    self._save_config_value('optimize_pending', json.dumps(current))
+        return bool(self.get_optimize_pending())
+
+    # ==================== 文件传输 ====================
+
+    def get_transfer_mode(self, target_table: str) -> str:
+        """表的传输模式：映射配置优先，其次全局配置"""
+        mapping = self.TABLE_MAPPINGS.get(target_table)
+        if mapping and mapping.transfer_mode:
+            return mapping.transfer_mode
+        return self.get_config('transfer_mode', 'insert')
+
+    def _export_shard(self, task: MigrationTask, shard: SourceShard, progress_lock) -> Dict[str, Any]:
+        """把单个分片当天的数据导出为本地文件（重试时复用已导出的文件）"""
+        key = f"{shard.profile}:{shard.source_table}"
+        columns = list(task.columns)
+        hash_column = self._row_hash_column(task.target_table)
+        if hash_column:
+            # 与_migrate_shard追加的行哈希列对应
+            columns.append(ColumnDefinition(hash_column, 'UInt64'))
+        column_names = [column.get_name() for column in columns]
+        export = task.exports.get(key)
+        # 当天无数据的导出没有文件
+        if export and export['columns'] == column_names and (not export['rows'] or os.path.exists(export['path'])):
+            progress = self.progress.get(task.target_table, task.date_str)
+            if progress is not None:
+                with progress_lock:
+                    progress.add_rows(export['rows'])
+            return export
+
+        writer_class = EXPORT_WRITERS[self.get_config('export_format', 'Native')]
+        directory = Path(self.get_config('export_dir'))
+        directory.mkdir(parents=True, exist_ok=True)
+        attempt = '_spec' if task.speculative else ''
+        path = directory / (f"{task.target_table}_{task.date_str}_{shard.profile}_{shard.source_table}"
+                            f"_{task.task_id}{attempt}.{writer_class.fmt.lower()}")
+        writer = writer_class(str(path), columns, self.get_config('export_compression', 'zstd'))
+        try:
+            rows = self._migrate_shard(task, shard, progress_lock, sink=writer.write)
+        except Exception:
+            # 不完整的导出文件不能复用
+            writer.close()
+            path.unlink(missing_ok=True)
+            raise
+        writer.close()
+        if not rows:
+            # 只有文件头（Native为空文件）的导出不保留，导入时跳过
+            path.unlink(missing_ok=True)
+
+        export = {'path': str(path), 'format': writer.fmt, 'compression': writer.compression,
+                  'columns': column_names, 'rows': rows, 'bytes': path.stat().st_size if rows else 0}
+        task.exports[key] = export
+        return export
+
+    def _migrate_task_via_files(self, task: MigrationTask) -> int:
+        """文件传输模式：先导出各分片到本地文件，再删除目标日期数据并整文件导入"""
+        # 某个分片导出失败时，已完成分片的文件保留在task.exports中供重试
+        exports = self._run_shards(task, self._export_shard)
+
+        # 与推测执行的另一方竞争提交权，获胜的推测副本同时作废原执行遗留的落盘缓冲
+        if not task.race.claim(task.speculative):
+            raise TaskCancelled()
+        if task.speculative and self.spill is not None and self.spill.discard(task.target_table, task.date_str):
+            logger.info(f"{task} discarded spilled batches of the original attempt")
+
+        client = self.get_clickhouse_client()
+        # 提交后仍登记每次写入：远程租约失效（TaskRace.fence）时停止后续写入
+        with task.race.write(task.speculative):
+            self._delete_target_day(client, task.target_table, task.date_str)
+        for export in exports:
+            if not export['rows']:
+                continue
+            self.parts_throttle.wait(task.target_table, self.shutdown_event)
+            with task.race.write(task.speculative), self.metrics.timer('clickhouse_insert', task.target_table):
+                insert_file(client, task.target_table, export['path'], fmt=export['format'],
+                            column_names=export['columns'], compression=export['compression'],
+                            settings=self.get_insert_settings(task.target_table))
+            logger.debug(f"{task} loaded {export['rows']} rows from {export['path']} ({export['bytes']} bytes)")
+
+        self.discard_exports(task)
+        return sum(export['rows'] for export in exports)
+
+    def discard_exports(self, task: MigrationTask):
+        """删除任务的导出文件（export_keep_files为真时保留）"""
+        if not self.get_config('export_keep_files', False):
+            for export in task.exports.values():
+                try:
+                    os.remove(export['path'])
+                except OSError:
+                    pass
+        task.exports.clear()
+
+    # ==================== 服务端拉取 ====================
+
+    @staticmethod
+    def _quote_clickhouse_string(value: Any) -> str:
+        return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+    def _mysql_table_function(self, shard: SourceShard) -> str:
+        """生成分片对应的ClickHouse mysql()表函数
+
+        源配置必须指定 clickhouse_named_collection（ClickHouse端保存地址与账号），
+        不在SQL中拼接明文密码（会出现在 query_log 与进程列表中）。
+        """
+        collection = self.source_collections.get(shard.profile)
+        if not collection:
+            raise ValueError(f"Source '{shard.profile}' has no clickhouse_named_collection, required for pushdown")
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', collection):
+            raise ValueError(f"Invalid clickhouse_named_collection name: {collection!r}")
+        return f"mysql({collection}, table = {self._quote_clickhouse_string(shard.source_table)})"
+
+    def _pushdown_shard(self, task: MigrationTask, shard: SourceShard, progress_lock) -> int:
+        """由ClickHouse执行 INSERT ... SELECT ... FROM mysql(...)，数据不经过本进程"""
+        table = task.target_table
+        target_columns = ', '.join(f"`{column.get_name()}`" for column in task.columns)
+        source_columns = ', '.join(f"`{column.source_name}`" for column in task.columns)
+        date_column = self.DATE_COLUMNS[table]
+        sql = (f"INSERT INTO {table} ({target_columns}) SELECT {source_columns} "
+               f"FROM {self._mysql_table_function(shard)} WHERE `{date_column}` = '{task.date_str}'")
+
+        client = self.get_clickhouse_client()
+        self.parts_throttle.wait(table, self.shutdown_event)
+        with task.race.write(task.speculative), self.source_limiter.query(self.shutdown_event), \
+                self.metrics.timer('clickhouse_insert', table):
+            summary = client.command(sql, settings=self.get_insert_settings(table))
+        rows = summary.written_rows if isinstance(summary, QuerySummary) else 0
+        logger.debug(f"{task} pushdown from {shard.profile}:{shard.source_table} wrote {rows} rows")
+        return rows
+
+    def _migrate_task_via_pushdown(self, task: MigrationTask) -> int:
+        """服务端拉取模式：删除目标日期数据后，每个分片一条 INSERT SELECT
+
+        读取由ClickHouse完成，本进程只占用源库并发槽位（mysql_max_concurrency / mysql_qps 生效）；
+        mysql_rows_per_sec 无法限制语句执行中的读取速度，只在完成后按行数扣减令牌，使其他读取随后让出。
+        """
+        table = task.target_table
+        # 缺少named collection时在删除目标日期之前失败
+        for shard in self.TABLE_MAPPINGS[table].shards:
+            self._mysql_table_function(shard)
+        client = self.get_clickhouse_client()
+        with task.race.write(task.speculative):
+            self._delete_target_day(client, table, task.date_str)
+        self._run_shards(task, self._pushdown_shard)
+
+        # 以目标端计数为准（长查询的written_rows摘要可能不完整）
+        target_date_column = self.TABLE_COLUMNS[table][self.DATE_COLUMNS[table]]
+        records = int(client.query(f"SELECT count() FROM {table} "
+                                   f"WHERE toDate(`{target_date_column}`) = '{task.date_str}'").result_rows[0][0])
+        self.source_limiter.consume_rows(records, self.shutdown_event)
+        self.metrics.add_rows(table, records, 0)
+        progress = self.progress.get(table, task.date_str)
+        if progress is not None:
+            progress.add_rows(records)
+        return records
+
+    # ==================== 增量行传输 ====================
+
+    @staticmethod
+    def _mysql_row_hash(columns: List[ColumnDefinition]) -> str:
+        """MySQL端行哈希表达式：各列文本以'|'连接后取MD5前64位（NULL以CHAR(0)区分）"""
+        parts = ', '.join(f"IFNULL(CAST(`{column.source_name}` AS CHAR), CHAR(0))" for column in columns)
+        return f"CAST(CONV(LEFT(MD5(CONCAT_WS('|', {parts})), 16), 16, 10) AS UNSIGNED)"
+
+    def _row_hash_column(self, target_table: str) -> Optional[str]:
+        """目标表的行哈希列（不存在时返回None）"""
+        hash_column = self.get_config('delta_hash_column', '_row_hash')
+        target_columns = self.schema_cache.get('clickhouse', target_table, self._load_target_schema)
+        return hash_column if hash_column in target_columns else None
+
+    def _delta_columns(self, task: MigrationTask) -> Optional[Dict[str, Any]]:
+        """delta模式所需的列；缺少行主键、哈希列或版本列时返回None"""
+        table = task.target_table
+        mapping = self.TABLE_MAPPINGS[table]
+        key = mapping.delta_key or mapping.validation_key or mapping.key_column
+        target_columns = self.schema_cache.get('clickhouse', table, self._load_target_schema)
+        hash_column = self.get_config('delta_hash_column', '_row_hash')
+        version_column = self.get_config('cdc_version_column', '_version')
+        deleted_column = self.get_config('cdc_deleted_column', '_is_deleted')
+        if not key or key not in self.TABLE_COLUMNS[table] or hash_column not in target_columns \
+                or version_column not in target_columns:
+            return None
+        return {'key': key, 'target_key': self.TABLE_COLUMNS[table][key], 'hash': hash_column,
+                'version': version_column, 'deleted': deleted_column if deleted_column in target_columns else None}
+
+    def _migrate_task_via_delta(self, task: MigrationTask) -> Optional[int]:
+        """delta模式：按 CRC32(key) 分桶比较两端 COUNT 与行哈希异或，只读取变化的桶，
+        写入新增/变化的行并为源端已删除的行写入删除标记（ReplacingMergeTree按版本列去重），返回变化行数；
+        不满足条件时返回None（回退到整天重写）"""
+        if task.target_table in self.cdc_target_tables and any(thread.is_alive() for thread in self.cdc_threads.values()):
+            # CDC写入的行没有行哈希（见start_cdc），整天重写一次让哈希与源端一致
+            logger.warning(f"{task} is being synced by CDC, delta mode is not supported, rewriting the whole day")
+            return None
+        delta = self._delta_columns(task)
+        if delta is None:
+            logger.warning(f"{task} delta mode needs a row key and {self.get_config('delta_hash_column', '_row_hash')}"
+                           f"/{self.get_config('cdc_version_column', '_version')} columns on the target, "
+                           f"rewriting the whole day")
+            return None
 
-            return cursor.lastrowid
+        table = task.target_table
+        key, target_key = delta['key'], delta['target_key']
+        date_column = self.DATE_COLUMNS[table]
+        target_date_column = self.TABLE_COLUMNS[table][date_column]
+        buckets = int(self.get_config('delta_buckets', 256))
+        row_hash = self._mysql_row_hash(task.columns)
+        shards = self.TABLE_MAPPINGS[table].shards
+        client = self.get_clickhouse_client()
+
+        # 1. 两端按桶汇总 (行数, 行哈希异或)；目标端取每个key最新版本且未删除的行
+        source_buckets: Dict[int, Tuple[int, int]] = {}
+        for shard in shards:
+            sql = (f"SELECT MOD(CRC32(`{key}`), {buckets}), COUNT(*), BIT_XOR({row_hash}) "
+                   f"FROM `{shard.source_table}` WHERE `{date_column}` = %s GROUP BY 1")
+            conn = self.get_mysql_connection(shard.profile)
+            with self.source_limiter.query(self.shutdown_event), conn.cursor() as cursor:
+                with self._source_query(table, shard, sql, (task.date_str,)):
+                    cursor.execute(sql, (task.date_str,))
+                    rows = cursor.fetchall()
+            for bucket, count, digest in rows:
+                total, combined = source_buckets.get(int(bucket), (0, 0))
+                source_buckets[int(bucket)] = (total + int(count), combined ^ int(digest))
+
+        deleted_expr = f"argMax(`{delta['deleted']}`, `{delta['version']}`)" if delta['deleted'] else '0'
+        latest = (f"SELECT toString(`{target_key}`) AS k, argMax(`{delta['hash']}`, `{delta['version']}`) AS h, "
+                  f"{deleted_expr} AS d FROM {table} "
+                  f"WHERE toDate(`{target_date_column}`) = '{task.date_str}' GROUP BY k")
+        target_buckets = {int(bucket): (int(count), int(digest)) for bucket, count, digest in client.query(
+            f"SELECT CRC32(k) % {buckets} AS b, count(), groupBitXor(h) FROM ({latest}) WHERE d = 0 GROUP BY b"
+        ).result_rows}
+
+        changed = sorted(bucket for bucket in set(source_buckets) | set(target_buckets)
+                         if source_buckets.get(bucket) != target_buckets.get(bucket))
+        if not changed:
+            logger.info(f"{task} delta: unchanged")
+            return 0
+
+        # 2. 变化的桶：目标端 key -> 行哈希，源端逐行比较
+        target_hashes = dict(client.query(
+            f"SELECT k, h FROM ({latest}) WHERE d = 0 AND CRC32(k) % {buckets} IN {{buckets:Array(UInt32)}}",
+            parameters={'buckets': changed}
+        ).result_rows)
+        max_version = client.query(f"SELECT max(`{delta['version']}`) FROM {table} "
+                                   f"WHERE toDate(`{target_date_column}`) = '{task.date_str}'").result_rows[0][0]
+        # 新版本只比该天已有的最大版本大1，之后CDC按binlog位置写入的版本仍会覆盖它
+        version = int(max_version or 0) + 1
+
+        column_names = [column.get_name() for column in task.columns] + [delta['hash'], delta['version']]
+        if delta['deleted']:
+            column_names.append(delta['deleted'])
+        converters = [self.build_converter(column.get_type()) for column in task.columns]
+        batch_size = self.TABLE_MAPPINGS[table].batch_size or self.batch_size
+        select_columns = ', '.join(f"`{column.source_name}`" for column in task.columns)
+        seen = set()
+        upserted = 0
+        for shard in shards:
+            sql = (f"SELECT {select_columns}, CAST(`{key}` AS CHAR), {row_hash} FROM `{shard.source_table}` "
+                   f"WHERE `{date_column}` = %s AND MOD(CRC32(`{key}`), {buckets}) IN %s")
+            params = (task.date_str, tuple(changed))
+            conn = self.get_mysql_connection(shard.profile)
+            with self.source_limiter.query(self.shutdown_event), conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                with self._source_query(table, shard, sql, params):
+                    cursor.execute(sql, params)
+                while True:
+                    with self.metrics.timer('mysql_fetch', table):
+                        rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if self.shutdown_event.is_set():
+                        raise RuntimeError("Migration stopped")
+                    self.source_limiter.consume_rows(len(rows), self.shutdown_event)
+                    changed_rows = []
+                    for row in rows:
+                        seen.add(row[-2])
+                        if target_hashes.get(row[-2]) != int(row[-1]):
+                            changed_rows.append(row)
+                    if not changed_rows:
+                        continue
+                    data = self.convert_rows([row[:-2] for row in changed_rows], converters)
+                    for values, row in zip(data, changed_rows):
+                        values.extend((int(row[-1]), version) + ((0,) if delta['deleted'] else ()))
+                    self._insert_batch(task, data, column_names)
+                    upserted += len(data)
+
+        # 3. 源端已删除的行：复制目标端当前行并写入删除标记；没有删除标记列时直接删除
+        deleted = [row_key for row_key in target_hashes if row_key not in seen]
+        for start in range(0, len(deleted), batch_size):
+            keys = deleted[start:start + batch_size]
+            condition = (f"toDate(`{target_date_column}`) = '{task.date_str}' "
+                         f"AND toString(`{target_key}`) IN {{keys:Array(String)}}")
+            if delta['deleted']:
+                select_target = ', '.join(f"`{column.get_name()}`" for column in task.columns)
+                rows = client.query(f"SELECT {select_target}, `{delta['hash']}` FROM {table} FINAL WHERE {condition}",
+                                    parameters={'keys': keys}).result_rows
+                self._insert_batch(task, [list(row) + [version, 1] for row in rows], column_names)
+            else:
+                with task.race.write(task.speculative):
+                    client.command(f"ALTER TABLE {table} DELETE WHERE {condition}", parameters={'keys': keys},
+                                   settings={'mutations_sync': 2})
+
+        records = upserted + len(deleted)
+        self.metrics.add_rows(table, records, 0)
+        progress = self.progress.get(table, task.date_str)
+        if progress is not None:
+            progress.add_rows(records)
+        logger.info(f"{task} delta: {len(changed)}/{buckets} buckets changed, "
+                    f"{upserted} rows upserted, {len(deleted)} rows deleted")
+        return records
+
+    # ==================== 增量同步（CDC） ====================
+
+    def get_cdc_checkpoint(self, profile: str) -> Optional[Dict[str, Any]]:
+        value = self._load_config_value(f'cdc_checkpoint:{profile}')
+        return json.loads(value) if value else None
+
+    def save_cdc_checkpoint(self, profile: str, log_file: str, log_pos: int):
+        self._save_config_value(f'cdc_checkpoint:{profile}', json.dumps({
+            'log_file': log_file, 'log_pos': log_pos, 'updated_at': datetime.now().isoformat(timespec='seconds')
+        }))
+
+    @staticmethod
+    def _binlog_version(log_file: str, log_pos: int) -> int:
+        """由binlog位置生成单调递增的版本号：文件序号在高32位，位置在低32位"""
+        sequence = re.sub(r'\D', '', log_file.rsplit('.', 1)[-1]) or '0'
+        return (int(sequence) << 32) | int(log_pos)
+
+    def _cdc_targets(self, tables: Optional[List[str]] = None) -> Dict[str, Dict[str, str]]:
+        """按源连接分组的 {源表: 目标表}"""
+        targets: Dict[str, Dict[str, str]] = {}
+        for mapping in self.TABLE_MAPPINGS.values():
+            if tables and mapping.source_table not in tables and mapping.target_table not in tables:
+                continue
+            for shard in mapping.shards:
+                targets.setdefault(shard.profile, {})[shard.source_table] = mapping.target_table
+        return targets
+
+    def _open_cdc_source(self, profile: str, source_tables: List[str]):
+        checkpoint = self.get_cdc_checkpoint(profile) or {}
+        event_file = self.get_config('cdc_event_file')
+        if event_file:
+            return RecordedEventSource(event_file, checkpoint.get('log_file'), checkpoint.get('log_pos'))
+
+        log_file, log_pos = checkpoint.get('log_file'), checkpoint.get('log_pos')
+        if not log_file:
+            # 首次启动从当前位置开始，之前的数据由按天迁移覆盖
+            with self.get_mysql_connection(profile).cursor() as cursor:
+                cursor.execute('SHOW MASTER STATUS')
+                log_file, log_pos = cursor.fetchone()[:2]
+            logger.info(f"CDC {profile} has no checkpoint, starting at {log_file}:{log_pos}")
+        return BinlogEventSource(self.MYSQL_SOURCES[profile], int(self.get_config('cdc_server_id', 4271)),
+                                 source_tables, log_file, int(log_pos), self.get_config('cdc_flush_interval', 5))
+
+    def _flush_cdc(self, profile: str, buffers: Dict[str, List[Tuple[bool, Dict[str, Any], int]]],
+                   position: Optional[Tuple[str, int]], stats: Dict[str, Any]):
+        """把缓冲的行事件写入ClickHouse，全部写入后保存检查点"""
+        version_column = self.get_config('cdc_version_column', '_version')
+        deleted_column = self.get_config('cdc_deleted_column', '_is_deleted')
+        for target_table, entries in buffers.items():
+            if not entries:
+                continue
+            schema = self.check_schema(target_table)
+            columns = [ColumnDefinition(target, schema['target_columns'][target], source)
+                       for source, target in schema['projection'].items()]
+            converters = [self.build_converter(column.get_type()) for column in columns]
+            column_names = [column.get_name() for column in columns]
+            has_version = version_column in schema['target_columns']
+            has_deleted = deleted_column in schema['target_columns']
+            if has_version:
+                column_names.append(version_column)
+            if has_deleted:
+                column_names.append(deleted_column)
+
+            data = []
+            for deleted, row, version in entries:
+                if deleted and not has_deleted:
+                    # 没有删除标记列时无法表达删除
+                    stats['skipped_deletes'] += 1
+                    continue
+                values = [convert(row.get(column.source_name)) for convert, column in zip(converters, columns)]
+                if has_version:
+                    values.append(version)
+                if has_deleted:
+                    values.append(1 if deleted else 0)
+                data.append(values)
+
+            while data:
+                try:
+                    with self.metrics.timer('clickhouse_insert', target_table):
+                        self.get_clickhouse_client().insert(target_table, data, column_names=column_names,
+                                                            settings=self.get_insert_settings(target_table))
+                    break
+                except OperationalError as e:
+                    # 目标暂不可用：保留缓冲并暂停读取binlog，恢复后继续
+                    stats['last_error'] = str(e)
+                    logger.warning(f"CDC {profile} insert into {target_table} failed, retrying: {str(e)}")
+                    self.reset_thread_connections()
+                    if self.cdc_stop.wait(self.get_config('spill_drain_interval', 10)):
+                        raise RuntimeError("CDC stopped before buffered events were written")
+            self.metrics.add_rows(target_table, len(data), 0)
+            stats['rows'] += len(data)
+            entries.clear()
+
+        if position is not None:
+            self.save_cdc_checkpoint(profile, *position)
+            stats['position'] = f"{position[0]}:{position[1]}"
+        stats['flushes'] += 1
+
+    def _cdc_loop(self, profile: str, targets: Dict[str, str]):
+        """读取binlog行事件，按表微批写入ClickHouse"""
+        stats = self.cdc_stats[profile] = {
+            'state': 'running', 'tables': sorted(set(targets.values())), 'events': 0, 'rows': 0,
+            'skipped_deletes': 0, 'flushes': 0, 'position': None, 'lag_seconds': None, 'last_error': None
+        }
+        buffers: Dict[str, List[Tuple[bool, Dict[str, Any], int]]] = {target: [] for target in targets.values()}
+        batch_size = self.get_config('cdc_batch_size', 5000)
+        flush_interval = self.get_config('cdc_flush_interval', 5)
+        record_file = self.get_config('cdc_record_file')
+        recorder = open(record_file, 'a', encoding='utf-8') if record_file and not self.get_config('cdc_event_file') else None
+        position = None
+        flushed_position = None
+        last_flush = time.monotonic()
+        source = None
+
+        try:
+            source = self._open_cdc_source(profile, list(targets))
+            for event in source:
+                if self.cdc_stop.is_set():
+                    break
+                if event is not None and event['type'] == 'commit':
+                    if recorder is not None:
+                        recorder.write(json.dumps(event, default=str, ensure_ascii=False) + '\n')
+                    # 检查点只推进到事务边界：中途停止时从最后提交的事务之后重放，
+                    # 已写入的半个事务按相同版本号重写，ReplacingMergeTree去重
+                    position = (event['log_file'], event['log_pos'])
+                elif event is not None and event.get('table') in targets:
+                    if recorder is not None:
+                        recorder.write(json.dumps(event, default=str, ensure_ascii=False) + '\n')
+                    version = self._binlog_version(event['log_file'], event['log_pos'])
+                    deleted = event['type'] == 'delete'
+                    buffers[targets[event['table']]].extend((deleted, row, version) for row in event['rows'])
+                    stats['events'] += 1
+                    if event.get('timestamp'):
+                        stats['lag_seconds'] = max(0, round(time.time() - event['timestamp'], 1))
+
+                pending = sum(len(entries) for entries in buffers.values())
+                if pending >= batch_size or (time.monotonic() - last_flush >= flush_interval
+                                             and (pending or position != flushed_position)):
+                    self._flush_cdc(profile, buffers, position, stats)
+                    flushed_position = position
+                    last_flush = time.monotonic()
+
+            # 事件流结束（录制文件读完）或停止时写入剩余缓冲
+            if position != flushed_position or any(buffers.values()):
+                self._flush_cdc(profile, buffers, position, stats)
+            stats['state'] = 'stopped'
         except Exception as e:
-            logger.error(f"Error saving migration history: {str(e)}")
+            stats['state'] = 'failed'
+            stats['last_error'] = str(e)
+            logger.error(f"CDC {profile} failed: {str(e)}", exc_info=True)
+        finally:
+            if source is not None:
+                source.close()
+            if recorder is not None:
+                recorder.close()
+            self.reset_thread_connections()
+            close_db(None)
+
+    def start_cdc(self, tables: Optional[List[str]] = None) -> Dict[str, Any]:
+        """启动binlog增量同步（每个源连接一个线程）"""
+        if any(thread.is_alive() for thread in self.cdc_threads.values()):
+            return {"success": False, "message": "CDC is already running"}
+        targets = self._cdc_targets(tables or self.get_config('cdc_tables'))
+        if not targets:
+            return {"success": False, "message": "No tables to sync"}
+        # CDC写入的行没有MySQL端行哈希，与delta模式同表使用会让每次delta都重写这些行
+        delta_tables = sorted({target for profile_targets in targets.values() for target in profile_targets.values()
+                               if self.get_transfer_mode(target) == 'delta'})
+        if delta_tables:
+            return {"success": False,
+                    "message": f"CDC cannot sync delta mode tables: {', '.join(delta_tables)} "
+                               f"(set cdc_tables or change their transfer_mode)"}
+
+        self.cdc_stop.clear()
+        self.cdc_threads = {}
+        self.cdc_target_tables = {target for profile_targets in targets.values() for target in profile_targets.values()}
+        for profile, profile_targets in targets.items():
+            thread = threading.Thread(target=self._cdc_loop, args=(profile, profile_targets),
+                                      name=f"CDC-{profile}", daemon=True)
+            self.cdc_threads[profile] = thread
+            thread.start()
+        return {"success": True, "message": f"CDC started for {sum(len(t) for t in targets.values())} tables"}
+
+    def stop_cdc(self) -> Dict[str, Any]:
+        """停止增量同步（写入已缓冲的事件并保存检查点）"""
+        self.cdc_stop.set()
+        for thread in self.cdc_threads.values():
+            thread.join(timeout=30)
+        return {"success": True, "message": "CDC stopped"}
+
+    # ==================== 数据校验 ====================
+
+    @staticmethod
+    def _normalize_value(value):
+        """校验用的规范化值（消除两端类型差异）"""
+        if value is None:
             return None
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return round(float(value), 6)
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, date):
+            return value.strftime('%Y-%m-%d')
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        return str(value)
+
+    def _row_digest(self, row) -> str:
+        return hashlib.md5(repr(tuple(self._normalize_value(value) for value in row)).encode('utf-8')).hexdigest()
+
+    def validate_task(self, task: MigrationTask, records: int) -> Dict[str, Any]:
+        """校验单天迁移结果：COUNT/SUM聚合对比 + 抽样行哈希对比"""
+        date_column = self.DATE_COLUMNS[task.target_table]
+        mapping = self.TABLE_COLUMNS[task.target_table]
+        target_date_column = mapping[date_column]
+        metric_columns = [column for column in self.VALIDATION_COLUMNS.get(task.target_table, [])
+                          if column in mapping]
+        tolerance = self.get_config('validation_tolerance', 1e-6)
+
+        client = self.get_clickhouse_client()
+        shards = self.TABLE_MAPPINGS[task.target_table].shards
+        # delta模式的目标表保留旧版本与删除标记，校验时只看每个key的最新未删除行
+        target_from = task.target_table
+        target_filter = ''
+        if self.get_transfer_mode(task.target_table) == 'delta':
+            delta = self._delta_columns(task)
+            if delta is not None:
+                target_from = f"{task.target_table} FINAL"
+                if delta['deleted']:
+                    target_filter = f" AND `{delta['deleted']}` = 0"
+
+        # 聚合对比：每个源分片执行一次COUNT/SUM后累加，目标端执行一次
+        source_agg = [0.0] * (len(metric_columns) + 1)
+        for shard in shards:
+            source_sql = "SELECT COUNT(*)" + ''.join(f", SUM(`{column}`)" for column in metric_columns) \
+                         + f" FROM `{shard.source_table}` WHERE `{date_column}` = %s"
+            with self.get_mysql_connection(shard.profile).cursor() as cursor:
+                cursor.execute(source_sql, (task.date_str,))
+                source_agg = [total + float(value or 0) for total, value in zip(source_agg, cursor.fetchone())]
+        target_sql = "SELECT count()" + ''.join(f", sum(`{mapping[column]}`)" for column in metric_columns) \
+                     + f" FROM {target_from} WHERE toDate(`{target_date_column}`) = '{task.date_str}'{target_filter}"
+        target_agg = client.query(target_sql).result_rows[0]
+
+        source_count, target_count = int(source_agg[0]), int(target_agg[0])
+        sums = {}
+        mismatched_sums = []
+        for index, column in enumerate(metric_columns, start=1):
+            source_sum = source_agg[index]
+            target_sum = float(target_agg[index] or 0)
+            sums[mapping[column]] = {'source': source_sum, 'target': target_sum}
+            if abs(source_sum - target_sum) > tolerance * max(abs(source_sum), abs(target_sum), 1.0):
+                mismatched_sums.append(mapping[column])
+
+        result = {
+            'date': task.date_str,
+            'source_count': source_count,
+            'target_count': target_count,
+            'migrated': records,
+            'sums': sums,
+            'mismatched_sums': mismatched_sums,
+            'sample_rows': 0,
+            'sample_mismatches': 0
+        }
 
-    def update_table_status(self, table_name, last_sync_time, records_count, status, last_error=None):
-        """更新表状态"""
+        # 抽样行哈希对比：两端按 CRC32(key) % buckets = bucket 选出同一批行
+        key_column = self.VALIDATION_KEYS.get(task.target_table)
+        sample_rows = self.get_config('validation_sample_rows', 200)
+        if key_column and key_column in mapping and source_count and sample_rows:
+            buckets = max(2, source_count // sample_rows)
+            # 跳过0号桶：空字符串的CRC32为0，非Nullable目标列会把NULL写成空字符串
+            bucket = random.randint(1, buckets - 1)
+            columns = task.columns
+            select_source = ', '.join(f"`{column.source_name}`" for column in columns)
+            select_target = ', '.join(f"`{column.get_name()}`" for column in columns)
+            source_rows = []
+            for shard in shards:
+                with self.get_mysql_connection(shard.profile).cursor() as cursor:
+                    cursor.execute(f"SELECT {select_source} FROM `{shard.source_table}` "
+                                   f"WHERE `{date_column}` = %s AND MOD(CRC32(`{key_column}`), {buckets}) = {bucket}",
+                                   (task.date_str,))
+                    source_rows.extend(cursor.fetchall())
+            target_rows = client.query(
+                f"SELECT {select_target} FROM {target_from} "
+                f"WHERE toDate(`{target_date_column}`) = '{task.date_str}'{target_filter} "
+                f"AND CRC32(`{mapping[key_column]}`) % {buckets} = {bucket}"
+            ).result_rows
+
+            converters = [self.build_converter(column.get_type()) for column in columns]
+            source_digests = Counter(self._row_digest(row) for row in self.convert_rows(source_rows, converters))
+            target_digests = Counter(self._row_digest(row) for row in target_rows)
+            result['sample_rows'] = len(source_rows)
+            result['sample_mismatches'] = sum(((source_digests - target_digests)
+                                               + (target_digests - source_digests)).values())
+
+        result['passed'] = (source_count == target_count and not mismatched_sums
+                            and result['sample_mismatches'] == 0)
+        return result
+
+    def run_validation(self, task: MigrationTask, records: int):
+        """迁移成功后执行校验并记录结果（校验异常不影响迁移结果）"""
         try:
-            db = get_db()
-            cursor = db.cursor()
+            result = self.validate_task(task, records)
+        except Exception as e:
+            logger.warning(f"{task} validation error: {str(e)}")
+            result = {'date': task.date_str, 'passed': False, 'error': str(e)}
+
+        self.validation_results.setdefault(task.target_table, {})[task.date_str] = result
+        if not result['passed']:
+            logger.warning(f"{task} validation failed: {json.dumps(result, default=str)}")
+        return result
+
+    def get_validation_summary(self, target_table: str) -> Optional[Dict[str, Any]]:
+        """汇总单表本次运行的校验结果"""
+        results = self.validation_results.get(target_table)
+        if not results:
+            return None
+        failed = sorted(day for day, result in results.items() if not result['passed'] and not result.get('pending'))
+        pending = sorted(day for day, result in results.items() if result.get('pending'))
+        return {
+            'status': 'mismatch' if failed else ('unvalidated' if pending else 'passed'),
+            'days_checked': len(results) - len(pending),
+            'days_failed': failed,
+            'days_pending': pending,
+            'sample_rows': sum(result.get('sample_rows', 0) for result in results.values()),
+            'details': {day: results[day] for day in failed}
+        }
 
-            # 检查是否已存在
-            cursor.execute('SELECT id FROM table_status WHERE table_name = ?', (table_name,))
-            existing = cursor.fetchone()
+    def _finish_task(self, task: MigrationTask, records: int, validation: Optional[Dict[str, Any]] = None):
+        """记录任务成功：计数、进度、待合并分区与校验（远程节点完成的任务记录其上报的校验结果）"""
+        self.total_records.increment(records)
+        self.table_records[task.target_table].increment(records)
+        self.completed_tasks.increment()
+        self.mark_day_touched(task)
+        progress = self.progress.get(task.target_table, task.date_str)
+        if progress is not None:
+            progress.finish('success')
+        logger.info(f"{task} migrated {records} records")
+        if task.worker is not None:
+            if validation:
+                self.validation_results.setdefault(task.target_table, {})[task.date_str] = validation
+        # 缓冲尚未回灌时目标端数据不完整，记为待校验
+        elif task.spilled:
+            self.validation_results.setdefault(task.target_table, {})[task.date_str] = {
+                'date': task.date_str, 'passed': False, 'pending': True, 'migrated': records,
+                'reason': 'spilled to local buffer, not yet drained'}
+        elif self.get_config('validation_enabled', True):
+            self.run_validation(task, records)
+
+    def execute_task_with_retry(self, task: MigrationTask) -> bool:
+        """执行迁移任务（失败时指数退避重试）"""
+        progress = self.progress.get(task.target_table, task.date_str)
+        recorder = self.trace_recorder
+        if not task.speculative:
+            with self.connection_lock:
+                self.running_tasks.setdefault(task.target_table, {})[task.date_str] = task
+            if recorder is not None:
+                recorder.begin(task, task.trace, threading.current_thread().name)
+        success = False
+        try:
+            with self.metrics.trace(task.trace):
+                success = self._execute_task_attempts(task, progress)
+            return success
+        finally:
+            if not task.speculative:
+                if recorder is not None:
+                    status = 'superseded' if task.race.winner is True else ('success' if success else 'failed')
+                    recorder.end(task.trace, status)
+                with self.task_finished:
+                    self.running_tasks.get(task.target_table, {}).pop(task.date_str, None)
+                    self.task_finished.notify_all()
+
+    def _execute_task_attempts(self, task: MigrationTask, progress: Optional[DayProgress]) -> bool:
+        for attempt in range(1, self.max_retries + 1):
+            if self.shutdown_event.is_set():
+                break
+            if task.race.cancelled(task.speculative):
+                logger.info(f"{task} superseded by another attempt")
+                return True
+            if progress is not None:
+                progress.start()
+            task.trace.attempts = attempt
+            try:
+                records = self.migrate_task(task)
+                if not task.race.claim(task.speculative):
+                    raise TaskCancelled()
+                self._finish_task(task, records)
+                return True
+            except TaskCancelled:
+                # 另一方已提交，由其记录结果
+                logger.info(f"{task} superseded by another attempt, cancelled")
+                self.reset_thread_connections()
+                self.discard_exports(task)
+                return True
+            except Exception as e:
+                self.last_error = f"{task.target_table} {task.date_str}: {str(e)}"
+                task.trace.errors.append(f"{type(e).__name__}: {str(e)}")
+                logger.warning(f"{task} failed (attempt {attempt}/{self.max_retries}): {str(e)}")
+                self.reset_thread_connections()
+                if attempt < self.max_retries:
+                    delay = self.retry_delay_base * (2 ** (attempt - 1)) + random.uniform(0, 1)
+                    self.shutdown_event.wait(delay)
+                    # 失败可能源于表结构变更，重试前刷新结构与投影
+                    self.schema_cache.invalidate(task.source_table)
+                    self.schema_cache.invalidate(task.target_table)
+                    try:
+                        task.columns = self.get_table_columns(task.target_table)
+                    except Exception as schema_error:
+                        logger.warning(f"Error refreshing schema for {task.target_table}: {str(schema_error)}")
+
+        if self.shutdown_event.is_set():
+            if progress is not None:
+                progress.finish('stopped')
+            self.discard_exports(task)
+            return False
+        if progress is not None:
+            progress.finish('failed')
+        self.discard_exports(task)
+        self.failed_tasks.increment()
+        logger.error(f"{task} failed after {self.max_retries} attempts")
+        return False
+
+    def _table_worker(self, table_key: str, target_table: str):
+        """表工作线程：消费表队列中的任务，队列空后对拖尾任务做推测执行"""
+        queue = self.table_queues[table_key]
+        while not self.shutdown_event.is_set():
+            try:
+                task = queue.get_nowait()
+            except Empty:
+                # 远程租约过期的任务会在等待期间重新入队
+                if self._speculate_when_idle(target_table) or not queue.empty():
+                    continue
+                break
+            try:
+                self.execute_task_with_retry(task)
+            finally:
+                queue.task_done()
 
-            if existing:
-                cursor.execute('''
-                    UPDATE table_status 
-                    SET last_sync_time = ?, records_count = ?, status = ?, last_error = ?
-                    WHERE table_name = ?
-                ''', (last_sync_time, records_count, status, last_error, table_name))
-            else:
-                cursor.execute('''
-                    INSERT INTO table_status (table_name, last_sync_time, records_count, status, last_error)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (table_name, last_sync_time, records_count, status, last_error))
+    def find_straggler(self, target_table: str) -> Optional[MigrationTask]:
+        """运行时间超过本表已完成任务耗时分位数 × 倍数的任务（每个任务只推测一次）"""
+        if not self.get_config('speculation_enabled', True) or self.get_transfer_mode(target_table) in ('pushdown', 'delta'):
+            return None
+        # 目标不可用时副本无法导入；已落盘的任务由回灌线程写入，回灌不参与提交竞争，不做推测
+        if self.spill is not None and self.spill.target_down:
+            return None
+        entries = self.progress.tables.get(target_table, [])
+        durations = sorted(entry.finished_at - entry.started_at for entry in entries
+                           if entry.state == 'success' and entry.started_at and entry.finished_at)
+        if len(durations) < self.get_config('speculation_min_samples', 3):
+            return None
+        percentile = self.get_config('speculation_percentile', 0.5)
+        baseline = durations[min(len(durations) - 1, int(len(durations) * percentile))]
+        threshold = max(baseline * self.get_config('speculation_multiplier', 2.0),
+                        self.get_config('speculation_min_seconds', 30))
 
-            db.commit()
+        now = time.monotonic()
+        with self.connection_lock:
+            stragglers = []
+            for task in self.running_tasks.get(target_table, {}).values():
+                progress = self.progress.get(target_table, task.date_str)
+                if (not task.race.speculated and task.race.winner is None and task.worker is None and not task.spilled
+                        and progress is not None and progress.state == 'running' and now - progress.started_at > threshold):
+                    stragglers.append((now - progress.started_at, task))
+            if not stragglers:
+                return None
+            elapsed, task = max(stragglers, key=lambda item: item[0])
+            task.race.speculated = True
+        logger.info(f"{task} running {elapsed:.1f}s (threshold {threshold:.1f}s), starting speculative attempt")
+        return task
+
+    def _speculate_when_idle(self, target_table: str) -> bool:
+        """空闲工作线程：本表还有任务在运行时等待拖尾任务出现并推测执行，返回是否执行了推测"""
+        while not self.shutdown_event.is_set():
+            task = self.find_straggler(target_table)
+            if task is not None:
+                self.execute_speculative(task)
+                return True
+            with self.task_finished:
+                if not self.running_tasks.get(target_table):
+                    return False
+                self.task_finished.wait(1.0)
+        return False
+
+    def execute_speculative(self, task: MigrationTask):
+        """推测执行：副本先导出到本地文件，与原执行竞争提交，获胜后删除目标日期数据并导入"""
+        clone = task.speculate()
+        self.speculated_tasks.increment()
+        try:
+            records = self._migrate_task_via_files(clone)
+        except TaskCancelled:
+            logger.info(f"{task} original attempt finished first, speculative attempt discarded")
+            return
         except Exception as e:
-            logger.error(f"Error updating table status: {str(e)}")
+            self.reset_thread_connections()
+            if clone.race.winner is not True:
+                logger.warning(f"{task} speculative attempt failed: {str(e)}")
+                return
+            # 原执行已被取消，由副本按常规任务重试
+            logger.warning(f"{task} speculative attempt failed after commit, retrying: {str(e)}")
+            self.execute_task_with_retry(clone)
+            return
+        finally:
+            self.discard_exports(clone)
+        self.speculation_wins.increment()
+        self._finish_task(clone, records)
 
-    def get_migration_history(self, limit=50):
-        """获取迁移历史"""
+    # ==================== 分布式工作节点 ====================
+
+    def lease_task(self, worker: str) -> Optional[Dict[str, Any]]:
+        """为远程工作节点分配一个任务租约（从待处理任务最多的运行中表取队首任务），没有可分配任务时返回None"""
+        if not self.is_running or self.shutdown_event.is_set():
+            return None
+        for table_key in sorted(list(self.table_workers), key=lambda key: -self.table_queues[key].qsize()):
+            # 出队与登记运行中任务在同一把锁内完成，本地工作线程不会在两者之间判定本表已结束
+            with self.connection_lock:
+                try:
+                    task = self.table_queues[table_key].get_nowait()
+                except Empty:
+                    continue
+                task.worker = worker
+                self.running_tasks.setdefault(task.target_table, {})[task.date_str] = task
+            progress = self.progress.get(task.target_table, task.date_str)
+            if progress is not None:
+                progress.start()
+            ttl = self.get_config('worker_lease_ttl', 60)
+            lease_id = self.task_leases.grant(worker, table_key, task, ttl)
+            if self.trace_recorder is not None:
+                self.trace_recorder.begin(task, task.trace, worker)
+            logger.info(f"{task} leased to {worker} ({lease_id})")
+            return {'lease_id': lease_id, 'ttl': ttl, 'source_table': task.source_table,
+                    'target_table': task.target_table, 'day': task.day, 'date': task.date_str,
+                    'task_id': task.task_id, 'priority': task.priority, 'table_index': task.table_index}
+        return None
+
+    def renew_leases(self, worker: str, rows: Dict[str, int]) -> List[str]:
+        """续约并累计远程任务进度，返回已失效的租约（工作节点应中止这些任务）"""
+        if self.shutdown_event.is_set():
+            return list(rows)
+        added, lost = self.task_leases.renew(worker, rows, self.get_config('worker_lease_ttl', 60))
+        for task, rows_added in added:
+            progress = self.progress.get(task.target_table, task.date_str)
+            if progress is not None and rows_added:
+                progress.add_rows(rows_added)
+        return lost
+
+    def complete_lease(self, worker: str, lease_id: str, records: int, error: Optional[str] = None,
+                       validation: Optional[Dict[str, Any]] = None, trace: Optional[Dict[str, Any]] = None,
+                       requeue: bool = False) -> bool:
+        """记录远程任务结果；租约已过期或被收回时返回False（任务已由其他节点重新执行）。
+        requeue为真时工作节点未能执行任务（如准备阶段连接失败），任务立即重新入队"""
+        lease = self.task_leases.release(worker, lease_id, records, error is None)
+        if lease is None:
+            logger.warning(f"{worker} reported stale lease {lease_id}, ignored")
+            return False
+        task = lease['task']
+        if requeue:
+            logger.warning(f"{task} returned by {worker} ({error}), requeued")
+            self._release_leased_task(lease, requeue=not self.shutdown_event.is_set(), status='returned')
+            return True
+        if trace:
+            task.trace.merge(trace)
+        if self.trace_recorder is not None:
+            self.trace_recorder.end(task.trace, 'success' if error is None else 'failed')
         try:
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('''
-                SELECT * FROM migration_history 
-                ORDER BY start_time DESC 
-                LIMIT ?
-            ''', (limit,))
-            return cursor.fetchall()
-        except Exception as e:
-            logger.error(f"Error getting migration history: {str(e)}")
-            return []
+            if error is None:
+                self._finish_task(task, records, validation)
+            else:
+                self.last_error = f"{task.target_table} {task.date_str}: {error}"
+                self.failed_tasks.increment()
+                progress = self.progress.get(task.target_table, task.date_str)
+                if progress is not None:
+                    progress.finish('failed')
+                logger.error(f"{task} failed on {worker}: {error}")
+        finally:
+            self._release_leased_task(lease)
+        return True
+
+    def _release_leased_task(self, lease: Dict[str, Any], requeue: bool = False, status: Optional[str] = None):
+        """租约结束：过期或交还的任务先重新入队，再从运行中任务移除并唤醒等待的本地工作线程"""
+        task = lease['task']
+        queue = self.table_queues[lease['table_key']]
+        if self.trace_recorder is not None:
+            self.trace_recorder.end(task.trace, status or ('expired' if requeue else 'revoked'))
+        if requeue:
+            task.worker = None
+            task.race = TaskRace()
+            task.trace = TaskTrace()
+            progress = self.progress.get(task.target_table, task.date_str)
+            if progress is not None:
+                progress.state = 'pending'
+            queue.put(task)
+        with self.task_finished:
+            self.running_tasks.get(task.target_table, {}).pop(task.date_str, None)
+            self.task_finished.notify_all()
+        queue.task_done()
+
+    def expire_leases(self):
+        for lease in self.task_leases.expired(self.get_config('worker_lease_grace', 30)):
+            logger.warning(f"{lease['task']} lease held by {lease['worker']} expired, requeued")
+            self._release_leased_task(lease, requeue=not self.shutdown_event.is_set())
+
+    def _lease_monitor_loop(self):
+        """迁移期间每秒收回过期租约"""
+        while not self.lease_monitor_stop.wait(1.0):
+            try:
+                self.expire_leases()
+            except Exception as e:
+                logger.error(f"Error expiring worker leases: {str(e)}")
+
+    def get_table_days(self, target_table: str, days_override: Optional[int] = None) -> int:
+        """获取表需要迁移的天数：本次运行指定 > 映射文件中的表级 days > 全局 ods_query_days / other_tables_days"""
+        if days_override:
+            return int(days_override)
+        mapping = self.TABLE_MAPPINGS.get(target_table)
+        if mapping and mapping.days:
+            return mapping.days
+        if target_table == 'ods_query':
+            return self.get_config('ods_query_days', 24)
+        return self.get_config('other_tables_days', 60)
+
+    @staticmethod
+    def get_task_dates(days: int) -> List[str]:
+        """迁移日期列表：今天（上海时区）起往前days天，近期在前"""
+        today = datetime.now(timezone('Asia/Shanghai')).date()
+        return [(today - timedelta(days=day)).strftime('%Y-%m-%d') for day in range(days)]
+
+    def create_table_tasks(self, source_table: str, target_table: str, days: int,
+                           table_index: int) -> List[MigrationTask]:
+        """创建单个表的按天迁移任务（近期优先）"""
+        columns = self.get_table_columns(target_table)
+
+        tasks = []
+        for day, date_str in enumerate(self.get_task_dates(days)):
+            self.progress.register(target_table, date_str)
+            tasks.append(MigrationTask(source_table, target_table, day, date_str, columns,
+                                       task_id=self.task_counter.increment(), priority=day,
+                                       table_index=table_index))
+        return tasks
+
+    def run_table_migration(self, source_table: str, target_table: str, days: int, table_index: int) -> bool:
+        """迁移单个表（表内多线程并行）"""
+        table_key = f"{source_table}_{target_table}"
+        queue = self.table_queues[table_key]
+        failed_before = self.failed_tasks.get()
+        self.update_table_status(target_table, datetime.now(), 0, 'syncing')
 
-    def get_table_status(self):
-        """获取所有表状态"""
         try:
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('SELECT * FROM table_status ORDER BY table_name')
-            return cursor.fetchall()
+            for task in self.create_table_tasks(source_table, target_table, days, table_index):
+                queue.put(task)
+
+            workers = self.TABLE_MAPPINGS[target_table].workers or self.max_workers_per_table
+            with ThreadPoolExecutor(max_workers=workers,
+                                    thread_name_prefix=f"Worker-{target_table}") as executor:
+                self.table_workers[table_key] = executor
+                futures = [executor.submit(self._table_worker, table_key, target_table) for _ in range(workers)]
+                wait(futures)
         except Exception as e:
-            logger.error(f"Error getting table status: {str(e)}")
-            return []
+            self.last_error = f"{target_table}: {str(e)}"
+            logger.error(f"Error migrating table {target_table}: {str(e)}", exc_info=True)
+            self.update_table_status(target_table, datetime.now(), self.table_records[target_table].get(),
+                                     'failed', str(e))
+            return False
+        finally:
+            self.table_workers.pop(table_key, None)
+
+        success = self.failed_tasks.get() == failed_before and not self.shutdown_event.is_set()
+        self.update_table_status(target_table, datetime.now(), self.table_records[target_table].get(),
+                                 'success' if success else 'failed', None if success else self.last_error,
+                                 validation=self.get_validation_summary(target_table))
+        return success
+
+    def run_all_tables_parallel(self, tables: Optional[List[str]] = None,
+                                days_override: Optional[int] = None) -> bool:
+        """所有表并行迁移（每个表一个线程，表内再分配工作线程）"""
+        self.schema_cache.ttl = self.get_config('schema_cache_ttl', 3600)
+        self.validation_results = {}
+        results = {}
+
+        def run_table(source_table, target_table, table_index):
+            days = self.get_table_days(target_table, days_override)
+            results[target_table] = self.run_table_migration(source_table, target_table, days, table_index)
+
+        for table_index, (source_table, target_table) in enumerate(zip(self.SOURCE_TABLES, self.TARGET_TABLES)):
+            if tables and source_table not in tables and target_table not in tables:
+                continue
+            self.table_records[target_table] = ThreadSafeCounter()
+            thread = threading.Thread(target=run_table, args=(source_table, target_table, table_index),
+                                      name=f"Table-{target_table}", daemon=True)
+            self.table_threads[target_table] = thread
+            thread.start()
 
-    # ... 这里省略了其他方法，保持代码长度合理
-    # 完整的数据迁移方法需要从之前的代码中复制过来
+        for thread in list(self.table_threads.values()):
+            thread.join()
+        self.table_threads.clear()
+
+        return bool(results) and all(results.values())
 
     def run_daily_migration_job(self, tables=None, days_override=None):
         """运行每日迁移任务（Web版本）"""
@@ -522,16 +4473,34 @@ class DataMigrationApp:
             return {"success": False, "message": "Migration is already running"}
 
         self.is_running = True
+        self.shutdown_event.clear()
+        self.source_monitor_stop.clear()
+        monitor = threading.Thread(target=self._source_monitor_loop, name="SourceMonitor", daemon=True)
+        monitor.start()
+        self.parts_monitor_stop.clear()
+        parts_monitor = threading.Thread(target=self._parts_monitor_loop, args=(tables or self.TARGET_TABLES,),
+                                         name="PartsMonitor", daemon=True)
+        parts_monitor.start()
+        self.lease_monitor_stop.clear()
+        lease_monitor = threading.Thread(target=self._lease_monitor_loop, name="LeaseMonitor", daemon=True)
+        lease_monitor.start()
+        # 上次停止时尚未回灌的批次
+        if self.spill is not None and self.spill.manifest:
+            self.ensure_spill_drainer()
         self.current_migration_id = None
         self.migration_start_time = datetime.now()
         self.last_error = None
-        self.progress_info = {}
+        self.progress.reset(self.get_progress_estimates())
 
         # 重置统计
         self.task_counter.value = 0
         self.completed_tasks.value = 0
         self.failed_tasks.value = 0
         self.total_records.value = 0
+        self.speculated_tasks.value = 0
+        self.speculation_wins.value = 0
+        self.trace_recorder = (TraceRecorder(self.get_trace_settings(), self.get_config('trace_rss_interval', 0.5))
+                               if self.get_config('trace_enabled', True) else None)
 
         logger.info("=" * 60)
         logger.info(f"Starting migration job at {self.migration_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -549,11 +4518,7 @@ class DataMigrationApp:
             )
             self.current_migration_id = migration_id
 
-            # 这里调用实际的数据迁移逻辑
-            # 由于代码较长，这里省略具体实现
-            # 需要从之前的代码中复制 run_all_tables_parallel 方法
-
-            success = True  # 假设迁移成功
+            success = self.run_all_tables_parallel(tables=tables, days_override=days_override)
 
             if success:
                 logger.info("Migration job completed successfully")
@@ -616,7 +4581,290 @@ class DataMigrationApp:
             }
         finally:
             self.is_running = False
-            self.close_all_connections()
+            self.source_monitor_stop.set()
+            self.parts_monitor_stop.set()
+            self.lease_monitor_stop.set()
+            monitor.join(timeout=5)
+            parts_monitor.join(timeout=5)
+            lease_monitor.join(timeout=5)
+            self.save_trace()
+            self.schedule_optimize()
+            # CDC、回灌、合并等后台线程可能正在写入，只关闭本次迁移已结束线程的连接
+            self.close_finished_connections()
+
+    # ==================== 运行trace ====================
+
+    def get_trace_settings(self) -> Dict[str, Any]:
+        """trace中记录的调度参数（dataSim.py 以此为回放基准）"""
+        return {
+            'workers_per_table': self.max_workers_per_table,
+            'batch_size': self.batch_size,
+            'mysql_max_concurrency': self.get_config('mysql_max_concurrency', 0),
+            'tables': {mapping.target_table: {'workers': mapping.workers or self.max_workers_per_table,
+                                              'batch_size': mapping.batch_size or self.batch_size,
+                                              'priority': mapping.priority,
+                                              'transfer_mode': self.get_transfer_mode(mapping.target_table)}
+                       for mapping in self.TABLE_MAPPINGS.values()}
+        }
+
+    def save_trace(self):
+        """把本次运行的任务trace写入migration.db"""
+        recorder, self.trace_recorder = self.trace_recorder, None
+        if recorder is None:
+            return
+        recorder.stop()
+        if not recorder.tasks:
+            return
+        try:
+            db = get_db()
+            cursor = db.cursor()
+            cursor.execute('''
+                INSERT INTO migration_traces (migration_id, start_time, duration_seconds, settings, base_rss, peak_rss)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (self.current_migration_id, self.migration_start_time, time.monotonic() - recorder.started,
+                  json.dumps(recorder.settings), recorder.base_rss, recorder.peak_rss))
+            trace_id = cursor.lastrowid
+            rows = []
+            for task, trace in recorder.tasks:
+                data = trace.to_dict()
+                stages = data['stages']
+                duration = trace.duration or 0.0
+                rows.append((trace_id, task.target_table, task.date_str, task.priority, trace.worker,
+                             trace.start_offset, trace.duration, trace.status or 'unfinished', data['attempts'],
+                             data['rows'], data['bytes'], data['batches'],
+                             stages.get('mysql_query', 0.0) + stages.get('mysql_fetch', 0.0),
+                             stages.get('convert', 0.0), stages.get('clickhouse_insert', 0.0), json.dumps(stages),
+                             trace.busy / duration if duration > 0 else 1.0, json.dumps(data['errors'])))
+            cursor.executemany('''
+                INSERT INTO migration_trace_tasks
+                (trace_id, target_table, task_date, priority, worker, start_offset, duration, status, attempts,
+                 rows, bytes, batches, read_seconds, convert_seconds, insert_seconds, stages, concurrency, errors)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            db.commit()
+            logger.info(f"Saved trace {trace_id} with {len(rows)} tasks")
+        except Exception as e:
+            logger.error(f"Error saving migration trace: {str(e)}")
+
+    # ==================== 迁移预估 ====================
+
+    def get_history_throughput(self, limit: int = 10) -> Optional[float]:
+        """根据最近成功的迁移历史估算单表吞吐（行/秒）：总吞吐按当次并行的表数平均"""
+        try:
+            db = get_db()
+            cursor = db.cursor()
+            cursor.execute('''
+                SELECT tables_migrated, total_records, duration_seconds FROM migration_history
+                WHERE status = 'success' AND total_records > 0 AND duration_seconds > 0
+                ORDER BY id DESC LIMIT ?
+            ''', (limit,))
+            rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error reading migration history: {str(e)}")
+            return None
+        rates = []
+        for row in rows:
+            table_count = len(self.TARGET_TABLES) if row['tables_migrated'] == 'all' \
+                else len(row['tables_migrated'].split(','))
+            rates.append(row['total_records'] / row['duration_seconds'] / max(table_count, 1))
+        return sum(rates) / len(rates) if rates else None
+
+    def _load_source_stats(self, conn, shard: SourceShard) -> Dict[str, Any]:
+        """information_schema.TABLES中的行数与平均行长（InnoDB为估算值）"""
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
+            ''', (self.MYSQL_SOURCES[shard.profile]['database'], shard.source_table))
+            row = cursor.fetchone()
+        if not row:
+            raise ValueError(f"Table {shard.source_table} not found")
+        return {'table_rows': int(row[0] or 0), 'avg_row_length': int(row[1] or 0), 'data_length': int(row[2] or 0)}
+
+    def _explain_day_rows(self, conn, target_table: str, shard: SourceShard, date_str: str) -> Optional[int]:
+        """优化器估算的某天行数（EXPLAIN，不实际扫描）"""
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN SELECT 1 FROM `{shard.source_table}` "
+                           f"WHERE `{self.DATE_COLUMNS[target_table]}` = %s", (date_str,))
+            names = [description[0] for description in cursor.description]
+            row = cursor.fetchone()
+        if not row or 'rows' not in names:
+            return None
+        return int(row[names.index('rows')] or 0)
+
+    def plan_migration(self, tables: Optional[List[str]] = None, days_override: Optional[int] = None,
+                       explain: bool = True) -> Dict[str, Any]:
+        """迁移预估（不执行迁移）：按表按天估算行数、字节数与耗时
+
+        使用本次预估专用的源库连接（结束时关闭），不占用也不泄漏工作线程的线程级连接。
+        """
+        connections = {}
+
+        def connection(profile: str):
+            if profile not in connections:
+                connections[profile] = self._create_mysql_connection(profile)
+            return connections[profile]
+
+        try:
+            return self._plan_migration(connection, tables, days_override, explain)
+        finally:
+            for conn in connections.values():
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def _plan_migration(self, connection, tables: Optional[List[str]], days_override: Optional[int],
+                        explain: bool) -> Dict[str, Any]:
+        table_rate = self.get_history_throughput()
+        seed_estimates = self.get_progress_estimates()
+        rows_limit = self.get_config('mysql_rows_per_sec', 0)
+        planned = [(source, target) for source, target in zip(self.SOURCE_TABLES, self.TARGET_TABLES)
+                   if not tables or source in tables or target in tables]
+
+        # 所有表并行：限流时每表分得总行速率的一部分
+        if table_rate and rows_limit:
+            table_rate = min(table_rate, rows_limit / max(len(planned), 1))
+
+        result_tables = []
+        errors = []
+        for source_table, target_table in planned:
+            mapping = self.TABLE_MAPPINGS[target_table]
+            days = self.get_table_days(target_table, days_override)
+            dates = self.get_task_dates(days)
+            day_rows = {date_str: 0 for date_str in dates}
+            day_sources = {date_str: set() for date_str in dates}
+            avg_row_length = 0
+            table_rows = 0
+
+            # 每个分片只EXPLAIN一个代表日（最近的完整一天，今天的数据尚未写完），结果用于所有日期
+            sample_date = dates[1] if len(dates) > 1 else dates[0]
+            for shard in mapping.shards:
+                try:
+                    stats = self._load_source_stats(connection(shard.profile), shard)
+                except Exception as e:
+                    errors.append(f"{shard.profile}:{shard.source_table}: {str(e)}")
+                    stats = {'table_rows': 0, 'avg_row_length': 0, 'data_length': 0}
+                table_rows += stats['table_rows']
+                avg_row_length = max(avg_row_length, stats['avg_row_length'])
+
+                explained = None
+                if explain:
+                    try:
+                        explained = self._explain_day_rows(connection(shard.profile), target_table, shard, sample_date)
+                    except Exception as e:
+                        errors.append(f"{shard.profile}:{shard.source_table} {sample_date}: {str(e)}")
+                        explain = False
+                for date_str in dates:
+                    rows = explained
+                    if rows is not None:
+                        day_sources[date_str].add('explain')
+                    elif target_table in seed_estimates:
+                        # 上次同步的每天平均行数已包含所有分片
+                        rows = seed_estimates[target_table] / len(mapping.shards)
+                        day_sources[date_str].add('history')
+                    else:
+                        rows = 0
+                        day_sources[date_str].add('unknown')
+                    day_rows[date_str] += rows
+
+            details = []
+            for date_str in dates:
+                rows = int(day_rows[date_str])
+                details.append({
+                    'date': date_str,
+                    'rows': rows,
+                    'bytes': rows * avg_row_length,
+                    'seconds': round(rows / table_rate, 1) if table_rate else None,
+                    'source': '+'.join(sorted(day_sources[date_str]))
+                })
+            total_rows = sum(detail['rows'] for detail in details)
+            result_tables.append({
+                'source_table': source_table,
+                'target_table': target_table,
+                'days': days,
+                'workers': mapping.workers or self.max_workers_per_table,
+                'shards': len(mapping.shards),
+                'source_table_rows': table_rows,
+                'avg_row_length': avg_row_length,
+                'rows': total_rows,
+                'bytes': total_rows * avg_row_length,
+                'seconds': round(total_rows / table_rate, 1) if table_rate else None,
+                'days_detail': details
+            })
+
+        seconds = [table['seconds'] for table in result_tables if table['seconds'] is not None]
+        return {
+            'tables': result_tables,
+            'total_rows': sum(table['rows'] for table in result_tables),
+            'total_bytes': sum(table['bytes'] for table in result_tables),
+            # 各表并行执行，总耗时取最慢的表
+            'estimated_seconds': max(seconds) if seconds else None,
+            'table_rows_per_sec': round(table_rate, 1) if table_rate else None,
+            'errors': errors
+        }
+
+    def get_schedules(self) -> List[Dict[str, Any]]:
+        """获取调度计划；未配置时以 schedule_time 为起点按表错峰生成"""
+        schedules = self.get_config('schedules')
+        if schedules:
+            return schedules
+
+        hour, minute = (int(part) for part in self.get_config('schedule_time', '09:00').split(':'))
+        # ods_query 每小时刷新近期数据
+        schedules = [{'name': 'ods_query_recent', 'tables': ['ods_query'],
+                      'cron': f'{(minute + 30) % 60} * * * *', 'days': 2}]
+        # 全量窗口每天一次，每个表间隔一小时，避免同一时刻压两端数据库
+        for offset, target_table in enumerate(self.TARGET_TABLES):
+            schedules.append({'name': target_table, 'tables': [target_table],
+                              'cron': f'{minute} {(hour + offset) % 24} * * *', 'days': None})
+        return schedules
+
+    def _load_config_value(self, key: str) -> Optional[str]:
+        """读取持久化配置项"""
+        try:
+            cursor = get_db().cursor()
+            cursor.execute('SELECT config_value FROM migration_config WHERE config_key = ?', (key,))
+            row = cursor.fetchone()
+            return row['config_value'] if row else None
+        except Exception as e:
+            logger.error(f"Error loading config {key}: {str(e)}")
+            return None
+
+    def _save_config_value(self, key: str, value: str):
+        """保存持久化配置项"""
+        try:
+            db = get_db()
+            db.execute('INSERT OR REPLACE INTO migration_config (config_key, config_value) VALUES (?, ?)',
+                       (key, value))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error saving config {key}: {str(e)}")
+
+    def _plan_schedules(self, schedules: List[Dict[str, Any]], now: datetime) -> Dict[str, Dict[str, Any]]:
+        """计算各调度的下次触发时间（停机期间错过的运行合并为一次立即补跑）"""
+        plans = {}
+        for entry in schedules:
+            cron = CronExpression(entry['cron'])
+            last_run = self._load_config_value(f"schedule_last_run:{entry['name']}")
+            next_fire = cron.next_fire(datetime.fromisoformat(last_run) if last_run else now)
+            if next_fire <= now:
+                if self.get_config('schedule_catch_up', True):
+                    logger.info(f"Schedule {entry['name']} missed run at {next_fire}, catching up")
+                else:
+                    next_fire = cron.next_fire(now)
+            plans[entry['name']] = {'entry': entry, 'cron': cron, 'next_fire': next_fire}
+        return plans
+
+    def get_scheduler_status(self) -> Dict[str, Any]:
+        """调度器状态"""
+        running = bool(self.scheduler_thread and self.scheduler_thread.is_alive())
+        next_runs = []
+        for name, plan in sorted(self.scheduler_plans.items(), key=lambda item: item[1]['next_fire']):
+            next_runs.append({'name': name, 'tables': plan['entry']['tables'], 'cron': plan['cron'].expression,
+                              'days': plan['entry'].get('days'), 'next_fire': plan['next_fire'].isoformat()})
+        return {'running': running, 'timezone': self.get_config('schedule_timezone', 'Asia/Shanghai'),
+                'next_runs': next_runs}
 
     def start_scheduler(self):
         """启动定时任务调度器"""
@@ -626,47 +4874,65 @@ class DataMigrationApp:
         if not self.schedule_enabled:
             return {"success": False, "message": "Schedule is disabled in config"}
 
+        try:
+            schedules = self.get_schedules()
+            tz = timezone(self.get_config('schedule_timezone', 'Asia/Shanghai'))
+            self.scheduler_plans = self._plan_schedules(schedules, datetime.now(tz).replace(tzinfo=None))
+        except Exception as e:
+            return {"success": False, "message": f"Invalid schedule: {str(e)}"}
+
         def run_scheduler():
-            """运行调度器"""
+            """运行调度器：睡眠到最近一次触发时间，按顺序执行到期的调度"""
             try:
-                # 设置北京时区
-                beijing_tz = timezone('Asia/Shanghai')
-
-                # 清除现有任务
-                schedule.clear()
-
-                # 设置定时任务
-                schedule_time = self.get_config('schedule_time', '09:00')
-                schedule.every().day.at(schedule_time).do(self.run_daily_migration_job)
-
-                logger.info(f"Scheduler started. Next run at {schedule_time} Beijing time")
-
-                while not self.shutdown_event.is_set():
-                    schedule.run_pending()
-                    time.sleep(60)  # 每分钟检查一次
+                logger.info(f"Scheduler started ({tz.zone}), schedules: "
+                            + ', '.join(f"{name}[{plan['cron'].expression}]"
+                                        for name, plan in self.scheduler_plans.items()))
+
+                while not self.scheduler_stop.is_set():
+                    name, plan = min(self.scheduler_plans.items(), key=lambda item: item[1]['next_fire'])
+                    now = datetime.now(tz).replace(tzinfo=None)
+                    delay = (plan['next_fire'] - now).total_seconds()
+                    if delay > 0:
+                        self.scheduler_stop.wait(delay)
+                        continue
+
+                    # 手动任务运行中时等待其结束
+                    while self.is_running and not self.scheduler_stop.wait(5):
+                        pass
+                    if self.scheduler_stop.is_set():
+                        break
+
+                    entry = plan['entry']
+                    logger.info(f"Schedule {name} fired (planned {plan['next_fire']}), tables={entry['tables']}")
+                    self.run_daily_migration_job(tables=entry['tables'], days_override=entry.get('days'))
+
+                    self._save_config_value(f"schedule_last_run:{name}", plan['next_fire'].isoformat())
+                    finished = datetime.now(tz).replace(tzinfo=None)
+                    plan['next_fire'] = plan['cron'].next_fire(max(plan['next_fire'], finished))
 
             except Exception as e:
-                logger.error(f"Scheduler error: {str(e)}")
+                logger.error(f"Scheduler error: {str(e)}", exc_info=True)
             finally:
                 logger.info("Scheduler stopped")
 
         # 启动调度器线程
+        self.scheduler_stop.clear()
         self.scheduler_thread = threading.Thread(target=run_scheduler, name="Scheduler", daemon=True)
         self.scheduler_thread.start()
 
         return {"success": True,
-                "message": f"Scheduler started. Will run daily at {self.get_config('schedule_time', '09:00')}"}
+                "message": f"Scheduler started with {len(self.scheduler_plans)} schedules",
+                "scheduler": self.get_scheduler_status()}
 
     def stop_scheduler(self):
         """停止定时任务调度器"""
-        self.shutdown_event.set()
+        self.scheduler_stop.set()
 
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
             self.scheduler_thread = None
 
-        schedule.clear()
-        self.shutdown_event.clear()
+        self.scheduler_plans = {}
 
         return {"success": True, "message": "Scheduler stopped"}
 
@@ -676,6 +4942,9 @@ class DataMigrationApp:
             return {"success": False, "message": "No migration is running"}
 
         self.shutdown()
+        # 已落盘的批次不随迁移停止而丢弃，继续在后台回灌
+        if self.spill is not None and self.spill.manifest:
+            self.ensure_spill_drainer()
 
         # 更新迁移历史
         if self.current_migration_id:
@@ -705,10 +4974,39 @@ class DataMigrationApp:
                 except Empty:
                     break
 
+        # 远程节点在下次续约时得知租约失效并中止写入
+        for lease in self.task_leases.revoke_all():
+            self._release_leased_task(lease)
+
+        self.spill_stop.set()
+        self.cdc_stop.set()
+        self.optimize_stop.set()
+        if self.shard_executor is not None:
+            self.shard_executor.shutdown(wait=False, cancel_futures=True)
+            self.shard_executor = None
+
         # 关闭所有连接
         self.close_all_connections()
         logger.info("Shutdown completed")
 
+    def close_finished_connections(self):
+        """关闭已结束线程与当前线程的连接；仍在运行的线程（CDC、回灌、合并、Web请求）继续使用各自的连接"""
+        current = threading.get_ident()
+        alive = {thread.ident for thread in threading.enumerate()} - {current}
+        with self.connection_lock:
+            resources = [self.clickhouse_clients.pop(key) for key in list(self.clickhouse_clients) if key not in alive]
+            resources += [self.mysql_connections.pop(key) for key in list(self.mysql_connections)
+                          if key[1] not in alive]
+            # 共享的HTTP连接池只在没有客户端使用时清空
+            idle_pool = not self.clickhouse_clients
+        for resource in resources:
+            try:
+                resource.close()
+            except:
+                pass
+        if idle_pool and self.http_pool is not None:
+            self.http_pool.clear()
+
     def close_all_connections(self):
         """关闭所有连接"""
         with self.connection_lock:
@@ -727,9 +5025,14 @@ class DataMigrationApp:
             self.clickhouse_clients.clear()
             self.mysql_connections.clear()
 
+        if self.http_pool is not None:
+            self.http_pool.clear()
+
 
-# 初始化应用
-migration_app = DataMigrationApp(max_workers_per_table=4, schedule_enabled=False)
+# 初始化应用；dataWorker.py 等只使用 DataMigrationApp 类的脚本设置 MIGRATION_APP_DISABLED=1，
+# 导入时不创建这个实例（否则它会接管并回灌本机默认落盘目录）
+migration_app = (None if os.environ.get('MIGRATION_APP_DISABLED') == '1'
+                 else DataMigrationApp(max_workers_per_table=4, schedule_enabled=False))
 
 
 # 在应用关闭时清理
@@ -752,7 +5055,8 @@ def index():
                            history=history,
                            table_status=table_status,
                            source_tables=migration_app.SOURCE_TABLES,
-                           target_tables=migration_app.TARGET_TABLES)
+                           target_tables=migration_app.TARGET_TABLES,
+                           table_mappings=migration_app.get_table_mappings())
 
 
 @app.route('/api/status')
@@ -762,6 +5066,75 @@ def api_status():
     return jsonify(status)
 
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus指标"""
+    status = migration_app.get_status()
+    gauges = {
+        'migration_running': 1 if status['is_running'] else 0,
+        'migration_tasks_completed': status['completed_tasks'],
+        'migration_tasks_failed': status['failed_tasks'],
+        'migration_records': status['total_records'],
+        'migration_spilled_records': migration_app.spilled_records.get(),
+        'migration_source_throttle_factor': status['source_limiter']['factor'],
+        'migration_source_active_queries': status['source_limiter']['active_queries'],
+        'migration_parts_throttled_seconds': status['parts_throttle']['throttled_seconds'],
+        'migration_optimize_pending_partitions': sum(len(ids) for ids in status['optimize_pending'].values()),
+        'migration_speculative_tasks': status['speculation']['started'],
+        'migration_speculative_wins': status['speculation']['won'],
+        'migration_remote_leases': len(status['remote_workers']['leases'])
+    }
+    if status['spill']:
+        gauges['migration_spill_files'] = status['spill']['files']
+        gauges['migration_spill_bytes'] = status['spill']['bytes']
+        gauges['migration_clickhouse_down'] = 1 if status['spill']['target_down'] else 0
+    return Response(migration_app.metrics.render_prometheus(gauges),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/profile/start', methods=['POST'])
+def api_profile_start():
+    """API: 对运行中的迁移启动剖析（cprofile / sampling）"""
+    data = request.json or {}
+    try:
+        result = migration_app.profiler.start(
+            mode=data.get('mode', 'sampling'),
+            seconds=data.get('seconds', 30),
+            interval=data.get('interval', 0.01),
+            trace_memory=data.get('tracemalloc', True),
+            top=data.get('top', 30)
+        )
+    except (TypeError, ValueError) as e:
+        result = {"success": False, "message": f"Invalid profile parameters: {str(e)}"}
+    return jsonify(result)
+
+
+@app.route('/api/profile/result')
+def api_profile_result():
+    """API: 获取剖析结果（format=json / collapsed / pstats）"""
+    output_format = request.args.get('format', 'json')
+
+    if output_format == 'pstats':
+        with tempfile.NamedTemporaryFile(suffix='.pstats', delete=False) as f:
+            path = f.name
+        try:
+            if not migration_app.profiler.dump_pstats(path):
+                return jsonify({"success": False, "message": "No cProfile result available"})
+            with open(path, 'rb') as f:
+                payload = f.read()
+        finally:
+            os.remove(path)
+        return Response(payload, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename=migration.pstats'})
+
+    status = migration_app.profiler.get_result()
+    if output_format == 'collapsed':
+        result = status['result'] or {}
+        return Response(result.get('collapsed', ''), mimetype='text/plain; charset=utf-8')
+
+    return jsonify({"success": True, **status})
+
+
 @app.route('/api/start', methods=['POST'])
 def api_start():
     """API: 开始迁移"""
@@ -776,9 +5149,15 @@ def api_start():
                 "message": "Migration is already running"
             })
 
+        if days is not None and (not isinstance(days, int) or isinstance(days, bool) or days <= 0):
+            return jsonify({
+                "success": False,
+                "message": "days must be a positive integer"
+            })
+
         # 启动迁移（异步）
         def run_migration():
-            migration_app.run_daily_migration_job(tables=tables if tables else None)
+            migration_app.run_daily_migration_job(tables=tables if tables else None, days_override=days)
 
         migration_thread = threading.Thread(target=run_migration, name="MigrationJob", daemon=True)
         migration_thread.start()
@@ -796,6 +5175,24 @@ def api_start():
         })
 
 
+@app.route('/api/plan', methods=['POST'])
+def api_plan():
+    """API: 迁移预估（参数同 /api/start，不执行迁移）"""
+    data = request.json or {}
+    tables = data.get('tables', [])
+    days = data.get('days', None)
+    if days is not None and (not isinstance(days, int) or isinstance(days, bool) or days <= 0):
+        return jsonify({"success": False, "message": "days must be a positive integer"})
+
+    try:
+        plan = migration_app.plan_migration(tables=tables if tables else None, days_override=days,
+                                            explain=data.get('explain', True))
+    except Exception as e:
+        logger.error(f"Error planning migration: {str(e)}")
+        return jsonify({"success": False, "message": f"Error planning migration: {str(e)}"})
+    return jsonify({"success": True, **plan})
+
+
 @app.route('/api/stop', methods=['POST'])
 def api_stop():
     """API: 停止迁移"""
@@ -803,11 +5200,30 @@ def api_stop():
     return jsonify(result)
 
 
+@app.route('/api/cdc/start', methods=['POST'])
+def api_cdc_start():
+    """API: 启动binlog增量同步"""
+    data = request.json or {}
+    try:
+        result = migration_app.start_cdc(tables=data.get('tables') or None)
+    except Exception as e:
+        logger.error(f"Error starting CDC: {str(e)}")
+        result = {"success": False, "message": f"Error starting CDC: {str(e)}"}
+    return jsonify(result)
+
+
+@app.route('/api/cdc/stop', methods=['POST'])
+def api_cdc_stop():
+    """API: 停止binlog增量同步"""
+    return jsonify(migration_app.stop_cdc())
+
+
 @app.route('/api/scheduler/start', methods=['POST'])
 def api_scheduler_start():
     """API: 启动调度器"""
     data = request.json or {}
     schedule_time = data.get('schedule_time', '09:00')
+    schedules = data.get('schedules')
 
     # 验证时间格式
     try:
@@ -818,6 +5234,20 @@ def api_scheduler_start():
             "message": "Invalid time format. Use HH:MM"
         })
 
+    # 验证自定义调度（cron表达式）
+    if schedules:
+        try:
+            for entry in schedules:
+                CronExpression(entry['cron'])
+                if not entry.get('name') or not entry.get('tables'):
+                    raise ValueError("each schedule needs name, tables and cron")
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({
+                "success": False,
+                "message": f"Invalid schedules: {str(e)}"
+            })
+        migration_app.set_config('schedules', schedules)
+
     migration_app.set_config('schedule_time', schedule_time)
     migration_app.set_config('schedule_enabled', True)
 
@@ -837,10 +5267,47 @@ def api_scheduler_stop():
 def api_config():
     """API: 获取/更新配置"""
     if request.method == 'GET':
-        return jsonify(migration_app.config)
+        return jsonify({**migration_app.config, 'table_mappings': migration_app.get_table_mappings()})
     else:
         data = request.json or {}
 
+        # 表映射热加载：指定新文件或重新读取当前文件
+        mapping_file = data.pop('mapping_file', None)
+        if mapping_file:
+            try:
+                mapping_file = resolve_mapping_file(str(mapping_file))
+            except ValueError as e:
+                return jsonify({"success": False, "message": str(e)})
+        if mapping_file or data.pop('reload_mappings', False):
+            result = migration_app.reload_table_mappings(mapping_file)
+            if not result['success']:
+                return jsonify(result)
+
+        if 'spill_dir' in data:
+            return jsonify({"success": False, "message": "spill_dir can only be set with the SPILL_DIR environment variable"})
+        if data.get('transfer_mode', 'insert') not in TRANSFER_MODES:
+            return jsonify({"success": False, "message": f"Unknown transfer_mode: {data['transfer_mode']}"})
+        for key in SOURCE_LIMIT_KEYS + PARTS_THROTTLE_KEYS + ('log_rate_limit', 'log_rate_interval'):
+            if key in data and (not isinstance(data[key], (int, float)) or data[key] < 0):
+                return jsonify({"success": False, "message": f"{key} must be a non-negative number"})
+        if data.get('read_mode', 'stream') not in READ_MODES:
+            return jsonify({"success": False, "message": f"Unknown read_mode: {data['read_mode']}"})
+        if data.get('source_decode', 'default') not in SOURCE_DECODE_MODES:
+            return jsonify({"success": False, "message": f"Unknown source_decode: {data['source_decode']}"})
+        if data.get('export_format', 'Native') not in EXPORT_WRITERS:
+            return jsonify({"success": False, "message": f"Unknown export_format: {data['export_format']}"})
+        if 'delta_buckets' in data and (not isinstance(data['delta_buckets'], int) or data['delta_buckets'] < 1):
+            return jsonify({"success": False, "message": "delta_buckets must be a positive integer"})
+        if 'trace_rss_interval' in data and (not isinstance(data['trace_rss_interval'], (int, float))
+                                             or isinstance(data['trace_rss_interval'], bool)
+                                             or data['trace_rss_interval'] <= 0):
+            return jsonify({"success": False, "message": "trace_rss_interval must be a positive number"})
+        if 'optimize_window' in data:
+            try:
+                parse_optimize_window(data['optimize_window'])
+            except ValueError:
+                return jsonify({"success": False, "message": "optimize_window must look like 02:00-06:00"})
+
         for key, value in data.items():
             if key in migration_app.config:
                 migration_app.set_config(key, value)
@@ -848,10 +5315,95 @@ def api_config():
         return jsonify({
             "success": True,
             "message": "Configuration updated",
-            "config": migration_app.config
+            "config": migration_app.config,
+            "tables": migration_app.get_table_mappings()
+        })
+
+
+@app.route('/api/schema')
+def api_schema():
+    """API: 表结构漂移报告（refresh=1 时忽略缓存重新检查）"""
+    try:
+        if request.args.get('refresh', 0, type=int):
+            migration_app.schema_cache.invalidate()
+            for target_table in migration_app.TARGET_TABLES:
+                migration_app.check_schema(target_table)
+        return jsonify({
+            "success": True,
+            "tables": migration_app.schema_reports
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Schema check failed: {str(e)}"
         })
 
 
+@app.route('/api/slow-queries')
+def api_slow_queries():
+    """API: 最近的源库慢查询"""
+    return jsonify({
+        "success": True,
+        "threshold_seconds": migration_app.get_config('slow_query_seconds', 5.0),
+        "total": migration_app.slow_query_count.get(),
+        "queries": list(migration_app.slow_queries)[::-1]
+    })
+
+
+@app.route('/api/worker/lease', methods=['POST'])
+def api_worker_lease():
+    """API: 远程工作节点领取任务租约"""
+    data = request.json or {}
+    if not data.get('worker'):
+        return jsonify({"success": False, "message": "worker is required"})
+    return jsonify({"success": True, "running": migration_app.is_running,
+                    "lease": migration_app.lease_task(data['worker'])})
+
+
+@app.route('/api/worker/heartbeat', methods=['POST'])
+def api_worker_heartbeat():
+    """API: 远程工作节点续约（leases: {租约: 已写入行数}），返回已失效的租约"""
+    data = request.json or {}
+    if not data.get('worker'):
+        return jsonify({"success": False, "message": "worker is required"})
+    lost = migration_app.renew_leases(data['worker'], data.get('leases') or {})
+    return jsonify({"success": True, "lost": lost})
+
+
+@app.route('/api/worker/complete', methods=['POST'])
+def api_worker_complete():
+    """API: 远程工作节点上报任务结果"""
+    data = request.json or {}
+    if not data.get('worker') or not data.get('lease_id'):
+        return jsonify({"success": False, "message": "worker and lease_id are required"})
+    accepted = migration_app.complete_lease(data['worker'], data['lease_id'], int(data.get('records') or 0),
+                                            data.get('error'), data.get('validation'), data.get('trace'),
+                                            requeue=bool(data.get('requeue')) and bool(data.get('error')))
+    return jsonify({"success": accepted,
+                    "message": "Result recorded" if accepted else "Lease expired or revoked"})
+
+
+@app.route('/api/workers')
+def api_workers():
+    """API: 远程工作节点与租约"""
+    return jsonify({"success": True, **migration_app.task_leases.snapshot()})
+
+
+@app.route('/api/logs')
+def api_logs():
+    """API: 最近的日志（内存环形缓冲，after为上次读取到的序号）"""
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 500, type=int)
+    level = logging.getLevelName(request.args.get('level', 'DEBUG').upper())
+    if not isinstance(level, int):
+        return jsonify({"success": False, "message": f"Unknown level: {request.args['level']}"})
+    return jsonify({
+        "success": True,
+        "last": log_buffer.sequence,
+        "logs": log_buffer.since(after, level, limit)
+    })
+
+
 @app.route('/api/history')
 def api_history():
     """API: 获取迁移历史"""
@@ -1146,6 +5698,7 @@ def create_templates():
                                         <th>最后同步时间</th>
                                         <th>记录数</th>
                                         <th>状态</th>
+                                        <th>数据校验</th>
                                         <th>最后错误</th>
                                     </tr>
                                 </thead>
@@ -1217,7 +5770,6 @@ def create_templates():
             // 清空日志按钮
             document.getElementById('clear-logs').addEventListener('click', function() {
                 document.getElementById('log-output').innerHTML = '';
-                logOffset = 0;
             });
 
             // 页面可见性变化
@@ -1295,12 +5847,29 @@ def create_templates():
                 const minutes = Math.floor((duration % 3600) / 60);
                 const seconds = duration % 60;
 
+                const progress = data.progress_info || {};
                 html += `
                     <div class="alert alert-info mt-3">
                         <i class="bi bi-info-circle"></i> 迁移已运行 ${hours}时 ${minutes}分 ${seconds}秒
+                        ${progress.eta_seconds != null ? `，预计剩余 ${formatDuration(progress.eta_seconds)}` : ''}
+                        ${progress.rows_per_sec ? `，${progress.rows_per_sec.toLocaleString()} 行/秒` : ''}
                         ${data.last_error ? `<br><strong>错误:</strong> ${data.last_error}` : ''}
                     </div>
                 `;
+
+                for (const [table, info] of Object.entries(progress.tables || {})) {
+                    const percent = info.rows_estimated ? Math.min(100, Math.round(info.rows_done * 100 / info.rows_estimated))
+                        : Math.round(info.days_done * 100 / Math.max(info.days_total, 1));
+                    html += `
+                        <div class="mb-2">
+                            <small>${table}: ${info.days_done}/${info.days_total} 天，${info.rows_done.toLocaleString()} 行
+                                ${info.eta_seconds != null ? `，剩余 ${formatDuration(info.eta_seconds)}` : ''}</small>
+                            <div class="progress">
+                                <div class="progress-bar ${info.days_failed ? 'bg-warning' : ''}" style="width: ${percent}%">${percent}%</div>
+                            </div>
+                        </div>
+                    `;
+                }
             }
 
             container.innerHTML = html;
@@ -1319,9 +5888,12 @@ def create_templates():
                 // 更新调度器状态
                 const schedulerStatus = document.getElementById('scheduler-status');
                 if (data.config.schedule_enabled) {
+                    const nextRuns = (data.scheduler?.next_runs || []).map(run =>
+                        `<li>${run.name} [${run.cron}] 下次: ${run.next_fire.replace('T', ' ')}</li>`).join('');
                     schedulerStatus.innerHTML = `
                         <div class="alert alert-success">
-                            <i class="bi bi-check-circle"></i> 定时任务已启用，每天 ${data.config.schedule_time} 执行
+                            <i class="bi bi-check-circle"></i> 定时任务已启用（${data.scheduler?.timezone || ''}）
+                            ${nextRuns ? `<ul class="mb-0 small">${nextRuns}</ul>` : ''}
                         </div>
                     `;
                     document.getElementById('btn-start-scheduler').disabled = true;
@@ -1341,11 +5913,10 @@ def create_templates():
         // 加载表格列表
         function loadTables() {
             const container = document.getElementById('tables-list');
-            const tables = ${json.dumps(list(zip(migration_app.SOURCE_TABLES, migration_app.TARGET_TABLES)))};
+            const tables = {{ table_mappings|tojson }};
 
             let html = '';
-            tables.forEach(([source, target], index) => {
-                const days = target === 'ods_query' ? 24 : 60;
+            tables.forEach(({source_table: source, target_table: target, days}, index) => {
                 html += `
                     <div class="form-check">
                         <input class="form-check-input table-checkbox" type="checkbox" 
@@ -1613,12 +6184,26 @@ def create_templates():
                     default: statusClass = 'status-idle';
                 }
 
+                let validationHtml = '-';
+                if (table.validation_status) {
+                    const detail = table.validation_detail ? JSON.parse(table.validation_detail) : {};
+                    const failedDays = (detail.days_failed || []).join(', ');
+                    if (table.validation_status === 'passed') {
+                        validationHtml = `<span class="status-success">通过</span> <small>(${detail.days_checked || 0} 天)</small>`;
+                    } else if (table.validation_status === 'unvalidated') {
+                        validationHtml = `<span class="status-idle">待回灌</span> <small>${(detail.days_pending || []).join(', ')}</small>`;
+                    } else {
+                        validationHtml = `<span class="status-failed">不一致</span> <small>${failedDays}</small>`;
+                    }
+                }
+
                 html += `
                     <tr>
                         <td><strong>${table.table_name}</strong></td>
                         <td>${lastSync}</td>
                         <td>${table.records_count?.toLocaleString() || 0}</td>
                         <td class="${statusClass}">${getStatusText(table.status)}</td>
+                        <td>${validationHtml}</td>
                         <td><small>${table.last_error || '-'}</small></td>
                     </tr>
                 `;
@@ -1629,24 +6214,35 @@ def create_templates():
 
         // 加载日志
         function loadLogs() {
-            // 这里可以添加日志API，暂时使用模拟数据
-            const logOutput = document.getElementById('log-output');
-            const now = new Date().toLocaleString('zh-CN');
-
-            // 模拟日志更新
-            if (Math.random() > 0.7) {
-                const messages = [
-                    `[${now}] INFO: 数据迁移任务正常执行中`,
-                    `[${now}] INFO: 已迁移 1000 条记录`,
-                    `[${now}] WARNING: 检测到网络延迟增加`,
-                    `[${now}] ERROR: 数据库连接超时，正在重试`,
-                    `[${now}] INFO: 重试成功，继续迁移`
-                ];
-
-                const randomMessage = messages[Math.floor(Math.random() * messages.length)];
-                logOutput.innerHTML += `<div>${randomMessage}</div>`;
-                logOutput.scrollTop = logOutput.scrollHeight;
-            }
+            // 从 /api/logs 增量读取内存中的最近日志
+            fetch(`/api/logs?after=${logOffset}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success || data.logs.length === 0) {
+                        logOffset = data.last || logOffset;
+                        return;
+                    }
+                    const logOutput = document.getElementById('log-output');
+                    data.logs.forEach(entry => {
+                        const line = document.createElement('div');
+                        line.textContent = `[${entry.time}] ${entry.level}: ${entry.message}`;
+                        if (entry.level === 'ERROR' || entry.level === 'CRITICAL') {
+                            line.className = 'text-danger';
+                        } else if (entry.level === 'WARNING') {
+                            line.className = 'text-warning';
+                        }
+                        logOutput.appendChild(line);
+                    });
+                    // 页面只保留最近500行
+                    while (logOutput.childElementCount > 500) {
+                        logOutput.removeChild(logOutput.firstChild);
+                    }
+                    logOffset = data.last;
+                    logOutput.scrollTop = logOutput.scrollHeight;
+                })
+                .catch(error => {
+                    console.error('Error loading logs:', error);
+                });
         }
 
         // 辅助函数
@@ -1743,6 +6339,10 @@ if __name__ == '__main__':
     # 初始化数据库
     init_db()
 
+    # 上次未完成的分区合并继续等待低峰窗口
+    if migration_app.get_optimize_pending():
+        migration_app.ensure_optimizer()
+
     # 启动Web服务器
     host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', 5000))
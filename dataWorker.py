@@ -0,0 +1,245 @@
+# dataWorker.py - 分布式迁移工作节点
+"""
+从协调端（运行 dataWeb.py 的服务）领取按天迁移任务的租约，在本机完成读取、转换与写入，
+定期续约并上报结果。多台机器同时运行即可把单机网络带宽上限分摊到多个节点。
+
+源库/目标库连接与表映射使用本机的配置（TABLE_MAPPINGS_FILE），迁移参数启动时从协调端同步。
+
+用法：
+  python dataWorker.py --coordinator http://10.0.0.1:5000
+  python dataWorker.py --coordinator http://10.0.0.1:5000 --threads 8 --worker-id etl-02
+  python dataWorker.py --coordinator http://127.0.0.1:5000 --exit-when-idle   # 本地测试
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# 工作节点只使用 DataMigrationApp 类，不创建 dataWeb 模块级的迁移实例
+os.environ.setdefault('MIGRATION_APP_DISABLED', '1')
+
+from dataWeb import SPILL_DIR, DataMigrationApp, MigrationTask, ThreadSafeCounter, logger  # noqa: E402
+
+# 与本机环境相关的配置不从协调端同步
+LOCAL_CONFIG_KEYS = ('spill_dir', 'export_dir', 'schedule_enabled', 'schedules', 'auto_start')
+
+
+class WorkerMigrationApp(DataMigrationApp):
+    """工作节点的迁移实例：记录每个任务的迁移行数供上报"""
+
+    def __init__(self, *args, worker_id: str = 'worker', **kwargs):
+        self.worker_id = worker_id
+        super().__init__(*args, **kwargs)
+        self.task_records: Dict[int, int] = {}
+
+    def _init_spill(self):
+        # 每个工作节点使用独立的落盘目录，不与同机的协调端或其它工作节点回灌同一批文件；
+        # 使用固定的 --worker-id 重启后才能继续回灌上次遗留的批次
+        name = re.sub(r'[^0-9A-Za-z_.-]', '_', self.worker_id)
+        self.config['spill_dir'] = str(Path(SPILL_DIR) / f"worker-{name}")
+        super()._init_spill()
+
+    def _finish_task(self, task: MigrationTask, records: int, validation: Optional[Dict[str, Any]] = None):
+        super()._finish_task(task, records, validation)
+        self.task_records[task.task_id] = records
+
+
+class RemoteWorker:
+    """领取租约 -> 执行任务 -> 上报结果；后台线程按租约有效期的1/6续约。
+
+    超过有效期的一半仍未续约成功时主动中止所有任务的写入（TaskRace.fence），
+    协调端在有效期之后还要再等 worker_lease_grace 秒才重新分配，重新执行的任务不会与本节点同时写入。
+    """
+
+    def __init__(self, coordinator: str, worker_id: str, threads: int, poll_interval: float,
+                 exit_when_idle: bool = False):
+        self.coordinator = coordinator.rstrip('/')
+        self.worker_id = worker_id
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+        self.app = WorkerMigrationApp(max_workers_per_table=1, schedule_enabled=False, worker_id=worker_id)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # 执行中的租约 {lease_id: task}；续约时协调端判定失效的租约
+        self.active: Dict[str, MigrationTask] = {}
+        self.lost = set()
+        self.ttl = 60.0
+        self.last_heartbeat = time.monotonic()
+        self.completed = ThreadSafeCounter()
+        self.records = ThreadSafeCounter()
+
+    def _request(self, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(payload, default=str).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(f"{self.coordinator}{path}", data=data,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def sync_config(self):
+        """同步协调端的迁移参数（批大小、传输模式、限流等）"""
+        config = self._request('/api/config')
+        for key, value in config.items():
+            if key in self.app.config and key not in LOCAL_CONFIG_KEYS:
+                self.app.set_config(key, value)
+
+    def run(self) -> int:
+        self.sync_config()
+        logger.info(f"Worker {self.worker_id} started with {self.threads} threads, coordinator {self.coordinator}")
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="Heartbeat", daemon=True)
+        heartbeat.start()
+        workers = [threading.Thread(target=self._work_loop, name=f"RemoteWorker-{index}", daemon=True)
+                   for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        try:
+            for thread in workers:
+                while thread.is_alive():
+                    thread.join(timeout=1.0)
+        except KeyboardInterrupt:
+            logger.info("Interrupted, stopping worker")
+            self.stop_event.set()
+            self.app.shutdown()
+        self.stop_event.set()
+        logger.info(f"Worker {self.worker_id} finished {self.completed.get()} tasks, {self.records.get()} records")
+        return 0
+
+    def _work_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                response = self._request('/api/worker/lease', {'worker': self.worker_id})
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                logger.warning(f"Error requesting lease from coordinator: {str(e)}")
+                self.stop_event.wait(self.poll_interval)
+                continue
+            lease = response.get('lease')
+            if lease is None:
+                if self.exit_when_idle and not response.get('running'):
+                    with self.lock:
+                        if not self.active:
+                            self.stop_event.set()
+                            break
+                self.stop_event.wait(self.poll_interval)
+                continue
+            try:
+                self.run_lease(lease)
+            except Exception as e:
+                # 任何未预料的错误都不能结束工作线程，租约交还协调端立即重新分配
+                logger.error(f"Error running lease {lease.get('lease_id')}: {str(e)}")
+                with self.lock:
+                    self.active.pop(lease.get('lease_id'), None)
+                    self.lost.discard(lease.get('lease_id'))
+                self.app.reset_thread_connections()
+                self._report(lease, {'records': 0, 'error': f"worker error: {str(e)}", 'requeue': True})
+                self.stop_event.wait(self.poll_interval)
+
+    def run_lease(self, lease: Dict[str, Any]):
+        """执行一个租约任务（重试由 execute_task_with_retry 完成）并上报结果"""
+        table = lease['target_table']
+        self.ttl = float(lease.get('ttl') or self.ttl)
+        try:
+            # 结构检查要连接源库和目标库，临时故障时交还租约，由协调端立即重新分配
+            task = MigrationTask(lease['source_table'], table, lease['day'], lease['date'],
+                                 self.app.get_table_columns(table), task_id=lease['task_id'],
+                                 priority=lease['priority'], table_index=lease['table_index'])
+        except Exception as e:
+            logger.error(f"Error preparing {table} {lease['date']} (lease {lease['lease_id']}): {str(e)}")
+            self.app.reset_thread_connections()
+            self._report(lease, {'records': 0, 'error': f"setup failed: {str(e)}", 'requeue': True})
+            # 故障持续时不立刻领取下一个租约
+            self.stop_event.wait(self.poll_interval)
+            return
+        self.app.table_records.setdefault(table, ThreadSafeCounter())
+        self.app.progress.register(table, task.date_str)
+        with self.lock:
+            self.active[lease['lease_id']] = task
+
+        success = self.app.execute_task_with_retry(task)
+
+        with self.lock:
+            self.active.pop(lease['lease_id'], None)
+            lost = lease['lease_id'] in self.lost
+            self.lost.discard(lease['lease_id'])
+        records = self.app.task_records.pop(task.task_id, 0)
+        validation = self.app.validation_results.get(table, {}).pop(task.date_str, None)
+        if lost:
+            logger.warning(f"{task} lease {lease['lease_id']} was revoked, result not reported")
+            return
+
+        accepted = self._report(lease, {'records': records, 'validation': validation, 'trace': task.trace.to_dict(),
+                                        'error': None if success else (self.app.last_error or 'failed')})
+        if accepted and success:
+            self.completed.increment()
+            self.records.increment(records)
+
+    def _report(self, lease: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        """向协调端上报租约结果，返回是否被接受（租约已失效时为False）"""
+        payload = {'worker': self.worker_id, 'lease_id': lease['lease_id'], **result}
+        for attempt in range(3):
+            try:
+                return bool(self._request('/api/worker/complete', payload).get('success'))
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                logger.warning(f"Error reporting lease {lease['lease_id']} (attempt {attempt + 1}/3): {str(e)}")
+                self.stop_event.wait(2 ** attempt)
+        # 上报失败时租约到期后由协调端重新分配（按天重写是幂等的）
+        logger.error(f"Lease {lease['lease_id']} result could not be reported, coordinator will requeue it")
+        return False
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(max(self.ttl / 6, 1.0)):
+            with self.lock:
+                leases = {lease_id: self._rows_done(task) for lease_id, task in self.active.items()}
+            if not leases:
+                self.last_heartbeat = time.monotonic()
+                continue
+            try:
+                lost = self._request('/api/worker/heartbeat', {'worker': self.worker_id, 'leases': leases})['lost']
+                self.last_heartbeat = time.monotonic()
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+                logger.warning(f"Heartbeat failed: {str(e)}")
+                if time.monotonic() - self.last_heartbeat < self.ttl / 2:
+                    continue
+                # 有效期过半仍联系不上协调端：在协调端收回租约之前主动中止
+                lost = list(leases)
+            for lease_id in lost:
+                self.revoke(lease_id)
+
+    def _rows_done(self, task: MigrationTask) -> int:
+        progress = self.app.progress.get(task.target_table, task.date_str)
+        return progress.rows_done if progress is not None else 0
+
+    def revoke(self, lease_id: str):
+        """租约失效：中止任务，之后的读取和写入都会取消（已提交的文件导入/增量写入也一样）"""
+        with self.lock:
+            task = self.active.get(lease_id)
+            if task is None:
+                return
+            self.lost.add(lease_id)
+        logger.warning(f"{task} lease {lease_id} lost, cancelling")
+        task.race.fence()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed data migration worker')
+    parser.add_argument('--coordinator', required=True, help='coordinator URL, e.g. http://10.0.0.1:5000')
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}:{os.getpid()}")
+    parser.add_argument('--threads', type=int, default=4, help='tasks executed concurrently')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='seconds between lease requests when idle')
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help='exit once the coordinator has no running migration')
+    args = parser.parse_args()
+
+    worker = RemoteWorker(args.coordinator, args.worker_id, args.threads, args.poll_interval, args.exit_when_idle)
+    return worker.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""映射文件 sources 段：连接参数之外的源配置项不能传给pymysql"""
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pymysql
+import pytest
+
+os.environ.setdefault('SPILL_DIR', tempfile.mkdtemp(prefix='sources_test_spill_'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dataWeb import DataMigrationApp, SourceShard, load_source_profiles  # noqa: E402
+
+SOURCES = {
+    'default': {'clickhouse_named_collection': 'mysql_main'},
+    'eu': {'host': 'eu-db.example.com', 'max_concurrency': 2, 'clickhouse_named_collection': 'mysql_eu',
+           'replicas': [{'host': 'eu-replica.example.com'}]},
+    'us': {'host': 'us-db.example.com'},
+}
+
+
+class OfflineApp(DataMigrationApp):
+    def _init_spill(self):
+        self.spill = None
+
+
+@pytest.fixture
+def migration(tmp_path):
+    mapping_file = tmp_path / 'mappings.json'
+    mapping_file.write_text(json.dumps({'sources': SOURCES, 'tables': []}), encoding='utf-8')
+    app = OfflineApp(max_workers_per_table=1)
+    app._init_source_profiles(load_source_profiles(str(mapping_file)))
+    yield app
+    app.shutdown()
+
+
+def test_pushdown_source_opens_mysql_connection(migration, monkeypatch):
+    opened = []
+    real_connect = pymysql.connect
+
+    def connect(**kwargs):
+        # defer_connect 只构造连接对象，不访问网络；多余的参数会在这里抛出TypeError
+        connection = real_connect(defer_connect=True, **kwargs)
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(pymysql, 'connect', connect)
+    for profile in ('default', 'eu', 'eu@eu-replica.example.com:3306', 'us'):
+        migration._create_mysql_connection(profile)
+        migration._create_mysql_connection(profile, decoders='float')
+
+    assert len(opened) == 8
+    assert opened[2].host == 'eu-db.example.com'
+
+
+def test_pushdown_uses_named_collection_of_the_source(migration):
+    assert migration._mysql_table_function(SourceShard('default', 'orders')) == "mysql(mysql_main, table = 'orders')"
+    assert migration._mysql_table_function(SourceShard('eu', 'orders_eu')) == "mysql(mysql_eu, table = 'orders_eu')"
+    with pytest.raises(ValueError, match='clickhouse_named_collection'):
+        migration._mysql_table_function(SourceShard('us', 'orders'))